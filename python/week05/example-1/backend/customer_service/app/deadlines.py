@@ -0,0 +1,147 @@
+# week05/example-1/backend/customer_service/app/deadlines.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .db import get_db, get_read_db
+from .metrics import APP_NAME, DB_CANCELLED_QUERIES
+
+logger = logging.getLogger(__name__)
+
+# --- Statement Budget Configuration ---
+# Callers send the absolute Unix time (seconds) after which they stop waiting
+DEADLINE_HEADER = "X-Request-Deadline"
+# statement_timeout per kind of route, in milliseconds; a propagated deadline
+# can only shorten these
+LOOKUP_STATEMENT_TIMEOUT_MS = int(os.getenv("LOOKUP_STATEMENT_TIMEOUT_MS", "1000"))
+LIST_STATEMENT_TIMEOUT_MS = int(os.getenv("LIST_STATEMENT_TIMEOUT_MS", "3000"))
+WRITE_STATEMENT_TIMEOUT_MS = int(os.getenv("WRITE_STATEMENT_TIMEOUT_MS", "5000"))
+# How often an in-flight request checks for a disconnected client
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.1"))
+
+
+def parse_deadline(request: Request) -> Optional[float]:
+    value = request.headers.get(DEADLINE_HEADER)
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def is_query_canceled(error: OperationalError) -> bool:
+    # SQLSTATE 57014: statement_timeout, or a cancel request (psycopg2 calls it
+    # pgcode, psycopg 3 sqlstate)
+    sqlstate = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    return sqlstate == "57014"
+
+
+class QueryCanceller:
+    """
+    Tracks the connection a request's session is using so another thread can
+    cancel its running statement. The lock keeps the connection from going back
+    to the pool (and to another request) while a cancel is being sent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dbapi_connection = None
+        self.reason: Optional[str] = None
+
+    def attach(self, dbapi_connection):
+        with self._lock:
+            self._dbapi_connection = dbapi_connection
+
+    def detach(self):
+        with self._lock:
+            self._dbapi_connection = None
+
+    def cancel(self, reason: str):
+        with self._lock:
+            self.reason = reason
+            if self._dbapi_connection is not None:
+                # The driver sends a cancel request on a separate socket
+                self._dbapi_connection.cancel()
+
+
+async def cancel_when_abandoned(
+    request: Request, deadline: Optional[float], canceller: QueryCanceller
+):
+    """Cancels the request's query once the client disconnects or its deadline passes."""
+    while True:
+        if await request.is_disconnected():
+            reason = "client_disconnected"
+            break
+        if deadline is not None and time.time() >= deadline:
+            reason = "deadline_expired"
+            break
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+    await run_in_threadpool(canceller.cancel, reason)
+
+
+def bounded_session(timeout_ms: int, read_only: bool = False):
+    """
+    Dependency factory: a session whose statements run under
+    SET LOCAL statement_timeout (the smaller of timeout_ms and the time left
+    before the caller's deadline), and whose running query is cancelled when
+    the client goes away. Cancelled queries become 504 responses.
+    """
+    source = get_read_db if read_only else get_db
+
+    async def dependency(request: Request, db: Session = Depends(source)):
+        route = getattr(request.scope.get("route"), "path", request.url.path)
+        deadline = parse_deadline(request)
+        if deadline is not None and deadline <= time.time():
+            DB_CANCELLED_QUERIES.labels(
+                app_name=APP_NAME, route=route, reason="deadline_expired"
+            ).inc()
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Request deadline already passed.",
+            )
+
+        canceller = QueryCanceller()
+
+        def after_begin(session, transaction, connection):
+            budget_ms = timeout_ms
+            if deadline is not None:
+                budget_ms = max(1, min(budget_ms, int((deadline - time.time()) * 1000)))
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {budget_ms}")
+            canceller.attach(connection.connection.dbapi_connection)
+
+        def after_transaction_end(session, transaction):
+            canceller.detach()
+
+        event.listen(db, "after_begin", after_begin)
+        event.listen(db, "after_transaction_end", after_transaction_end)
+        watcher = asyncio.create_task(cancel_when_abandoned(request, deadline, canceller))
+        try:
+            yield db
+        except OperationalError as e:
+            if not is_query_canceled(e):
+                raise
+            reason = canceller.reason or "statement_timeout"
+            DB_CANCELLED_QUERIES.labels(app_name=APP_NAME, route=route, reason=reason).inc()
+            logger.warning(
+                f"Customer Service: Cancelled database query for {request.method} {route} ({reason})."
+            )
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Database query timed out or was cancelled.",
+            )
+        finally:
+            watcher.cancel()
+            canceller.detach()
+            event.remove(db, "after_begin", after_begin)
+            event.remove(db, "after_transaction_end", after_transaction_end)
+
+    return dependency
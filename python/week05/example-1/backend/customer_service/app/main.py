@@ -6,12 +6,30 @@ import sys
 import time
 from typing import List, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
+import pydantic_core
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import generate_latest
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
-
-from .db import Base, engine, get_db
+from starlette.responses import PlainTextResponse
+
+from .db import (
+    CONSISTENCY_TOKEN_HEADER,
+    Base,
+    engine,
+    replica_status,
+    track_write_position,
+)
+from .deadlines import (
+    LIST_STATEMENT_TIMEOUT_MS,
+    LOOKUP_STATEMENT_TIMEOUT_MS,
+    WRITE_STATEMENT_TIMEOUT_MS,
+    bounded_session,
+    is_query_canceled,
+)
+from .metrics import registry
 from .models import Customer
 from .schemas import CustomerCreate, CustomerResponse, CustomerUpdate
 
@@ -50,6 +68,21 @@ app.add_middleware(
 )
 
 
+# --- Middleware for Read-Your-Writes Tokens ---
+@app.middleware("http")
+async def add_consistency_token(request: Request, call_next):
+    # Clients echo the token on later reads so the replica is only used once it
+    # has replayed this write; only needed when a replica is configured. The
+    # position is captured when a write commits (see track_write_position)
+    if replica_status is None:
+        return await call_next(request)
+    with track_write_position() as position:
+        response = await call_next(request)
+    if position["lsn"] is not None and response.status_code < 400:
+        response.headers[CONSISTENCY_TOKEN_HEADER] = position["lsn"]
+    return response
+
+
 # --- FastAPI Event Handlers ---
 @app.on_event("startup")
 async def startup_event():
@@ -97,6 +130,12 @@ async def health_check():
     return {"status": "ok", "service": "customer-service"}
 
 
+# --- Prometheus Metrics Endpoint ---
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus metrics endpoint")
+async def metrics():
+    return PlainTextResponse(generate_latest(registry))
+
+
 # --- CRUD Endpoints for Customers ---
 @app.post(
     "/customers/",
@@ -104,7 +143,10 @@ async def health_check():
     status_code=status.HTTP_201_CREATED,
     summary="Create a new customer",
 )
-async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db)):
+async def create_customer(
+    customer: CustomerCreate,
+    db: Session = Depends(bounded_session(WRITE_STATEMENT_TIMEOUT_MS)),
+):
     logger.info(f"Customer Service: Creating customer with email: {customer.email}")
     db_customer = Customer(
         email=customer.email,
@@ -133,6 +175,8 @@ async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db
         )
     except Exception as e:
         db.rollback()
+        if isinstance(e, OperationalError) and is_query_canceled(e):
+            raise  # Reported as 504 by bounded_session
         logger.error(f"Customer Service: Error creating customer: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -140,13 +184,26 @@ async def create_customer(customer: CustomerCreate, db: Session = Depends(get_db
         )
 
 
+# Columns returned by CustomerResponse (never the password hash)
+CUSTOMER_LIST_COLUMNS = (
+    Customer.email,
+    Customer.first_name,
+    Customer.last_name,
+    Customer.phone_number,
+    Customer.shipping_address,
+    Customer.customer_id,
+    Customer.created_at,
+    Customer.updated_at,
+)
+
+
 @app.get(
     "/customers/",
     response_model=List[CustomerResponse],
     summary="Retrieve a list of all customers",
 )
 def list_customers(
-    db: Session = Depends(get_db),
+    db: Session = Depends(bounded_session(LIST_STATEMENT_TIMEOUT_MS, read_only=True)),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     search: Optional[str] = Query(None, max_length=255),
@@ -154,21 +211,23 @@ def list_customers(
     logger.info(
         f"Customer Service: Listing customers with skip={skip}, limit={limit}, search='{search}'"
     )
-    query = db.query(Customer)
+    # Read-only fast path: plain rows straight to JSON bytes, without ORM objects
+    # in the identity map or CustomerResponse validation per row
+    query = select(*CUSTOMER_LIST_COLUMNS)
     if search:
         search_pattern = f"%{search}%"
         logger.info(f"Customer Service: Applying search filter for term: {search}")
-        query = query.filter(
+        query = query.where(
             (Customer.first_name.ilike(search_pattern))
             | (Customer.last_name.ilike(search_pattern))
             | (Customer.email.ilike(search_pattern))
         )
-    customers = query.offset(skip).limit(limit).all()
+    customers = [row._asdict() for row in db.execute(query.offset(skip).limit(limit))]
 
     logger.info(
         f"Customer Service: Retrieved {len(customers)} customers (skip={skip}, limit={limit})."
     )
-    return customers
+    return Response(content=pydantic_core.to_json(customers), media_type="application/json")
 
 
 @app.get(
@@ -176,7 +235,10 @@ def list_customers(
     response_model=CustomerResponse,
     summary="Retrieve a single customer by ID",
 )
-def get_customer(customer_id: int, db: Session = Depends(get_db)):
+def get_customer(
+    customer_id: int,
+    db: Session = Depends(bounded_session(LOOKUP_STATEMENT_TIMEOUT_MS, read_only=True)),
+):
     """
     Retrieves details for a specific customer using their unique ID.
     """
@@ -200,7 +262,9 @@ def get_customer(customer_id: int, db: Session = Depends(get_db)):
     summary="Update an existing customer by ID",
 )
 async def update_customer(
-    customer_id: int, customer_data: CustomerUpdate, db: Session = Depends(get_db)
+    customer_id: int,
+    customer_data: CustomerUpdate,
+    db: Session = Depends(bounded_session(WRITE_STATEMENT_TIMEOUT_MS)),
 ):
     """
     Updates an existing customer's details. Only provided fields will be updated.
@@ -247,6 +311,8 @@ async def update_customer(
         )
     except Exception as e:
         db.rollback()
+        if isinstance(e, OperationalError) and is_query_canceled(e):
+            raise  # Reported as 504 by bounded_session
         logger.error(
             f"Customer Service: Error updating customer {customer_id}: {e}",
             exc_info=True,
@@ -262,7 +328,9 @@ async def update_customer(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Delete a customer by ID",
 )
-def delete_customer(customer_id: int, db: Session = Depends(get_db)):
+def delete_customer(
+    customer_id: int, db: Session = Depends(bounded_session(WRITE_STATEMENT_TIMEOUT_MS))
+):
     """
     Deletes a customer record from the database.
     """
@@ -286,6 +354,8 @@ def delete_customer(customer_id: int, db: Session = Depends(get_db)):
         )
     except Exception as e:
         db.rollback()
+        if isinstance(e, OperationalError) and is_query_canceled(e):
+            raise  # Reported as 504 by bounded_session
         logger.error(
             f"Customer Service: Error deleting customer {customer_id}: {e}",
             exc_info=True,
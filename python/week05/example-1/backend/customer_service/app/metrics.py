@@ -0,0 +1,65 @@
+# week05/example-1/backend/customer_service/app/metrics.py
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CollectorRegistry
+
+# --- Prometheus Metrics Initialization ---
+# Create a custom registry specific to this application instance
+registry = CollectorRegistry()
+APP_NAME = "customer_service"  # Unique identifier for this service in metrics
+
+# --- Database Connection Pool Metrics ---
+# Labelled by pool ("api" for request handlers, "consumer" for RabbitMQ consumers)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out of the pool",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections open beyond pool_size (counted against max_overflow)",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["app_name", "pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+    registry=registry,
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout seconds",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_INVALIDATIONS = Counter(
+    "db_pool_invalidations_total",
+    "Connections invalidated (hard: closed after an error; soft: replaced on next checkout)",
+    ["app_name", "pool", "kind"],
+    registry=registry,
+)
+
+# --- Read Replica Metrics ---
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total",
+    "Read-only requests by the database they were sent to, and why",
+    ["app_name", "target", "reason"],
+    registry=registry,
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "Replication lag of the read replica at its last status check",
+    ["app_name"],
+    registry=registry,
+)
+
+# --- Query Cancellation Metrics ---
+DB_CANCELLED_QUERIES = Counter(
+    "db_cancelled_queries_total",
+    "Requests whose database work was cut short, by reason (statement_timeout, deadline_expired, client_disconnected)",
+    ["app_name", "route", "reason"],
+    registry=registry,
+)
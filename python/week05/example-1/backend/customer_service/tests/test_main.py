@@ -1,15 +1,33 @@
 # week05/example-1/backend/customer_service/tests/test_main.py
 
 import logging
+import threading
 import time
+from unittest.mock import patch
 
 import pytest
-from app.db import Base, SessionLocal, engine, get_db
+from app.db import (
+    DATABASE_URL,
+    Base,
+    InstrumentedQueuePool,
+    ReplicaStatus,
+    SessionLocal,
+    engine,
+    get_db,
+    parse_lsn,
+    track_write_position,
+)
+from app.deadlines import DEADLINE_HEADER, bounded_session
 from app.main import app
+from app.metrics import registry
 from app.models import Customer
 
+from fastapi import Depends, FastAPI
 from fastapi.testclient import TestClient
+from prometheus_client import generate_latest
+from sqlalchemy import create_engine, text
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import Session
 
 # Suppress noisy logs from SQLAlchemy/FastAPI/Uvicorn during tests for cleaner output
@@ -232,3 +250,172 @@ def test_delete_customer_not_found(client: TestClient):
     response = client.delete("/customers/999999")
     assert response.status_code == 404
     assert response.json()["detail"] == "Customer not found"
+
+
+def test_pool_metrics_record_checkouts_and_timeouts(client: TestClient):
+    """The instrumented pool exports checked-out connections, wait times and timeouts."""
+    pool_engine = create_engine(
+        DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+        pool_logging_name="pool-test",
+    )
+    try:
+        with pool_engine.connect():
+            with pytest.raises(PoolTimeoutError):
+                pool_engine.connect()
+            metrics_text = client.get("/metrics").text
+            assert (
+                'db_pool_checked_out_connections{app_name="customer_service",pool="pool-test"} 1.0'
+                in metrics_text
+            )
+    finally:
+        pool_engine.dispose()
+
+    metrics_text = client.get("/metrics").text
+    assert (
+        'db_pool_checked_out_connections{app_name="customer_service",pool="pool-test"} 0.0'
+        in metrics_text
+    )
+    assert (
+        'db_pool_checkout_timeouts_total{app_name="customer_service",pool="pool-test"} 1.0'
+        in metrics_text
+    )
+    assert (
+        'db_pool_checkout_wait_seconds_count{app_name="customer_service",pool="pool-test"} 2.0'
+        in metrics_text
+    )
+
+
+def test_replica_status_routes_reads_by_lag_and_consistency_token():
+    """Reads fall back to the primary when the replica lags or hasn't replayed a client's write."""
+    # The primary stands in for the replica: it reports its own WAL position and no lag
+    status = ReplicaStatus(engine)
+    with engine.connect() as connection:
+        primary_lsn = connection.execute(text("SELECT pg_current_wal_lsn()::text")).scalar_one()
+    assert status.choose(None) == "replica"
+    assert status.replay_lsn >= parse_lsn(primary_lsn)
+
+    ahead = status.replay_lsn + (1 << 40)
+    assert status.choose(f"{ahead >> 32:X}/{ahead & 0xFFFFFFFF:X}") == "replica_behind_token"
+    assert status.choose("not-an-lsn") == "invalid_token"
+
+    status.lag_seconds = 3600.0
+    assert status.choose(None) == "replica_lagging"
+    assert parse_lsn("16/B374D848") == (0x16 << 32) | 0xB374D848
+
+
+def test_consistency_token_is_captured_only_when_a_write_commits(
+    client: TestClient, db_session_for_test: Session
+):
+    """Writes return the WAL position read at commit; requests that wrote nothing get no token."""
+    with track_write_position() as position:
+        db_session_for_test.execute(text("SELECT 1"))
+        db_session_for_test.commit()
+    assert position["lsn"] is None
+
+    with patch("app.main.replica_status", ReplicaStatus(engine)):
+        response = client.post(
+            "/customers/",
+            json={
+                "email": "token@example.com",
+                "password": "tokenpassword",
+                "first_name": "Toke",
+                "last_name": "N",
+            },
+        )
+        assert response.status_code == 201
+        token = response.headers["X-DB-Consistency-Token"]
+        with engine.connect() as connection:
+            primary_lsn = connection.execute(text("SELECT pg_current_wal_lsn()::text")).scalar_one()
+        assert parse_lsn(token) <= parse_lsn(primary_lsn)
+
+        # A rejected write gets no token
+        duplicate = client.post(
+            "/customers/",
+            json={
+                "email": "token@example.com",
+                "password": "tokenpassword",
+                "first_name": "Toke",
+                "last_name": "N",
+            },
+        )
+        assert duplicate.status_code == 400
+        assert "X-DB-Consistency-Token" not in duplicate.headers
+
+
+def test_replica_status_refresh_is_shared_by_concurrent_requests():
+    """Requests finding the status stale at the same time wait for one check instead of each running one."""
+    status = ReplicaStatus(engine)
+    checks = []
+    original_refresh = status.refresh
+
+    def slow_refresh():
+        checks.append(threading.get_ident())
+        time.sleep(0.2)
+        original_refresh()
+
+    status.refresh = slow_refresh
+    start = threading.Barrier(8)
+    results = []
+
+    def read():
+        start.wait()
+        results.append(status.choose(None))
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["replica"] * 8
+    assert len(checks) == 1
+
+
+def test_list_customers_fast_path_matches_single_customer_response(
+    client: TestClient, db_session_for_test: Session
+):
+    """Customers listed from Core rows serialize exactly like the ORM-backed single-customer route."""
+    created = client.post(
+        "/customers/",
+        json={
+            "email": "fastpath@example.com",
+            "password": "fastpassword",
+            "first_name": "Fay",
+            "last_name": "Path",
+        },
+    ).json()
+
+    response = client.get("/customers/", params={"search": "fastpath@"})
+    assert response.status_code == 200
+    assert response.json() == [client.get(f"/customers/{created['customer_id']}").json()]
+    assert "password_hash" not in response.json()[0]
+
+
+def test_bounded_session_turns_statement_timeout_into_504():
+    """A statement running past the route's budget is cancelled by PostgreSQL and reported as a 504."""
+    slow_app = FastAPI()
+
+    @slow_app.get("/slow")
+    def slow(db: Session = Depends(bounded_session(100))):
+        db.execute(text("SELECT pg_sleep(2)"))
+        return {"finished": True}
+
+    started = time.perf_counter()
+    with TestClient(slow_app) as slow_client:
+        response = slow_client.get("/slow")
+    assert response.status_code == 504
+    assert time.perf_counter() - started < 1.5
+    assert (
+        'db_cancelled_queries_total{app_name="customer_service",reason="statement_timeout",route="/slow"}'
+        in generate_latest(registry).decode()
+    )
+
+
+def test_expired_request_deadline_is_rejected_before_querying(client: TestClient):
+    """A caller that has already given up gets a 504 without the route touching the database."""
+    response = client.get("/customers/1", headers={DEADLINE_HEADER: f"{time.time() - 1:.3f}"})
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Request deadline already passed."
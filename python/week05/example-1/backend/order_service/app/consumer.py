@@ -0,0 +1,68 @@
+# week05/example-1/backend/order_service/app/consumer.py
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .metrics import (
+    APP_NAME,
+    CONSUMER_EXECUTOR_ACTIVE,
+    CONSUMER_EXECUTOR_QUEUED,
+    CONSUMER_EXECUTOR_WORKERS,
+    CONSUMER_TASK_DURATION,
+    CONSUMER_TASK_WAIT,
+)
+
+# --- Consumer Executor Configuration ---
+# Threads running blocking database work for RabbitMQ messages
+CONSUMER_DB_WORKERS = int(os.getenv("CONSUMER_DB_WORKERS", "2"))
+# Unacknowledged messages RabbitMQ hands us at once; anything beyond this stays
+# in the broker instead of piling up as queued executor tasks
+CONSUMER_PREFETCH_COUNT = int(
+    os.getenv("CONSUMER_PREFETCH_COUNT", str(CONSUMER_DB_WORKERS * 2))
+)
+
+
+class ConsumerExecutor:
+    """
+    Bounded thread pool for the synchronous database work of message handlers,
+    so a slow query never blocks the event loop serving HTTP requests.
+    Queue depth, busy threads and wait/run times are exported as metrics.
+    """
+
+    def __init__(self, max_workers: int = CONSUMER_DB_WORKERS):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        CONSUMER_EXECUTOR_WORKERS.labels(app_name=APP_NAME).set(max_workers)
+
+    async def run(self, label: str, fn: Callable, *args):
+        """Runs fn(*args) on a worker thread and returns its result."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="order-consumer-db"
+            )
+        submitted = time.perf_counter()
+        CONSUMER_EXECUTOR_QUEUED.labels(app_name=APP_NAME).inc()
+
+        def call():
+            started = time.perf_counter()
+            CONSUMER_EXECUTOR_QUEUED.labels(app_name=APP_NAME).dec()
+            CONSUMER_EXECUTOR_ACTIVE.labels(app_name=APP_NAME).inc()
+            CONSUMER_TASK_WAIT.labels(app_name=APP_NAME).observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                CONSUMER_EXECUTOR_ACTIVE.labels(app_name=APP_NAME).dec()
+                CONSUMER_TASK_DURATION.labels(
+                    app_name=APP_NAME, routing_key=label
+                ).observe(time.perf_counter() - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def shutdown(self):
+        """Waits for running tasks; a later run() starts a fresh pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
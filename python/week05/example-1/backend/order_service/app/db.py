@@ -1,10 +1,38 @@
 # week05/example-1/backend/order_service/app/db.py
 
+import contextlib
+import contextvars
+import logging
 import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
 
-from sqlalchemy import create_engine
+from fastapi import Depends, Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from .ids import SHARD_BITS, id_shard
+from .metrics import (
+    APP_NAME,
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_CHECKOUT_TIMEOUTS,
+    DB_POOL_CHECKOUT_WAIT,
+    DB_POOL_INVALIDATIONS,
+    DB_POOL_OVERFLOW,
+    DB_READ_ROUTING,
+    DB_REPLICA_LAG,
+)
+from .querystats import instrument_statements
+
+logger = logging.getLogger(__name__)
 
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
@@ -12,13 +40,293 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "orders")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 
+# SQLAlchemy driver for PostgreSQL; psycopg (3) enables pipelined writes (see writes.py)
+DB_DRIVER = os.getenv("DB_DRIVER", "psycopg")
+
 DATABASE_URL = (
-    f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
+    f"postgresql+{DB_DRIVER}://{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
     f"{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# --- Sharding Configuration ---
+# Comma-separated DSNs, one per order shard (shard 0 first); unset, the service
+# runs on a single shard at DATABASE_URL
+ORDER_SHARD_DATABASE_URLS = [
+    url.strip()
+    for url in os.getenv("ORDER_SHARD_DATABASE_URLS", "").split(",")
+    if url.strip()
+] or [DATABASE_URL]
+# Order ids carry their shard in their low bits (see ids.py), which caps the
+# number of shards
+ORDER_ID_SHARD_SLOTS = 1 << SHARD_BITS
+
+# --- Connection Pool Configuration ---
+# Every worker process has its own pool, so the database sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections from this service
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+# Connections older than this are replaced on checkout (-1 disables)
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+# Tests each connection with a lightweight query before handing it out
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool that exports checked-out and overflow connections and how long
+    checkouts wait, labelled by the pool's logging name.
+    """
+
+    def _do_get(self):
+        pool_name = self.logging_name or "default"
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.labels(app_name=APP_NAME, pool=pool_name).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(app_name=APP_NAME, pool=pool_name).observe(
+                time.perf_counter() - started
+            )
+        self._record_usage(pool_name)
+        return record
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._record_usage(self.logging_name or "default")
+
+    def _record_usage(self, pool_name: str):
+        DB_POOL_CHECKED_OUT.labels(app_name=APP_NAME, pool=pool_name).set(
+            self.checkedout()
+        )
+        DB_POOL_OVERFLOW.labels(app_name=APP_NAME, pool=pool_name).set(
+            max(self.overflow(), 0)
+        )
+
+
+def count_invalidations(engine, pool_name: str):
+    """Counts connections the pool discards, e.g. after a failed pre-ping or a dropped connection."""
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        DB_POOL_INVALIDATIONS.labels(
+            app_name=APP_NAME, pool=pool_name, kind="hard"
+        ).inc()
+
+    @event.listens_for(engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        DB_POOL_INVALIDATIONS.labels(
+            app_name=APP_NAME, pool=pool_name, kind="soft"
+        ).inc()
+
+
+engine = create_engine(
+    ORDER_SHARD_DATABASE_URLS[0],
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_logging_name="api",
+)
+count_invalidations(engine, "api")
+instrument_statements(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# --- Consumer Engine ---
+# RabbitMQ consumers use their own small pool, so a burst of stock events cannot
+# take the connections API requests need (and a busy API cannot starve them)
+CONSUMER_DB_POOL_SIZE = int(os.getenv("CONSUMER_DB_POOL_SIZE", "2"))
+consumer_engine = create_engine(
+    ORDER_SHARD_DATABASE_URLS[0],
+    poolclass=InstrumentedQueuePool,
+    pool_size=CONSUMER_DB_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_logging_name="consumer",
+)
+count_invalidations(consumer_engine, "consumer")
+instrument_statements(consumer_engine)
+ConsumerSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, bind=consumer_engine
+)
+
+# --- Read Replica ---
+# Optional streaming replica for read-only routes; unset, every read uses the primary
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+# Reads fall back to the primary while the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# How long a replica status check is reused before querying it again
+REPLICA_STATUS_TTL_SECONDS = float(os.getenv("REPLICA_STATUS_TTL_SECONDS", "1"))
+# Write responses carry the primary's WAL position in this header; clients send it
+# back on reads that must see their own writes
+CONSISTENCY_TOKEN_HEADER = "X-DB-Consistency-Token"
+
+# Replay position and lag (0 when everything received has been replayed). On a
+# server that is not in recovery the current WAL position is reported instead,
+# so pointing REPLICA_DATABASE_URL at the primary is harmless.
+REPLICA_STATUS_SQL = text(
+    """
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+             ELSE pg_current_wal_lsn() END::text,
+        CASE WHEN NOT pg_is_in_recovery()
+               OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """
+)
+
+
+def parse_lsn(lsn: Optional[str]) -> Optional[int]:
+    """Converts a PostgreSQL LSN ("16/B374D848") to an integer, or None if malformed."""
+    if not lsn:
+        return None
+    high, _, low = lsn.partition("/")
+    try:
+        return (int(high, 16) << 32) | int(low, 16)
+    except ValueError:
+        return None
+
+
+class ReplicaStatus:
+    """Replication state of the read replica, refreshed at most every REPLICA_STATUS_TTL_SECONDS."""
+
+    def __init__(self, replica_engine):
+        self.engine = replica_engine
+        self.replay_lsn: Optional[int] = None
+        self.lag_seconds: Optional[float] = None  # None while the replica is unreachable
+        self.checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        try:
+            with self.engine.connect() as connection:
+                lsn, lag = connection.execute(REPLICA_STATUS_SQL).one()
+            self.replay_lsn = parse_lsn(lsn)
+            self.lag_seconds = float(lag)
+            DB_REPLICA_LAG.labels(app_name=APP_NAME).set(self.lag_seconds)
+        except (OperationalError, PoolTimeoutError) as e:
+            logger.warning(f"Order Service: Read replica status check failed: {e}")
+            self.replay_lsn = self.lag_seconds = None
+        self.checked_at = time.monotonic()
+
+    def refresh_unless_checked_since(self, moment: float):
+        """
+        Refreshes unless a check finished after moment. Requests that find the
+        status stale together wait for one check instead of each running their own.
+        """
+        with self._refresh_lock:
+            if self.checked_at <= moment:
+                self.refresh()
+
+    def choose(self, consistency_token: Optional[str]) -> str:
+        """Returns "replica", or the reason the read has to go to the primary."""
+        now = time.monotonic()
+        if now - self.checked_at > REPLICA_STATUS_TTL_SECONDS:
+            self.refresh_unless_checked_since(now - REPLICA_STATUS_TTL_SECONDS)
+        if self.lag_seconds is None:
+            return "replica_unavailable"
+        if self.lag_seconds > REPLICA_MAX_LAG_SECONDS:
+            return "replica_lagging"
+        if consistency_token is not None:
+            min_lsn = parse_lsn(consistency_token)
+            if min_lsn is None:
+                return "invalid_token"
+            if self.replay_lsn is None or self.replay_lsn < min_lsn:
+                # The cached position may just be stale; look once more
+                self.refresh_unless_checked_since(now)
+                if self.replay_lsn is None or self.replay_lsn < min_lsn:
+                    return "replica_behind_token"
+        return "replica"
+
+
+if REPLICA_DATABASE_URL:
+    replica_engine = create_engine(
+        REPLICA_DATABASE_URL,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name="replica",
+    )
+    count_invalidations(replica_engine, "replica")
+    instrument_statements(replica_engine)
+    ReadSessionLocal = sessionmaker(
+        autocommit=False, autoflush=False, bind=replica_engine
+    )
+    replica_status: Optional[ReplicaStatus] = ReplicaStatus(replica_engine)
+else:
+    replica_engine = ReadSessionLocal = None
+    replica_status = None
+
+
+# --- Read-Your-Writes Tokens ---
+# Inside track_write_position (the write-token middleware), statements that change
+# data on the primary are noted; when a session then commits, the primary's WAL
+# position is read on the connection that committed. Requests that wrote nothing
+# never pay for it.
+WRITE_STATEMENT = re.compile(r"\s*(INSERT|UPDATE|DELETE|MERGE|COPY)\b", re.IGNORECASE)
+
+# The current request's {"wrote", "lsn"}; None outside tracked requests
+_write_position: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "write_position", default=None
+)
+
+
+@contextlib.contextmanager
+def track_write_position():
+    """Collects the WAL position after the last write committed inside the block ("lsn", None if none)."""
+    position = {"wrote": False, "lsn": None}
+    token = _write_position.set(position)
+    try:
+        yield position
+    finally:
+        _write_position.reset(token)
+
+
+def note_write():
+    """Marks the current request as having written to the primary."""
+    position = _write_position.get()
+    if position is not None:
+        position["wrote"] = True
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def note_write_statements(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+        note_write()
+    elif WRITE_STATEMENT.match(statement):
+        note_write()
+
+
+@event.listens_for(Session, "after_begin")
+def remember_primary_connection(session, transaction, connection):
+    if connection.engine is engine:
+        session.info["primary_connection"] = connection
+
+
+@event.listens_for(Session, "after_commit")
+def capture_write_position(session):
+    connection = session.info.pop("primary_connection", None)
+    position = _write_position.get()
+    if connection is None or position is None or not position["wrote"]:
+        return
+    # Read after the commit, so the position is at or past its commit record
+    position["lsn"] = connection.exec_driver_sql(
+        "SELECT pg_current_wal_lsn()::text"
+    ).scalar_one()
+    position["wrote"] = False
+
+
 Base = declarative_base()
 
 
@@ -28,3 +336,193 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_read_db(request: Request, primary_db: Session = Depends(get_db)):
+    """
+    Session for read-only routes: the replica when it is reachable, within
+    REPLICA_MAX_LAG_SECONDS and past the request's consistency token, otherwise
+    the primary session (which never connects if unused).
+    """
+    if replica_status is None:
+        yield primary_db
+        return
+    reason = replica_status.choose(request.headers.get(CONSISTENCY_TOKEN_HEADER))
+    if reason != "replica":
+        DB_READ_ROUTING.labels(app_name=APP_NAME, target="primary", reason=reason).inc()
+        yield primary_db
+        return
+    DB_READ_ROUTING.labels(app_name=APP_NAME, target="replica", reason="ok").inc()
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# --- Shards ---
+def create_shard_engine(url: str, pool_name: str, pool_size: int, max_overflow: int):
+    """Engine for a shard past shard 0, pooled and instrumented like the engines above."""
+    shard_engine = create_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name=pool_name,
+    )
+    count_invalidations(shard_engine, pool_name)
+    instrument_statements(shard_engine)
+    return shard_engine
+
+
+class ShardMap:
+    """
+    The order shards. A user's orders all live on the shard picked by hashing
+    their user_id, and every order id encodes its shard, so lookups by either
+    go straight to one database. Changing the number of shards remaps users
+    and requires moving their orders.
+    """
+
+    def __init__(
+        self,
+        engines: Sequence,
+        connections_per_shard: int = DB_POOL_SIZE + DB_MAX_OVERFLOW,
+    ):
+        if not 0 < len(engines) <= ORDER_ID_SHARD_SLOTS:
+            raise ValueError(f"Between 1 and {ORDER_ID_SHARD_SLOTS} shards are supported.")
+        self.engines = list(engines)
+        self.sessionmakers = [
+            sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)
+            for shard_engine in self.engines
+        ]
+        # Shared by every request's scatters. Each shard call holds one of its
+        # shard's connections, so there is a thread for every connection the
+        # pools can hand out: concurrent scatters wait on the pools, as
+        # single-shard requests do, not on each other for threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.engines) * connections_per_shard,
+            thread_name_prefix="order-shard",
+        )
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    def shard_for_user(self, user_id: int) -> int:
+        # crc32 rather than hash(): stable across processes and Python versions
+        return zlib.crc32(str(user_id).encode()) % len(self.engines)
+
+    def shard_for_order(self, order_id: int) -> int:
+        if len(self.engines) == 1:
+            return 0  # Includes ids handed out before sharding
+        return id_shard(order_id) % len(self.engines)
+
+    def run_concurrently(self, calls: List[Callable]) -> List:
+        """
+        Runs the calls concurrently and returns their results in order. The
+        first runs on the calling thread, which would otherwise sit waiting.
+        """
+        if len(calls) == 1:
+            return [calls[0]()]
+        # Each call runs in a copy of the request's context, so its statements
+        # still count towards the request's query statistics
+        futures = [
+            self._executor.submit(contextvars.copy_context().run, call) for call in calls[1:]
+        ]
+        try:
+            first = calls[0]()
+        finally:
+            # The other calls use sessions the request closes once this returns
+            wait(futures)
+        return [first] + [future.result() for future in futures]
+
+    def dispose(self):
+        """Closes the pools of shards past shard 0 (whose engine is disposed with the rest)."""
+        for shard_engine in self.engines[1:]:
+            shard_engine.dispose()
+
+
+shard_map = ShardMap(
+    [engine]
+    + [
+        create_shard_engine(url, f"api-shard{shard}", DB_POOL_SIZE, DB_MAX_OVERFLOW)
+        for shard, url in enumerate(ORDER_SHARD_DATABASE_URLS[1:], start=1)
+    ]
+)
+consumer_shard_map = ShardMap(
+    [consumer_engine]
+    + [
+        create_shard_engine(url, f"consumer-shard{shard}", CONSUMER_DB_POOL_SIZE, 0)
+        for shard, url in enumerate(ORDER_SHARD_DATABASE_URLS[1:], start=1)
+    ],
+    connections_per_shard=CONSUMER_DB_POOL_SIZE,
+)
+
+
+class ShardedSessions:
+    """
+    One request's sessions, opened per shard on first use. Shard 0 uses the
+    session the request already has (primary or read replica).
+    """
+
+    def __init__(self, shard_map: ShardMap, shard0_session: Session):
+        self.shard_map = shard_map
+        self._sessions: Dict[int, Session] = {0: shard0_session}
+
+    def __len__(self) -> int:
+        return len(self.shard_map)
+
+    def for_shard(self, shard: int) -> Session:
+        if shard not in self._sessions:
+            self._sessions[shard] = self.shard_map.sessionmakers[shard]()
+        return self._sessions[shard]
+
+    def for_user(self, user_id: int) -> Session:
+        return self.for_shard(self.shard_map.shard_for_user(user_id))
+
+    def for_order(self, order_id: int) -> Session:
+        return self.for_shard(self.shard_map.shard_for_order(order_id))
+
+    def scatter(self, fn: Callable, shards: Optional[Sequence[int]] = None) -> Dict[int, object]:
+        """Calls fn(shard, session) for every shard (or the given ones) concurrently."""
+        shards = list(range(len(self.shard_map)) if shards is None else shards)
+        sessions = [self.for_shard(shard) for shard in shards]
+        results = self.shard_map.run_concurrently(
+            [
+                lambda shard=shard, db=db: fn(shard, db)
+                for shard, db in zip(shards, sessions)
+            ]
+        )
+        return dict(zip(shards, results))
+
+    def close(self):
+        for shard, db in self._sessions.items():
+            if shard != 0:  # Shard 0's session belongs to get_db / get_read_db
+                db.close()
+
+
+def get_sharded_db(primary_db: Session = Depends(get_db)):
+    sessions = ShardedSessions(shard_map, primary_db)
+    try:
+        yield sessions
+    finally:
+        sessions.close()
+
+
+def get_sharded_read_db(read_db: Session = Depends(get_read_db)):
+    """
+    Like get_sharded_db, for read-only routes. The read replica only serves
+    shard 0; other shards are read from their primaries.
+    """
+    sessions = ShardedSessions(shard_map, read_db)
+    try:
+        yield sessions
+    finally:
+        sessions.close()
+
+
+def get_db_for_user(user_id: int, shards: ShardedSessions = Depends(get_sharded_db)):
+    """Session on the shard holding user_id's orders, for routes with a user_id parameter."""
+    yield shards.for_user(user_id)
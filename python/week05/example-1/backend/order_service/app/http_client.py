@@ -0,0 +1,159 @@
+# week05/example-1/backend/order_service/app/http_client.py
+
+import logging
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from .metrics import (
+    APP_NAME,
+    HTTP_CLIENT_CONNECTIONS_OPENED,
+    HTTP_CLIENT_POOL_CONNECTIONS,
+    HTTP_CLIENT_REQUEST_DURATION,
+    HTTP_CLIENT_REQUESTS_IN_FLIGHT,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Inter-Service HTTP Client Configuration ---
+# One client per process, created at startup: calls to the customer and product
+# services reuse kept-alive connections instead of paying TCP (and TLS) setup
+# on every order. Per process, at most HTTP_MAX_CONNECTIONS are open at once;
+# further requests wait up to HTTP_POOL_TIMEOUT_SECONDS for one to free up
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+# Idle connections kept open for reuse, and for how long
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "30"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "2"))
+HTTP_POOL_TIMEOUT_SECONDS = float(os.getenv("HTTP_POOL_TIMEOUT_SECONDS", "2"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "5"))
+# Multiplexes concurrent requests over one connection per service. Negotiated
+# over TLS only, so it takes effect with https:// service URLs
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+
+# The process-wide client, between startup and shutdown
+http_client: Optional[httpx.AsyncClient] = None
+
+
+class PoolStateStream(httpx.AsyncByteStream):
+    """A response body that reports the pool's state when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        await self.stream.aclose()
+        self.on_close()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Wraps a transport to export request latency, requests in flight, new
+    connections (a high rate means keep-alive isn't working) and, for the
+    pooled transport, how many of its connections are busy or idle.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        target = request.url.host
+        traced = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            if event_name == "connection.connect_tcp.complete":
+                HTTP_CLIENT_CONNECTIONS_OPENED.labels(app_name=APP_NAME, target=target).inc()
+            if traced is not None:
+                await traced(event_name, info)
+
+        request.extensions["trace"] = trace
+        in_flight = HTTP_CLIENT_REQUESTS_IN_FLIGHT.labels(app_name=APP_NAME, target=target)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        finally:
+            in_flight.dec()
+            HTTP_CLIENT_REQUEST_DURATION.labels(app_name=APP_NAME, target=target).observe(
+                time.perf_counter() - started
+            )
+            self.record_pool_state()
+        # The connection goes back to the pool once the body has been read
+        response.stream = PoolStateStream(response.stream, self.record_pool_state)
+        return response
+
+    def record_pool_state(self):
+        # httpx doesn't expose its transport's httpcore pool; _pool is read
+        # under the httpx pin in requirements.txt, and transports without one
+        # (httpx.MockTransport in tests) report nothing
+        pool = getattr(self.transport, "_pool", None)
+        if pool is None:
+            return
+        connections = pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        HTTP_CLIENT_POOL_CONNECTIONS.labels(app_name=APP_NAME, state="idle").set(idle)
+        HTTP_CLIENT_POOL_CONNECTIONS.labels(app_name=APP_NAME, state="active").set(
+            len(connections) - idle
+        )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def create_http_client(
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> httpx.AsyncClient:
+    """
+    Builds the inter-service client. Without a transport it gets the pooled one
+    configured above; tests pass an httpx.MockTransport instead.
+    """
+    if transport is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            http2=HTTP2_ENABLED,
+        )
+    return httpx.AsyncClient(
+        transport=InstrumentedTransport(transport),
+        timeout=httpx.Timeout(
+            HTTP_TIMEOUT_SECONDS,
+            connect=HTTP_CONNECT_TIMEOUT_SECONDS,
+            pool=HTTP_POOL_TIMEOUT_SECONDS,
+        ),
+    )
+
+
+def start_http_client():
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+        logger.info(
+            f"Order Service: Inter-service HTTP client ready (max connections {HTTP_MAX_CONNECTIONS}, "
+            f"keep-alive {HTTP_MAX_KEEPALIVE_CONNECTIONS} for {HTTP_KEEPALIVE_EXPIRY_SECONDS}s, "
+            f"HTTP/2 {'on' if HTTP2_ENABLED else 'off'})."
+        )
+
+
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+        logger.info("Order Service: Inter-service HTTP client closed.")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Dependency handing routes the shared client; tests override it."""
+    if http_client is None:
+        raise RuntimeError("The inter-service HTTP client is not started.")
+    return http_client
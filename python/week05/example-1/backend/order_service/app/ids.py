@@ -0,0 +1,123 @@
+# week05/example-1/backend/order_service/app/ids.py
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+# --- Snowflake ID Layout ---
+# Ids are built in the application, so a whole order can be inserted without
+# asking the database for its id first. From the most significant bit:
+#   40 bits  milliseconds since ID_EPOCH_MS (until 2058)
+#    4 bits  worker: one per service process, so replicas never collide
+#    5 bits  sequence within the millisecond
+#    4 bits  shard the row lives on (see ShardMap)
+# 53 bits in total: ids stay exact as JSON numbers in JavaScript clients, and
+# they sort by creation time.
+ID_EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+TIMESTAMP_BITS = 40
+WORKER_BITS = 4
+SEQUENCE_BITS = 5
+SHARD_BITS = 4
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+MAX_SHARD = (1 << SHARD_BITS) - 1
+SEQUENCE_SHIFT = SHARD_BITS
+WORKER_SHIFT = SEQUENCE_SHIFT + SEQUENCE_BITS
+TIMESTAMP_SHIFT = WORKER_SHIFT + WORKER_BITS
+
+# First key of the advisory locks claiming worker ids (see claim_worker_id)
+WORKER_ID_LOCK_NAMESPACE = 0x1D5
+
+
+def default_worker_id() -> int:
+    """
+    ORDER_ID_WORKER_ID, which every process of the service needs its own of
+    (0 when unset, enough for a lone process). claim_worker_id makes startup
+    fail when another live process already uses the same id.
+    """
+    return int(os.getenv("ORDER_ID_WORKER_ID", "0"))
+
+
+def claim_worker_id(url, worker_id: int):
+    """
+    Takes a session advisory lock on worker_id in the database at url and
+    returns the connection holding it: the claim lasts until that connection
+    is closed, or the process dies. Raises RuntimeError if another process
+    holds the claim.
+    """
+    # A connection of its own, outside the API pool, for the process lifetime
+    claim_engine = create_engine(url, poolclass=NullPool)
+    connection = claim_engine.connect()
+    claimed = connection.execute(
+        text("SELECT pg_try_advisory_lock(:namespace, :worker_id)"),
+        {"namespace": WORKER_ID_LOCK_NAMESPACE, "worker_id": worker_id},
+    ).scalar_one()
+    connection.commit()
+    if not claimed:
+        connection.close()
+        raise RuntimeError(
+            f"Snowflake worker id {worker_id} is in use by another process; "
+            "give every process its own ORDER_ID_WORKER_ID."
+        )
+    return connection
+
+
+class SnowflakeGenerator:
+    """
+    Thread-safe generator of time-ordered ids. If the clock goes backwards,
+    or a millisecond's sequence runs out, ids carry on from the last
+    millisecond used instead of waiting, so they never repeat or go backwards.
+    """
+
+    def __init__(
+        self,
+        worker_id: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.worker_id = default_worker_id() if worker_id is None else worker_id
+        if not 0 <= self.worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"Worker id must be between 0 and {MAX_WORKER_ID}.")
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self, shard: int = 0) -> int:
+        if not 0 <= shard <= MAX_SHARD:
+            raise ValueError(f"Shard must be between 0 and {MAX_SHARD}.")
+        with self._lock:
+            now_ms = int(self._clock() * 1000) - ID_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms, self._sequence = now_ms, 0
+            elif self._sequence < MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                self._last_ms, self._sequence = self._last_ms + 1, 0
+            timestamp_ms, sequence = self._last_ms, self._sequence
+        return (
+            (timestamp_ms << TIMESTAMP_SHIFT)
+            | (self.worker_id << WORKER_SHIFT)
+            | (sequence << SEQUENCE_SHIFT)
+            | shard
+        )
+
+
+def id_shard(snowflake_id: int) -> int:
+    return snowflake_id & MAX_SHARD
+
+
+def id_datetime(snowflake_id: int) -> datetime:
+    """Creation time encoded in an id, to the millisecond."""
+    timestamp_ms = (snowflake_id >> TIMESTAMP_SHIFT) + ID_EPOCH_MS
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc)
+
+
+# Orders and order items draw from separate sequences
+order_ids = SnowflakeGenerator()
+order_item_ids = SnowflakeGenerator(order_ids.worker_id)
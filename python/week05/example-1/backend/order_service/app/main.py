@@ -1,30 +1,79 @@
 # week05/example-1/backend/order_service/app/main.py
 
 import asyncio
+import heapq
+import itertools
 import json
 import logging
 import os
 import sys
 import time
+from datetime import datetime
 from decimal import Decimal
 from typing import List, Optional
 
 import aio_pika
 import httpx
-from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
+import pydantic_core
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import generate_latest
+from sqlalchemy import and_, select, tuple_
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import Session, joinedload
-
-from .db import Base, SessionLocal, engine, get_db
-from .models import Order, OrderItem
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload, sessionmaker
+from starlette.responses import PlainTextResponse
+
+from .consumer import CONSUMER_PREFETCH_COUNT, ConsumerExecutor
+from .db import (
+    CONSISTENCY_TOKEN_HEADER,
+    Base,
+    ShardedSessions,
+    ShardMap,
+    consumer_engine,
+    consumer_shard_map,
+    get_sharded_db,
+    get_sharded_read_db,
+    replica_engine,
+    replica_status,
+    shard_map,
+    track_write_position,
+)
+from .http_client import close_http_client, get_http_client, start_http_client
+from .ids import claim_worker_id, id_datetime, order_ids, order_item_ids
+from .metrics import APP_NAME, CONSUMER_MESSAGES, registry
+from .models import (
+    ORDER_ITEM_LIST_COLUMNS,
+    ORDER_LIST_COLUMNS,
+    ORDER_SUMMARY_COLUMNS,
+    Order,
+    OrderItem,
+)
+from .pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from .partitions import (
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS,
+    maintain_partitions,
+    missing_month_partitions,
+)
+from .querystats import (
+    DB_QUERY_COUNT_HEADER,
+    QUERY_COUNT_HEADER,
+    report_request_queries,
+    track_request_queries,
+)
 from .schemas import (
+    CustomerOrderPage,
     OrderCreate,
     OrderItemResponse,
     OrderResponse,
     OrderStatusUpdate,
     OrderUpdate,
+    order_item_row_to_json,
+    order_row_to_json,
+    order_summary_row_to_json,
 )
+from .status_migration import require_status_codes
+from .writes import insert_order, set_order_status
 
 # --- Standard Logging Configuration ---
 logging.basicConfig(
@@ -40,6 +89,14 @@ logging.getLogger("uvicorn.error").setLevel(logging.INFO)
 
 # --- Service URLs Configuration ---
 CUSTOMER_SERVICE_URL = os.getenv("CUSTOMER_SERVICE_URL", "http://localhost:8002")
+PRODUCT_SERVICE_URL = os.getenv("PRODUCT_SERVICE_URL", "http://localhost:8000")
+# Seconds we wait for the customer lookup; sent along as an absolute
+# X-Request-Deadline so the Customer Service can stop its query once we give up
+CUSTOMER_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("CUSTOMER_LOOKUP_TIMEOUT_SECONDS", "3"))
+REQUEST_DEADLINE_HEADER = "X-Request-Deadline"
+PRODUCT_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("PRODUCT_LOOKUP_TIMEOUT_SECONDS", "3"))
+# Customer and product lookups one order has in flight at once
+ORDER_VALIDATION_CONCURRENCY = int(os.getenv("ORDER_VALIDATION_CONCURRENCY", "10"))
 logger.info(
     f"Order Service: Configured to communicate with Customer Service at: {CUSTOMER_SERVICE_URL}"
 )
@@ -56,6 +113,12 @@ rabbitmq_connection: Optional[aio_pika.Connection] = None
 rabbitmq_channel: Optional[aio_pika.Channel] = None
 rabbitmq_exchange: Optional[aio_pika.Exchange] = None
 
+# Runs the blocking database work of RabbitMQ message handlers
+consumer_executor = ConsumerExecutor()
+
+# Connection holding this process's claim on its snowflake worker id
+worker_id_claim = None
+
 # --- FastAPI Application Setup ---
 app = FastAPI(
     title="Order Service API",
@@ -73,6 +136,34 @@ app.add_middleware(
 )
 
 
+# --- Middleware for SQL Statement Metrics ---
+@app.middleware("http")
+async def count_database_queries(request: Request, call_next):
+    with track_request_queries() as queries:
+        response = await call_next(request)
+    # Label by route template (e.g. /orders/{order_id}) to keep cardinality bounded
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    report_request_queries(route, queries)
+    if DB_QUERY_COUNT_HEADER:
+        response.headers[QUERY_COUNT_HEADER] = str(sum(queries.values()))
+    return response
+
+
+# --- Middleware for Read-Your-Writes Tokens ---
+@app.middleware("http")
+async def add_consistency_token(request: Request, call_next):
+    # Clients echo the token on later reads so the replica is only used once it
+    # has replayed this write; only needed when a replica is configured. The
+    # position is captured when a write commits (see track_write_position)
+    if replica_status is None:
+        return await call_next(request)
+    with track_write_position() as position:
+        response = await call_next(request)
+    if position["lsn"] is not None and response.status_code < 400:
+        response.headers[CONSISTENCY_TOKEN_HEADER] = position["lsn"]
+    return response
+
+
 # --- RabbitMQ Helper Functions ---
 async def connect_to_rabbitmq():
     """Establishes an asynchronous connection to RabbitMQ."""
@@ -143,7 +234,59 @@ async def publish_event(routing_key: str, message_data: dict):
         )
 
 
-async def consume_stock_events(db_session_factory: Session):
+# Order status each stock event moves an order to
+STOCK_EVENT_STATUSES = {
+    "product.stock.deducted": "confirmed",
+    "product.stock.deduction.failed": "failed",  # New status for failed orders
+}
+
+
+def apply_stock_event(
+    db_session_factory: sessionmaker, order_id: int, routing_key: str, details
+) -> str:
+    """
+    Updates an order's status for a stock event (blocking; runs on the consumer
+    executor). Returns the outcome recorded in the consumer metrics.
+    """
+    new_status = STOCK_EVENT_STATUSES.get(routing_key)
+    if new_status is None:
+        logger.warning(
+            f"Order Service: Received unknown routing key '{routing_key}' for order {order_id}."
+        )
+        return "ignored"
+
+    local_db_session = db_session_factory()
+    try:
+        # One UPDATE ... RETURNING, pipelined with its COMMIT on psycopg
+        if set_order_status(local_db_session, order_id, new_status) is None:
+            logger.warning(
+                f"Order Service: Received event for non-existent order ID: {order_id}. Routing key: {routing_key}. Skipping update."
+            )
+            return "order_not_found"
+
+        if new_status == "confirmed":
+            logger.info(
+                f"Order Service: Order {order_id} status updated to 'confirmed' based on stock deduction success."
+            )
+        else:
+            logger.warning(
+                f"Order Service: Order {order_id} status updated to 'failed' based on stock deduction failure. Details: {details}"
+            )
+            # In a real app, you might publish a compensation event here or trigger alerts.
+        return new_status
+
+    except Exception as db_e:
+        local_db_session.rollback()
+        logger.critical(
+            f"Order Service: Database error updating order {order_id} status: {db_e}",
+            exc_info=True,
+        )
+        return "error"
+    finally:
+        local_db_session.close()
+
+
+async def consume_stock_events(shards: ShardMap):
     if not rabbitmq_channel or not rabbitmq_exchange:
         logger.error(
             "Order Service: RabbitMQ channel or exchange not available for consuming stock events."
@@ -154,6 +297,9 @@ async def consume_stock_events(db_session_factory: Session):
     stock_deduction_failed_queue_name = "order_service_stock_deduction_failed_queue"
 
     try:
+        # Bound in-flight messages so the executor queue cannot grow without limit
+        await rabbitmq_channel.set_qos(prefetch_count=CONSUMER_PREFETCH_COUNT)
+
         # Declare and bind queue for successful stock deductions
         stock_deducted_queue = await rabbitmq_channel.declare_queue(
             stock_deducted_queue_name, durable=True
@@ -179,74 +325,41 @@ async def consume_stock_events(db_session_factory: Session):
         # Create a combined consumer for both queues
         async def process_message(message: aio_pika.abc.AbstractIncomingMessage):
             async with message.process():
+                routing_key = message.routing_key
                 try:
                     message_data = json.loads(message.body.decode("utf-8"))
-                    routing_key = message.routing_key
                     order_id = message_data.get("order_id")
 
                     if not order_id:
                         logger.error(
                             f"Order Service: Received message with no order_id: {message_data}"
                         )
-                        return
-
-                    # Create a new session for this background task
-                    local_db_session = db_session_factory()
-                    try:
-                        db_order = (
-                            local_db_session.query(Order)
-                            .filter(Order.order_id == order_id)
-                            .first()
-                        )
-
-                        if not db_order:
-                            logger.warning(
-                                f"Order Service: Received event for non-existent order ID: {order_id}. Routing key: {routing_key}. Skipping update."
-                            )
-                            return
-
-                        if routing_key == "product.stock.deducted":
-                            db_order.status = "confirmed"
-                            logger.info(
-                                f"Order Service: Order {order_id} status updated to 'confirmed' based on stock deduction success."
-                            )
-                        elif routing_key == "product.stock.deduction.failed":
-                            db_order.status = "failed"  # New status for failed orders
-                            logger.warning(
-                                f"Order Service: Order {order_id} status updated to 'failed' based on stock deduction failure. Details: {message_data.get('details')}"
-                            )
-                            # In a real app, you might publish a compensation event here or trigger alerts.
-                        else:
-                            logger.warning(
-                                f"Order Service: Received unknown routing key '{routing_key}' for order {order_id}."
-                            )
-                            return
-
-                        local_db_session.add(db_order)
-                        local_db_session.commit()
-                        local_db_session.refresh(db_order)
-                        logger.info(
-                            f"Order Service: Order {order_id} status successfully updated to {db_order.status}."
+                        outcome = "invalid"
+                    else:
+                        # The database work runs on the consumer executor, off the event loop
+                        outcome = await consumer_executor.run(
+                            routing_key,
+                            apply_stock_event,
+                            shards.sessionmakers[shards.shard_for_order(order_id)],
+                            order_id,
+                            routing_key,
+                            message_data.get("details"),
                         )
 
-                    except Exception as db_e:
-                        local_db_session.rollback()
-                        logger.critical(
-                            f"Order Service: Database error updating order {order_id} status: {db_e}",
-                            exc_info=True,
-                        )
-                    finally:
-                        local_db_session.close()
-
                 except json.JSONDecodeError as e:
                     logger.error(
                         f"Order Service: Failed to decode RabbitMQ message body: {e}. Message: {message.body}"
                     )
+                    outcome = "invalid"
                 except Exception as e:
                     logger.error(
                         f"Order Service: Unhandled error processing stock event message: {e}",
                         exc_info=True,
                     )
+                    outcome = "error"
+                CONSUMER_MESSAGES.labels(
+                    app_name=APP_NAME, routing_key=routing_key, outcome=outcome
+                ).inc()
 
         # Start consuming from both queues concurrently
         await asyncio.gather(
@@ -261,9 +374,29 @@ async def consume_stock_events(db_session_factory: Session):
         )
 
 
+# --- Partition Maintenance ---
+# Parents first: orders partitions are created before, and dropped after, their items'
+PARTITIONED_TABLES = (Order.__tablename__, OrderItem.__tablename__)
+
+
+async def run_partition_maintenance_periodically():
+    """Background task that keeps future monthly partitions ready and drops expired ones."""
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            for shard_engine in shard_map.engines:
+                await run_in_threadpool(maintain_partitions, shard_engine, PARTITIONED_TABLES)
+        except Exception as e:
+            logger.error(
+                f"Order Service: Partition maintenance failed: {e}", exc_info=True
+            )
+
+
 # --- FastAPI Event Handlers ---
 @app.on_event("startup")
 async def startup_event():
+    start_http_client()
+
     max_retries = 10
     retry_delay_seconds = 5
     for i in range(max_retries):
@@ -271,7 +404,10 @@ async def startup_event():
             logger.info(
                 f"Order Service: Attempting to connect to PostgreSQL and create tables (attempt {i+1}/{max_retries})..."
             )
-            Base.metadata.create_all(bind=engine)
+            for shard_engine in shard_map.engines:
+                Base.metadata.create_all(bind=shard_engine)
+                # Tables from before status codes need the expand step first
+                require_status_codes(shard_engine)
             logger.info(
                 "Order Service: Successfully connected to PostgreSQL and ensured tables exist."
             )
@@ -295,10 +431,28 @@ async def startup_event():
             )
             sys.exit(1)
 
+    # Two live processes with one worker id would generate the same order ids
+    global worker_id_claim
+    try:
+        worker_id_claim = claim_worker_id(shard_map.engines[0].url, order_ids.worker_id)
+        logger.info(f"Order Service: Claimed snowflake worker id {order_ids.worker_id}.")
+    except RuntimeError as e:
+        logger.critical(f"Order Service: {e} Exiting application.")
+        sys.exit(1)
+
+    try:
+        for shard_engine in shard_map.engines:
+            maintain_partitions(shard_engine, PARTITIONED_TABLES)
+    except Exception as e:
+        logger.error(
+            f"Order Service: Partition maintenance failed at startup: {e}", exc_info=True
+        )
+    asyncio.create_task(run_partition_maintenance_periodically())
+
     # Connect to RabbitMQ and start consumer
     if await connect_to_rabbitmq():
-        # Pass SessionLocal directly to the consumer to create new sessions per message
-        asyncio.create_task(consume_stock_events(SessionLocal))
+        # The consumer gets its own session factory (and pool), separate from the API's
+        asyncio.create_task(consume_stock_events(consumer_shard_map))
     else:
         logger.error(
             "Order Service: RabbitMQ connection failed at startup. Async order processing will not work."
@@ -308,6 +462,15 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     await close_rabbitmq_connection()
+    await close_http_client()
+    if worker_id_claim is not None:
+        worker_id_claim.close()
+    consumer_executor.shutdown()
+    consumer_engine.dispose()
+    shard_map.dispose()
+    consumer_shard_map.dispose()
+    if replica_engine is not None:
+        replica_engine.dispose()
 
 
 # --- Root Endpoint ---
@@ -322,74 +485,216 @@ async def health_check():
     return {"status": "ok", "service": "order-service"}
 
 
-@app.post(
-    "/orders/",
-    response_model=OrderResponse,
-    status_code=status.HTTP_201_CREATED,
-    summary="Create a new order and publish 'order.placed' event for stock deduction",
-)
-async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
-    if not order.items:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Order must contain at least one item.",
+@app.get("/health/ready", summary="Readiness check covering the database and upcoming partitions")
+def readiness_check(response: Response):
+    """
+    Not ready while any shard lacks this or next month's orders partitions:
+    orders dated in a month without one fail to insert, so stalled partition
+    maintenance takes the service out of rotation while there is still a
+    month to fix it.
+    """
+    checks = {}
+    missing = []
+    try:
+        for shard_engine in shard_map.engines:
+            with shard_engine.connect() as connection:
+                missing += missing_month_partitions(connection, PARTITIONED_TABLES)
+        checks["database"] = "available"
+        checks["partitions"] = "missing" if missing else "available"
+    except OperationalError as e:
+        logger.warning(f"Order Service: Readiness check could not reach the database: {e}")
+        checks["database"] = checks["partitions"] = "unavailable"
+    if missing:
+        logger.error(
+            f"Order Service: Partitions {missing} are missing; check partition maintenance."
         )
 
-    # --- Step 1: Validate customer_id with Customer Service (Synchronous Call) ---
-    async with httpx.AsyncClient() as client:
-        customer_validation_url = f"{CUSTOMER_SERVICE_URL}/customers/{order.user_id}"
+    ready = all(check == "available" for check in checks.values())
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    result = {
+        "status": "ready" if ready else "not_ready",
+        "service": "order-service",
+        "checks": checks,
+    }
+    if missing:
+        result["missing_partitions"] = missing
+    return result
+
+
+# --- Prometheus Metrics Endpoint ---
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus metrics endpoint")
+async def metrics():
+    return PlainTextResponse(generate_latest(registry))
+
+
+# --- Order Validation Against Other Services ---
+async def gather_or_cancel(*calls):
+    """
+    asyncio.gather for downstream calls: results in order, and the first
+    failure cancels the calls still running instead of leaving them to finish.
+    """
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def validate_customer(client: httpx.AsyncClient, order: OrderCreate):
+    """Checks the customer exists, filling in their default shipping address if the order has none."""
+    customer_validation_url = f"{CUSTOMER_SERVICE_URL}/customers/{order.user_id}"
+    logger.info(
+        f"Order Service: Validating customer ID {order.user_id} via Customer Service at {customer_validation_url}"
+    )
+    try:
+        deadline = time.time() + CUSTOMER_LOOKUP_TIMEOUT_SECONDS
+        response = await client.get(
+            customer_validation_url,
+            headers={REQUEST_DEADLINE_HEADER: f"{deadline:.3f}"},
+            timeout=CUSTOMER_LOOKUP_TIMEOUT_SECONDS,
+        )
+        response.raise_for_status()  # Raises HTTPStatusError for 4xx/5xx responses
+        customer_data = response.json()
         logger.info(
-            f"Order Service: Validating customer ID {order.user_id} via Customer Service at {customer_validation_url}"
+            f"Order Service: Customer ID {order.user_id} validated. Customer email: {customer_data.get('email')}"
         )
-        try:
-            response = await client.get(customer_validation_url, timeout=3)
-            response.raise_for_status()  # Raises HTTPStatusError for 4xx/5xx responses
-            customer_data = response.json()
+
+        # If the order's shipping address is not provided, use the customer's default
+        if not order.shipping_address and customer_data.get("shipping_address"):
+            order.shipping_address = customer_data["shipping_address"]
             logger.info(
-                f"Order Service: Customer ID {order.user_id} validated. Customer email: {customer_data.get('email')}"
+                f"Order Service: Using customer's default shipping address: {order.shipping_address}"
             )
 
-            # If the order's shipping address is not provided, use the customer's default
-            if not order.shipping_address and customer_data.get("shipping_address"):
-                order.shipping_address = customer_data["shipping_address"]
-                logger.info(
-                    f"Order Service: Using customer's default shipping address: {order.shipping_address}"
-                )
-
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == status.HTTP_404_NOT_FOUND:
-                logger.warning(
-                    f"Order Service: Customer validation failed for ID {order.user_id}: Customer not found."
-                )
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Invalid user_id: Customer {order.user_id} not found.",
-                )
-            else:
-                logger.error(
-                    f"Order Service: Customer service returned an error for ID {order.user_id}: {e.response.status_code} - {e.response.text}"
-                )
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="Failed to validate customer with Customer Service.",
-                )
-        except httpx.RequestError as e:
-            logger.critical(
-                f"Order Service: Network error communicating with Customer Service: {e}"
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == status.HTTP_404_NOT_FOUND:
+            logger.warning(
+                f"Order Service: Customer validation failed for ID {order.user_id}: Customer not found."
             )
             raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Customer Service is currently unavailable. Please try again later.",
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid user_id: Customer {order.user_id} not found.",
             )
-        except Exception as e:
+        else:
             logger.error(
-                f"Order Service: An unexpected error occurred during customer validation: {e}",
-                exc_info=True,
+                f"Order Service: Customer service returned an error for ID {order.user_id}: {e.response.status_code} - {e.response.text}"
             )
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"An unexpected error occurred: {e}",
+                detail="Failed to validate customer with Customer Service.",
+            )
+    except httpx.RequestError as e:
+        logger.critical(
+            f"Order Service: Network error communicating with Customer Service: {e}"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Customer Service is currently unavailable. Please try again later.",
+        )
+    except Exception as e:
+        logger.error(
+            f"Order Service: An unexpected error occurred during customer validation: {e}",
+            exc_info=True,
+        )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {e}",
+        )
+
+
+async def fetch_product(client: httpx.AsyncClient, product_id: int, quantity: int) -> dict:
+    """Looks up a product and checks it has quantity in stock."""
+    product_detail_url = f"{PRODUCT_SERVICE_URL}/products/{product_id}"
+    try:
+        response = await client.get(
+            product_detail_url, timeout=PRODUCT_LOOKUP_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+        product_data = response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == status.HTTP_404_NOT_FOUND:
+            logger.warning(
+                f"Order Service: Product validation failed for ID {product_id}: Product not found."
+            )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid product_id: Product {product_id} not found.",
             )
+        logger.error(
+            f"Order Service: Product Service returned an error for product {product_id}: {e.response.status_code} - {e.response.text}"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to validate products with Product Service.",
+        )
+    except httpx.RequestError as e:
+        logger.critical(
+            f"Order Service: Network error communicating with Product Service: {e}"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Product Service is currently unavailable. Please try again later.",
+        )
+
+    # Stock is only reserved by the order.placed consumer; this rejects orders
+    # that can't succeed before they are written
+    if product_data["stock_quantity"] < quantity:
+        logger.warning(
+            f"Order Service: Insufficient stock for product {product_id}. Requested {quantity}, available {product_data['stock_quantity']}."
+        )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock for product '{product_data['name']}'. Only {product_data['stock_quantity']} available.",
+        )
+    return product_data
+
+
+@app.post(
+    "/orders/",
+    response_model=OrderResponse,
+    status_code=status.HTTP_201_CREATED,
+    summary="Create a new order and publish 'order.placed' event for stock deduction",
+)
+async def create_order(
+    order: OrderCreate,
+    shards: ShardedSessions = Depends(get_sharded_db),
+    client: httpx.AsyncClient = Depends(get_http_client),
+):
+    # The order, and its id, belong to the user's shard
+    shard = shards.shard_map.shard_for_user(order.user_id)
+    db = shards.for_shard(shard)
+    if not order.items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Order must contain at least one item.",
+        )
+
+    # --- Step 1: Validate the customer and every product, concurrently ---
+    # Latency is that of the slowest lookup rather than their sum; a product
+    # ordered on several lines is looked up once, for its total quantity
+    quantities = {}
+    for item in order.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    lookup_slots = asyncio.Semaphore(ORDER_VALIDATION_CONCURRENCY)
+
+    async def limited(call):
+        async with lookup_slots:
+            return await call
+
+    logger.info(
+        f"Order Service: Validating customer {order.user_id} and {len(quantities)} products."
+    )
+    await gather_or_cancel(
+        limited(validate_customer(client, order)),
+        *(
+            limited(fetch_product(client, product_id, quantity))
+            for product_id, quantity in quantities.items()
+        ),
+    )
 
     # --- Step 2: Create the Order in the Order Service DB with 'pending' status ---
     total_amount = sum(
@@ -397,61 +702,67 @@ async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
         for item in order.items
     )
 
-    db_order = Order(
-        user_id=order.user_id,
-        shipping_address=order.shipping_address,
-        total_amount=total_amount,
-        status="pending",  # Always start as pending; status will be updated by RabbitMQ consumer
-    )
-
-    db.add(db_order)
-    db.flush()  # Use flush to get order_id before committing, needed for order items
-
-    for item in order.items:
-        db_order_item = OrderItem(
-            order_id=db_order.order_id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price_at_purchase=item.price_at_purchase,
-            item_total=Decimal(str(item.quantity))
-            * Decimal(str(item.price_at_purchase)),
-        )
-        db.add(db_order_item)
-
+    # Ids are generated here rather than by the database, so the order and its
+    # items go out as two INSERTs without a flush to learn order_id. RETURNING
+    # brings back the server-generated columns, so nothing is read back after
+    # commit; on psycopg both INSERTs and the COMMIT share one round trip
+    order_id = order_ids.next_id(shard)
+    order_date = id_datetime(order_id)
     try:
-        db.commit()
-        db.refresh(db_order)
-        db.refresh(
-            db_order, attribute_names=["items"]
-        )  # Ensure items are loaded for response
+        order_row, item_rows = insert_order(
+            db,
+            {
+                "order_id": order_id,
+                "order_date": order_date,  # Items share it, keeping them in the order's partition
+                "user_id": order.user_id,
+                "shipping_address": order.shipping_address,
+                "total_amount": total_amount,
+                "status": "pending",  # Always start as pending; status will be updated by RabbitMQ consumer
+            },
+            [
+                {
+                    "order_item_id": order_item_ids.next_id(shard),
+                    "product_id": item.product_id,
+                    "quantity": item.quantity,
+                    "price_at_purchase": item.price_at_purchase,
+                    "item_total": Decimal(str(item.quantity))
+                    * Decimal(str(item.price_at_purchase)),
+                }
+                for item in order.items
+            ],
+        )
+        created_order = order_row_to_json(order_row)
+        created_order["items"] = [order_item_row_to_json(row) for row in item_rows]
         logger.info(
-            f"Order Service: Order {db_order.order_id} created with initial 'pending' status for user {db_order.user_id}."
+            f"Order Service: Order {order_id} created with initial 'pending' status for user {order.user_id}."
         )
 
         # --- Step 3: Publish 'order.placed' event to RabbitMQ ---
         order_event_data = {
-            "order_id": db_order.order_id,
-            "user_id": db_order.user_id,
-            "total_amount": float(
-                db_order.total_amount
-            ),  # Convert Decimal for JSON serialization
+            "order_id": order_id,
+            "user_id": order.user_id,
+            "total_amount": created_order["total_amount"],
             "items": [
                 {
-                    "product_id": item.product_id,
-                    "quantity": item.quantity,
-                    "price_at_purchase": float(item.price_at_purchase),
+                    "product_id": item["product_id"],
+                    "quantity": item["quantity"],
+                    "price_at_purchase": item["price_at_purchase"],
                 }
-                for item in db_order.items
+                for item in created_order["items"]
             ],
-            "order_date": db_order.order_date.isoformat(),
-            "status": db_order.status,  # Should be 'pending' at this point
+            "order_date": order_date.isoformat(),
+            "status": created_order["status"],  # Should be 'pending' at this point
         }
         await publish_event("order.placed", order_event_data)
         logger.info(
-            f"Order Service: 'order.placed' event published for order {db_order.order_id}."
+            f"Order Service: 'order.placed' event published for order {order_id}."
         )
 
-        return db_order
+        return Response(
+            content=pydantic_core.to_json(created_order),
+            status_code=status.HTTP_201_CREATED,
+            media_type="application/json",
+        )
     except Exception as e:
         db.rollback()
         logger.error(
@@ -464,42 +775,200 @@ async def create_order(order: OrderCreate, db: Session = Depends(get_db)):
         )
 
 
+def cursor_position(cursor: str):
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor."
+        )
+
+
+def order_key(order_id: int):
+    """
+    Matches one order by its id and its order_date, which is the id's timestamp.
+    With the partition key in the filter, PostgreSQL scans the one monthly
+    partition that can hold the order instead of probing every partition's index.
+    """
+    return and_(Order.order_id == order_id, Order.order_date == id_datetime(order_id))
+
+
+def attach_order_items(db: Session, orders: List[dict]):
+    """Fills in the items of a page of orders from one shard with a single query."""
+    if not orders:
+        return
+    items_by_order = {order["order_id"]: order["items"] for order in orders}
+    order_dates = [order["order_date"] for order in orders]
+    # The page's date range prunes the items scan to the months it covers
+    item_rows = db.execute(
+        select(*ORDER_ITEM_LIST_COLUMNS)
+        .where(
+            OrderItem.order_id.in_(items_by_order),
+            OrderItem.order_date.between(min(order_dates), max(order_dates)),
+        )
+        .order_by(OrderItem.order_item_id)
+    )
+    for row in item_rows:
+        items_by_order[row.order_id].append(order_item_row_to_json(row))
+
+
 @app.get(
     "/orders/",
     response_model=List[OrderResponse],
     summary="Retrieve a list of all orders",
 )
 def list_orders(
-    db: Session = Depends(get_db),
+    shards: ShardedSessions = Depends(get_sharded_read_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"{NEXT_CURSOR_HEADER} of the previous page; pages after it without skipping rows.",
+    ),
+    include_items: bool = Query(
+        True, description="Include each order's items; false returns the orders alone."
+    ),
     user_id: Optional[int] = Query(None, ge=1, description="Filter orders by user ID."),
     status: Optional[str] = Query(
         None,
         pattern="^(pending|processing|shipped|cancelled|confirmed|completed|failed)$",
     ),
+    placed_after: Optional[datetime] = Query(
+        None, description="Only orders placed at or after this time."
+    ),
+    placed_before: Optional[datetime] = Query(
+        None, description="Only orders placed before this time."
+    ),
 ):
     """
-    Lists orders with optional pagination and filtering by user ID or status.
-    Includes nested order items in the response.
+    Lists orders, oldest first, with optional pagination and filtering by user
+    ID, status or order date. Date filters limit the scan to the matching
+    monthly partitions. A user's orders come from their shard; other listings
+    are gathered from all shards and merged.
+    Full pages carry an X-Next-Cursor header: passing it back as cursor gets
+    the next page by keyset, which unlike skip costs the same at any depth.
+    Includes nested order items in the response, fetched for the whole page
+    in one query per shard, unless include_items is false.
     """
     logger.info(
         f"Order Service: Listing orders (skip={skip}, limit={limit}, user_id={user_id}, status='{status}')"
     )
-    query = db.query(Order).options(joinedload(Order.items))
+    if cursor and skip:
+        # 400: the status filter shadows fastapi.status in here
+        raise HTTPException(
+            status_code=400,
+            detail="Page with either cursor or skip, not both.",
+        )
+    # Read-only fast path: plain rows straight to JSON bytes, without ORM objects
+    # in the identity map or OrderResponse validation per row
+    query = select(*ORDER_LIST_COLUMNS).order_by(Order.order_date, Order.order_id)
 
     if user_id:
-        query = query.filter(Order.user_id == user_id)
+        query = query.where(Order.user_id == user_id)
         logger.info(f"Order Service: Filtering orders by user_id: {user_id}")
     if status:
-        query = query.filter(Order.status == status)
+        query = query.where(Order.status == status)
         logger.info(f"Order Service: Filtering orders by status: {status}")
+    if placed_after:
+        query = query.where(Order.order_date >= placed_after)
+    if placed_before:
+        query = query.where(Order.order_date < placed_before)
+    if cursor:
+        query = query.where(
+            tuple_(Order.order_date, Order.order_id) > cursor_position(cursor)
+        )
+
+    if user_id or len(shards) == 1:
+        db = shards.for_user(user_id) if user_id else shards.for_shard(0)
+        orders = [order_row_to_json(row) for row in db.execute(query.offset(skip).limit(limit))]
+        if include_items:
+            attach_order_items(db, orders)
+    else:
+        # Scatter-gather: every shard returns its first skip + limit orders, and
+        # the merged stream is cut down to the requested page
+        pages = shards.scatter(
+            lambda shard, db: [
+                order_row_to_json(row) for row in db.execute(query.limit(skip + limit))
+            ]
+        )
+        merged = heapq.merge(
+            *pages.values(), key=lambda order: (order["order_date"], order["order_id"])
+        )
+        orders = list(itertools.islice(merged, skip, skip + limit))
+        if include_items:
+            orders_by_shard = {}
+            for order in orders:
+                orders_by_shard.setdefault(
+                    shards.shard_map.shard_for_order(order["order_id"]), []
+                ).append(order)
+            shards.scatter(
+                lambda shard, db: attach_order_items(db, orders_by_shard[shard]),
+                shards=list(orders_by_shard),
+            )
 
-    orders = query.offset(skip).limit(limit).all()
     logger.info(
         f"Order Service: Retrieved {len(orders)} orders (skip={skip}, limit={limit})."
     )
-    return orders
+    headers = {}
+    if len(orders) == limit:
+        last = orders[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last["order_date"], last["order_id"])
+    return Response(
+        content=pydantic_core.to_json(orders), media_type="application/json", headers=headers
+    )
+
+
+def customer_orders_query(user_id: int, cursor: Optional[str], limit: int):
+    """A page of a customer's order summaries, newest first, answered by the user history index alone."""
+    query = (
+        select(*ORDER_SUMMARY_COLUMNS)
+        .where(Order.user_id == user_id)
+        .order_by(Order.order_date.desc(), Order.order_id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        query = query.where(
+            tuple_(Order.order_date, Order.order_id) < cursor_position(cursor)
+        )
+    return query
+
+
+@app.get(
+    "/customers/{user_id}/orders",
+    response_model=CustomerOrderPage,
+    summary="Retrieve a customer's order history",
+)
+def list_customer_orders(
+    user_id: int,
+    shards: ShardedSessions = Depends(get_sharded_read_db),
+    cursor: Optional[str] = Query(
+        None, description="next_cursor of the previous page; omit for the newest orders."
+    ),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Lists a customer's orders, newest first, as summaries without items; an
+    order's items are fetched on demand from /orders/{order_id}/items. Pages
+    are keyset-paginated: follow next_cursor until it is null.
+    """
+    logger.info(
+        f"Order Service: Listing order history for customer {user_id} (limit={limit})."
+    )
+    db = shards.for_user(user_id)
+    # One row past the page tells whether there is another page
+    rows = db.execute(customer_orders_query(user_id, cursor, limit + 1)).all()
+    orders = [order_summary_row_to_json(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.order_date, last.order_id)
+    logger.info(
+        f"Order Service: Retrieved {len(orders)} orders for customer {user_id}."
+    )
+    return Response(
+        content=pydantic_core.to_json({"orders": orders, "next_cursor": next_cursor}),
+        media_type="application/json",
+    )
 
 
 @app.get(
@@ -507,12 +976,13 @@ def list_orders(
     response_model=OrderResponse,
     summary="Retrieve a single order by ID",
 )
-def get_order(order_id: int, db: Session = Depends(get_db)):
+def get_order(order_id: int, shards: ShardedSessions = Depends(get_sharded_read_db)):
     logger.info(f"Order Service: Fetching order with ID: {order_id}")
+    db = shards.for_order(order_id)
     order = (
         db.query(Order)
         .options(joinedload(Order.items))
-        .filter(Order.order_id == order_id)
+        .filter(order_key(order_id))
         .first()
     )
     if not order:
@@ -533,12 +1003,15 @@ def get_order(order_id: int, db: Session = Depends(get_db)):
     summary="Update the status of an order",
 )
 async def update_order_status(
-    order_id: int, new_status: OrderStatusUpdate, db: Session = Depends(get_db)
+    order_id: int,
+    new_status: OrderStatusUpdate,
+    shards: ShardedSessions = Depends(get_sharded_db),
 ):
     logger.info(
         f"Order Service: Attempting to update status for order {order_id} to '{new_status.status}'."
     )
-    db_order = db.query(Order).filter(Order.order_id == order_id).first()
+    db = shards.for_order(order_id)
+    db_order = db.query(Order).filter(order_key(order_id)).first()
     if not db_order:
         logger.warning(
             f"Order Service: Order with ID {order_id} not found for status update."
@@ -547,7 +1020,7 @@ async def update_order_status(
             status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
         )
 
-    db_order.status = new_status
+    db_order.status = new_status.status
 
     try:
         db.add(db_order)
@@ -575,9 +1048,10 @@ async def update_order_status(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Delete an order by ID",
 )
-def delete_order(order_id: int, db: Session = Depends(get_db)):
+def delete_order(order_id: int, shards: ShardedSessions = Depends(get_sharded_db)):
     logger.info(f"Order Service: Attempting to delete order with ID: {order_id}")
-    order = db.query(Order).filter(Order.order_id == order_id).first()
+    db = shards.for_order(order_id)
+    order = db.query(Order).filter(order_key(order_id)).first()
     if not order:
         logger.warning(
             f"Order Service: Order with ID: {order_id} not found for deletion."
@@ -608,12 +1082,21 @@ def delete_order(order_id: int, db: Session = Depends(get_db)):
     response_model=List[OrderItemResponse],
     summary="Retrieve all items for a specific order",
 )
-def get_order_items(order_id: int, db: Session = Depends(get_db)):
+def get_order_items(
+    order_id: int, shards: ShardedSessions = Depends(get_sharded_read_db)
+):
     """
     Retrieves all order items belonging to a specific order ID.
     """
     logger.info(f"Order Service: Fetching items for order ID: {order_id}")
-    order = db.query(Order).filter(Order.order_id == order_id).first()
+    db = shards.for_order(order_id)
+    # The items come in the same pruned query as the order
+    order = (
+        db.query(Order)
+        .options(joinedload(Order.items))
+        .filter(order_key(order_id))
+        .first()
+    )
     if not order:
         logger.warning(
             f"Order Service: Order with ID {order_id} not found when fetching items."
@@ -622,7 +1105,6 @@ def get_order_items(order_id: int, db: Session = Depends(get_db)):
             status_code=status.HTTP_404_NOT_FOUND, detail="Order not found"
         )
 
-    # Access items through the relationship
     logger.info(
         f"Order Service: Retrieved {len(order.items)} items for order {order_id}."
     )
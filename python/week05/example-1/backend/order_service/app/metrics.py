@@ -0,0 +1,150 @@
+# week05/example-1/backend/order_service/app/metrics.py
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CollectorRegistry
+
+# --- Prometheus Metrics Initialization ---
+# Create a custom registry specific to this application instance
+registry = CollectorRegistry()
+APP_NAME = "order_service"  # Unique identifier for this service in metrics
+
+# Gauges: Saturation of the executor running RabbitMQ consumer DB work
+CONSUMER_EXECUTOR_WORKERS = Gauge(
+    "order_consumer_executor_workers",
+    "Threads available for consumer database work",
+    ["app_name"],
+    registry=registry,
+)
+CONSUMER_EXECUTOR_ACTIVE = Gauge(
+    "order_consumer_executor_active_tasks",
+    "Consumer database tasks currently running",
+    ["app_name"],
+    registry=registry,
+)
+CONSUMER_EXECUTOR_QUEUED = Gauge(
+    "order_consumer_executor_queued_tasks",
+    "Consumer database tasks waiting for a free thread",
+    ["app_name"],
+    registry=registry,
+)
+# Histograms: Time a consumer task waited for a thread, and how long it ran
+CONSUMER_TASK_WAIT = Histogram(
+    "order_consumer_task_wait_seconds",
+    "Time consumer database tasks spent queued for a thread",
+    ["app_name"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+    registry=registry,
+)
+CONSUMER_TASK_DURATION = Histogram(
+    "order_consumer_task_duration_seconds",
+    "Time consumer database tasks spent running",
+    ["app_name", "routing_key"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    registry=registry,
+)
+# Counter: Stock events processed, by routing key and outcome
+CONSUMER_MESSAGES = Counter(
+    "order_consumer_messages_total",
+    "Stock events processed by the order consumer",
+    ["app_name", "routing_key", "outcome"],
+    registry=registry,
+)
+
+# --- Database Connection Pool Metrics ---
+# Labelled by pool ("api" for request handlers, "consumer" for RabbitMQ consumers)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out of the pool",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections open beyond pool_size (counted against max_overflow)",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["app_name", "pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+    registry=registry,
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout seconds",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_INVALIDATIONS = Counter(
+    "db_pool_invalidations_total",
+    "Connections invalidated (hard: closed after an error; soft: replaced on next checkout)",
+    ["app_name", "pool", "kind"],
+    registry=registry,
+)
+
+# --- SQL Statement Metrics ---
+# Labelled by statement fingerprint: literals and bind parameters replaced with ?
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Time taken to execute a SQL statement, by statement fingerprint",
+    ["app_name", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5),
+    registry=registry,
+)
+DB_REQUEST_QUERIES = Histogram(
+    "db_request_queries",
+    "SQL statements executed per HTTP request",
+    ["app_name", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+    registry=registry,
+)
+DB_REPEATED_STATEMENTS = Counter(
+    "db_repeated_statements_total",
+    "Requests that ran one statement fingerprint more times than the N+1 threshold",
+    ["app_name", "route"],
+    registry=registry,
+)
+
+# --- Read Replica Metrics ---
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total",
+    "Read-only requests by the database they were sent to, and why",
+    ["app_name", "target", "reason"],
+    registry=registry,
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "Replication lag of the read replica at its last status check",
+    ["app_name"],
+    registry=registry,
+)
+
+# --- Inter-Service HTTP Client Metrics ---
+# Labelled by target host (the customer and product services)
+HTTP_CLIENT_REQUEST_DURATION = Histogram(
+    "http_client_request_duration_seconds",
+    "Time taken by requests to other services, including waiting for a pooled connection",
+    ["app_name", "target"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 3, 10),
+    registry=registry,
+)
+HTTP_CLIENT_REQUESTS_IN_FLIGHT = Gauge(
+    "http_client_requests_in_flight",
+    "Requests to other services currently waiting for a response",
+    ["app_name", "target"],
+    registry=registry,
+)
+HTTP_CLIENT_CONNECTIONS_OPENED = Counter(
+    "http_client_connections_opened_total",
+    "New connections opened to other services (requests on kept-alive ones don't count)",
+    ["app_name", "target"],
+    registry=registry,
+)
+HTTP_CLIENT_POOL_CONNECTIONS = Gauge(
+    "http_client_pool_connections",
+    "Connections held by the inter-service HTTP client pool, by state",
+    ["app_name", "state"],
+    registry=registry,
+)
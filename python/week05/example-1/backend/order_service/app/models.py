@@ -1,21 +1,104 @@
 # week05/example-1/backend/order_service/app/models.py
 
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, Numeric, String, Text
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    ForeignKeyConstraint,
+    Index,
+    Integer,
+    Numeric,
+    SmallInteger,
+    Text,
+    TypeDecorator,
+    event,
+)
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
-from .db import Base
+from .db import Base, shard_map
+from .ids import id_datetime, id_shard, order_ids, order_item_ids
+from .partitions import create_initial_partitions
+
+
+# --- Order Status Encoding ---
+# Statuses are stored as SMALLINT codes in the status_code column; the API and
+# the rest of the service keep using the names through Order.status. Codes are
+# persisted, so only ever add new ones. Tables created before the codes still
+# carry the text status column until status_migration.py contracts it
+STATUS_CODE_COLUMN = "status_code"
+ORDER_STATUS_CODES = {
+    "pending": 1,
+    "processing": 2,
+    "confirmed": 3,
+    "shipped": 4,
+    "completed": 5,
+    "cancelled": 6,
+    "failed": 7,
+}
+ORDER_STATUS_NAMES = {code: name for name, code in ORDER_STATUS_CODES.items()}
+# In-flight orders: the ones queue-like queries poll for, covered by a partial index
+ACTIVE_ORDER_STATUSES = ("pending", "processing")
+
+
+class OrderStatus(TypeDecorator):
+    """An order status name in Python, its SMALLINT code in the database."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else ORDER_STATUS_CODES[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else ORDER_STATUS_NAMES[value]
+
+
+def active_status_index_name(table_name: str) -> str:
+    return f"ix_{table_name}_active_status"
+
+
+def new_order_id(context) -> int:
+    # Generated in the application, on the shard of the order's user
+    user_id = context.get_current_parameters()["user_id"]
+    return order_ids.next_id(shard_map.shard_for_user(user_id))
+
+
+def new_order_date(context):
+    # An order is dated by its id's timestamp, so a lookup by id also knows the
+    # partition key (see order_key in main.py)
+    return id_datetime(context.get_current_parameters()["order_id"])
+
+
+def new_order_item_id(context) -> int:
+    return order_item_ids.next_id(id_shard(context.get_current_parameters()["order_id"]))
 
 
 class Order(Base):
     __tablename__ = "orders_week05_example_01"
+    # Monthly range partitions on order_date (see partitions.py); the partition
+    # key has to be part of the primary key
+    __table_args__ = (
+        Index(
+            "ix_orders_week05_example_01_order_date_brin",
+            "order_date",
+            postgresql_using="brin",
+        ),
+        {"postgresql_partition_by": "RANGE (order_date)"},
+    )
 
-    order_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    order_id = Column(
+        BigInteger, primary_key=True, index=True, autoincrement=False, default=new_order_id
+    )
     user_id = Column(Integer, nullable=False, index=True)
     order_date = Column(
-        DateTime(timezone=True), server_default=func.now(), nullable=False
+        DateTime(timezone=True),
+        primary_key=True,
+        default=new_order_date,
+        server_default=func.now(),
+        nullable=False,
     )
-    status = Column(String(50), nullable=False, default="pending")
+    status = Column(STATUS_CODE_COLUMN, OrderStatus, nullable=False, default="pending")
     total_amount = Column(Numeric(10, 2), nullable=False)
     shipping_address = Column(Text, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -30,19 +113,57 @@ class Order(Base):
         return f"<Order(id={self.order_id}, user_id={self.user_id}, status='{self.status}', total={self.total_amount})>"
 
 
+# Only in-flight orders are indexed, so scans for work to do skip the (much
+# larger) history of finished ones and come back oldest first
+Index(
+    active_status_index_name(Order.__tablename__),
+    Order.status,
+    Order.order_date,
+    Order.order_id,
+    postgresql_where=Order.status.in_(ACTIVE_ORDER_STATUSES),
+)
+
+# A customer's order history, newest first. The summary columns are carried in
+# the index, so a page of history is an index-only scan that never visits the
+# table; order_id breaks ties between orders placed at the same instant
+Index(
+    "ix_orders_week05_example_01_user_history",
+    Order.user_id,
+    Order.order_date.desc(),
+    Order.order_id.desc(),
+    postgresql_include=[STATUS_CODE_COLUMN, "total_amount"],
+)
+
+
 class OrderItem(Base):
     __tablename__ = "order_items_week05_example_01"
+    # Partitioned like orders, on a copy of the order's date, so an order and
+    # its items always live in (and are dropped with) the same month
+    __table_args__ = (
+        # Foreign key to the 'orders' table
+        ForeignKeyConstraint(
+            ["order_id", "order_date"],
+            ["orders_week05_example_01.order_id", "orders_week05_example_01.order_date"],
+        ),
+        Index(
+            "ix_order_items_week05_example_01_order_date_brin",
+            "order_date",
+            postgresql_using="brin",
+        ),
+        {"postgresql_partition_by": "RANGE (order_date)"},
+    )
 
-    order_item_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-
-    # Foreign key to the 'orders' table
-    order_id = Column(
-        Integer,
-        ForeignKey("orders_week05_example_01.order_id"),
-        nullable=False,
+    order_item_id = Column(
+        BigInteger,
+        primary_key=True,
         index=True,
+        autoincrement=False,
+        default=new_order_item_id,
     )
 
+    order_id = Column(BigInteger, nullable=False, index=True)
+    order_date = Column(DateTime(timezone=True), primary_key=True, nullable=False)
+
     product_id = Column(Integer, nullable=False, index=True)
     quantity = Column(Integer, nullable=False)
     price_at_purchase = Column(Numeric(10, 2), nullable=False)
@@ -55,3 +176,39 @@ class OrderItem(Base):
 
     def __repr__(self):
         return f"<OrderItem(id={self.order_item_id}, order_id={self.order_id}, product_id={self.product_id}, qty={self.quantity})>"
+
+
+# New tables get their monthly partitions as part of create_all
+event.listen(Order.__table__, "after_create", create_initial_partitions)
+event.listen(OrderItem.__table__, "after_create", create_initial_partitions)
+
+
+# --- Response Columns ---
+# Columns needed to build an OrderResponse and its OrderItemResponses
+ORDER_LIST_COLUMNS = (
+    Order.order_id,
+    Order.user_id,
+    Order.order_date,
+    Order.status,
+    Order.total_amount,
+    Order.shipping_address,
+    Order.created_at,
+    Order.updated_at,
+)
+# Everything in an OrderSummary, all covered by the user history index
+ORDER_SUMMARY_COLUMNS = (
+    Order.order_id,
+    Order.order_date,
+    Order.status,
+    Order.total_amount,
+)
+ORDER_ITEM_LIST_COLUMNS = (
+    OrderItem.order_item_id,
+    OrderItem.order_id,
+    OrderItem.product_id,
+    OrderItem.quantity,
+    OrderItem.price_at_purchase,
+    OrderItem.item_total,
+    OrderItem.created_at,
+    OrderItem.updated_at,
+)
@@ -0,0 +1,28 @@
+# week05/example-1/backend/order_service/app/pagination.py
+
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Tuple
+
+# --- Keyset Pagination Cursors ---
+# A cursor is the (order_date, order_id) of the last order on a page, opaque to
+# clients. The next page starts strictly after it, so every page costs one index
+# range scan however deep it is, and pages don't shift as new orders arrive
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(order_date: datetime, order_id: int) -> str:
+    payload = json.dumps([order_date.isoformat(), order_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Returns the (order_date, order_id) position; raises ValueError for a malformed cursor."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        order_date, order_id = json.loads(payload)
+        return datetime.fromisoformat(order_date), int(order_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}") from e
@@ -0,0 +1,161 @@
+# week05/example-1/backend/order_service/app/partitions.py
+
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# --- Partition Maintenance Configuration ---
+# Monthly partitions are kept ready this many months past the current one
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Partitions whose month ended more than this many months ago are dropped
+# (0 keeps every partition)
+PARTITION_RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = int(
+    os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", "21600")
+)
+
+
+def month_start(moment: datetime) -> datetime:
+    """First instant (UTC) of the month containing moment."""
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table_name: str, month: datetime) -> str:
+    return f"{table_name}_p{month:%Y_%m}"
+
+
+def is_partitioned(connection, table_name: str) -> bool:
+    relkind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table_name)"),
+        {"table_name": table_name},
+    ).scalar()
+    return relkind == "p"
+
+
+def create_month_partitions(
+    connection,
+    table_name: str,
+    now: Optional[datetime] = None,
+    months_ahead: int = PARTITION_MONTHS_AHEAD,
+) -> List[str]:
+    """
+    Creates the partitions of table_name for the current month and the next
+    months_ahead months, skipping ones that exist. Returns the names created.
+    """
+    current = month_start(now or datetime.now(timezone.utc))
+    created = []
+    for offset in range(months_ahead + 1):
+        start = add_months(current, offset)
+        name = partition_name(table_name, start)
+        if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+            continue
+        connection.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF {table_name} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+            )
+        )
+        created.append(name)
+    return created
+
+
+def drop_expired_partitions(
+    connection,
+    table_name: str,
+    now: Optional[datetime] = None,
+    retention_months: int = PARTITION_RETENTION_MONTHS,
+) -> List[str]:
+    """
+    Drops the monthly partitions of table_name older than retention_months.
+    Dropping a partition is a catalog operation, unlike deleting its rows.
+    Returns the names dropped.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -retention_months)
+    pattern = re.compile(rf"{re.escape(table_name)}_p(\d{{4}})_(\d{{2}})")
+    partitions = connection.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table_name)"
+        ),
+        {"table_name": table_name},
+    ).scalars()
+    dropped = []
+    for name in sorted(partitions):
+        match = pattern.fullmatch(name)
+        if match and datetime(
+            int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc
+        ) < cutoff:
+            # Detaching first is required for partitions referenced by a foreign
+            # key, and fails if rows in a referencing table still point into it
+            connection.execute(text(f"ALTER TABLE {table_name} DETACH PARTITION {name}"))
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def missing_month_partitions(
+    connection,
+    table_names: Sequence[str],
+    now: Optional[datetime] = None,
+    months_ahead: int = 1,
+) -> List[str]:
+    """
+    Names of the monthly partitions for the current month and the next
+    months_ahead months that don't exist. There is no DEFAULT partition, so
+    inserts dated in a missing month fail. Tables that aren't partitioned are skipped.
+    """
+    current = month_start(now or datetime.now(timezone.utc))
+    missing = []
+    for table_name in table_names:
+        if not is_partitioned(connection, table_name):
+            continue
+        for offset in range(months_ahead + 1):
+            name = partition_name(table_name, add_months(current, offset))
+            if not connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+                missing.append(name)
+    return missing
+
+
+def create_initial_partitions(table, connection, **kw):
+    """after_create hook: a freshly created partitioned table gets its partitions right away."""
+    create_month_partitions(connection, table.name)
+
+
+def maintain_partitions(
+    engine, table_names: Sequence[str], now: Optional[datetime] = None
+) -> Dict[str, List[str]]:
+    """
+    Creates upcoming partitions and drops expired ones for the given tables,
+    listed parents first (referencing tables are dropped from before the
+    tables they reference). Tables that aren't partitioned are skipped.
+    """
+    created, dropped = [], []
+    with engine.begin() as connection:
+        tables = [name for name in table_names if is_partitioned(connection, name)]
+        for name in sorted(set(table_names) - set(tables)):
+            logger.warning(
+                f"Order Service: Table {name} is not partitioned; migrate it to manage monthly partitions."
+            )
+        for name in tables:
+            created += create_month_partitions(connection, name, now)
+        for name in reversed(tables):
+            dropped += drop_expired_partitions(connection, name, now)
+    if created or dropped:
+        logger.info(
+            f"Order Service: Partition maintenance created {created or 'none'}, dropped {dropped or 'none'}."
+        )
+    return {"created": created, "dropped": dropped}
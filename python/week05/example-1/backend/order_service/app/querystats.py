@@ -0,0 +1,101 @@
+# week05/example-1/backend/order_service/app/querystats.py
+
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import re
+import time
+from typing import Optional
+
+from sqlalchemy import event
+
+from .metrics import (
+    APP_NAME,
+    DB_REPEATED_STATEMENTS,
+    DB_REQUEST_QUERIES,
+    DB_STATEMENT_DURATION,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Statement Instrumentation Configuration ---
+# A request running the same statement shape more than this many times is
+# reported as a likely N+1 query pattern
+DB_REPEATED_STATEMENT_THRESHOLD = int(
+    os.getenv("DB_REPEATED_STATEMENT_THRESHOLD", "10")
+)
+# Adds X-DB-Query-Count to every response; meant for development and tests, as it
+# tells any client how much database work a request took
+DB_QUERY_COUNT_HEADER = os.getenv("DB_QUERY_COUNT_HEADER", "false").lower() == "true"
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+# Fingerprints longer than this are cut off to keep metric labels readable
+MAX_FINGERPRINT_LENGTH = 200
+
+# Statements run by the current request, by fingerprint; None outside requests
+_request_queries: contextvars.ContextVar[Optional[collections.Counter]] = (
+    contextvars.ContextVar("request_queries", default=None)
+)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\$\d+|\b\d+(?:\.\d+)?\b")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Reduces a SQL statement to its shape: literals and bind parameters become ?,
+    IN lists collapse to (?), and whitespace is normalised.
+    """
+    shape = _STRING_LITERAL.sub("?", statement)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _PARAMETER_LIST.sub("(?)", shape)
+    shape = _WHITESPACE.sub(" ", shape).strip()
+    return shape[:MAX_FINGERPRINT_LENGTH]
+
+
+def instrument_statements(engine):
+    """Records the latency of every statement the engine runs, and counts it against the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_statement(statement, time.perf_counter() - context._query_started)
+
+
+def record_statement(statement: str, seconds: float):
+    """Records one statement's latency and counts it against the current request."""
+    shape = fingerprint(statement)
+    DB_STATEMENT_DURATION.labels(app_name=APP_NAME, statement=shape).observe(seconds)
+    queries = _request_queries.get()
+    if queries is not None:
+        queries[shape] += 1
+
+
+@contextlib.contextmanager
+def track_request_queries():
+    """Collects the statements run while the block is active, by fingerprint."""
+    queries = collections.Counter()
+    token = _request_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        _request_queries.reset(token)
+
+
+def report_request_queries(route: str, queries: collections.Counter):
+    """Exports the request's query count and flags statements repeated past the threshold."""
+    DB_REQUEST_QUERIES.labels(app_name=APP_NAME, route=route).observe(
+        sum(queries.values())
+    )
+    for shape, count in queries.items():
+        if count > DB_REPEATED_STATEMENT_THRESHOLD:
+            DB_REPEATED_STATEMENTS.labels(app_name=APP_NAME, route=route).inc()
+            logger.warning(
+                f"Order Service: Possible N+1 query in {route}: statement ran {count} times in one request: {shape}"
+            )
@@ -52,7 +52,11 @@ class OrderCreate(OrderBase):
 class OrderUpdate(OrderBase):
     user_id: Optional[int] = Field(None, ge=1)
     shipping_address: Optional[str] = Field(None, max_length=1000)
-    status: Optional[str] = Field(None, max_length=50)  # Allow status to be updated
+    status: Optional[str] = Field(
+        None,
+        max_length=50,
+        pattern="^(pending|processing|shipped|cancelled|confirmed|completed|failed)$",
+    )  # Allow status to be updated
 
 
 class OrderResponse(OrderBase):
@@ -78,3 +82,62 @@ class OrderStatusUpdate(BaseModel):
         pattern="^(pending|processing|shipped|cancelled|confirmed|completed|failed)$",
         description="New status for the order.",
     )
+
+
+# --- Customer Order History Schemas ---
+class OrderSummary(BaseModel):
+    order_id: int
+    order_date: datetime
+    status: str
+    total_amount: float
+
+
+class CustomerOrderPage(BaseModel):
+    orders: List[OrderSummary]
+    next_cursor: Optional[str] = Field(
+        None,
+        description="Pass as cursor to get the next (older) page; null on the last page.",
+    )
+
+
+# --- Row Serialization (list fast path) ---
+def order_row_to_json(row) -> dict:
+    """
+    Builds the OrderResponse JSON shape from a Core row of order columns, for list
+    endpoints that skip ORM objects and model validation. Items are appended later.
+    """
+    return {
+        "user_id": row.user_id,
+        "shipping_address": row.shipping_address,
+        "status": row.status,
+        "order_id": row.order_id,
+        "order_date": row.order_date,
+        "total_amount": float(row.total_amount),
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+        "items": [],
+    }
+
+
+def order_item_row_to_json(row) -> dict:
+    """Builds the OrderItemResponse JSON shape from a Core row of order item columns."""
+    return {
+        "product_id": row.product_id,
+        "quantity": row.quantity,
+        "price_at_purchase": float(row.price_at_purchase),
+        "order_item_id": row.order_item_id,
+        "order_id": row.order_id,
+        "item_total": float(row.item_total),
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
+
+
+def order_summary_row_to_json(row) -> dict:
+    """Builds the OrderSummary JSON shape from a Core row of order summary columns."""
+    return {
+        "order_id": row.order_id,
+        "order_date": row.order_date,
+        "status": row.status,
+        "total_amount": float(row.total_amount),
+    }
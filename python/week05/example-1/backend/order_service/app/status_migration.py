@@ -0,0 +1,308 @@
+# week05/example-1/backend/order_service/app/status_migration.py
+
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List, Set
+
+from sqlalchemy import text
+
+from .models import (
+    ACTIVE_ORDER_STATUSES,
+    ORDER_STATUS_CODES,
+    STATUS_CODE_COLUMN,
+    Order,
+    active_status_index_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Status Migration Configuration ---
+# Online move of tables created with a text status column to the SMALLINT codes
+# in status_code (see models.OrderStatus), in expand/contract steps:
+#   1. expand (python -m app.status_migration): adds status_code, keeps both
+#      columns in sync with a trigger, backfills existing rows in small batches
+#      and builds the partial index concurrently. Versions of the service that
+#      write the text column and versions that write codes both work from here.
+#   2. deploy the code version of the service to every replica.
+#   3. contract (python -m app.status_migration --contract): drops the trigger
+#      and the text column, once nothing reads or writes it.
+# Run each step on every shard; both are safe to re-run.
+STATUS_MIGRATION_BATCH_SIZE = int(os.getenv("STATUS_MIGRATION_BATCH_SIZE", "5000"))
+STATUS_MIGRATION_PAUSE_SECONDS = float(os.getenv("STATUS_MIGRATION_PAUSE_SECONDS", "0.05"))
+# Schema changes wait at most this long for their table lock, so they never
+# queue up traffic behind a long-running transaction
+STATUS_MIGRATION_LOCK_TIMEOUT = os.getenv("STATUS_MIGRATION_LOCK_TIMEOUT", "5s")
+# Upper bound on building one partition's index
+STATUS_MIGRATION_INDEX_TIMEOUT = os.getenv("STATUS_MIGRATION_INDEX_TIMEOUT", "30min")
+
+TEXT_STATUS_COLUMN = "status"
+
+
+def status_code_sql(column: str) -> str:
+    """SQL expression mapping a text status to its code."""
+    branches = " ".join(f"WHEN '{name}' THEN {code}" for name, code in ORDER_STATUS_CODES.items())
+    return f"CASE {column} {branches} END"
+
+
+def status_name_sql(column: str) -> str:
+    """SQL expression mapping a status code to its text name."""
+    branches = " ".join(f"WHEN {code} THEN '{name}'" for name, code in ORDER_STATUS_CODES.items())
+    return f"CASE {column} {branches} END"
+
+
+def table_columns(connection, table_name: str) -> Set[str]:
+    return set(
+        connection.execute(
+            text("SELECT column_name FROM information_schema.columns WHERE table_name = :table_name"),
+            {"table_name": table_name},
+        ).scalars()
+    )
+
+
+def list_partitions(connection, table_name: str) -> List[str]:
+    return list(
+        connection.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(:table_name) ORDER BY c.relname"
+            ),
+            {"table_name": table_name},
+        ).scalars()
+    )
+
+
+def require_status_codes(engine, table_name: str = Order.__tablename__):
+    """Startup check: this version of the service reads and writes status_code only."""
+    with engine.connect() as connection:
+        if STATUS_CODE_COLUMN not in table_columns(connection, table_name):
+            raise RuntimeError(
+                f"{table_name} has no {STATUS_CODE_COLUMN} column; run "
+                "`python -m app.status_migration` on every shard before deploying this version."
+            )
+
+
+def expand_status_column(
+    engine,
+    table_name: str,
+    batch_size: int = STATUS_MIGRATION_BATCH_SIZE,
+    pause_seconds: float = STATUS_MIGRATION_PAUSE_SECONDS,
+) -> int:
+    """
+    Adds status_code next to the text status, keeps the two in sync for every
+    write with a trigger (whichever column the writer set wins), and fills in
+    existing rows one batch per transaction. Returns the number of rows backfilled.
+    """
+    trigger = f"{table_name}_status_sync"
+    with engine.begin() as connection:
+        unknown = connection.execute(
+            text(
+                f"SELECT DISTINCT {TEXT_STATUS_COLUMN} FROM {table_name} "
+                f"WHERE {TEXT_STATUS_COLUMN} NOT IN "
+                f"({', '.join(repr(name) for name in ORDER_STATUS_CODES)})"
+            )
+        ).scalars().all()
+        if unknown:
+            raise ValueError(
+                f"Rows in {table_name} have statuses without a code: {', '.join(unknown)}."
+            )
+        connection.execute(text(f"SET LOCAL lock_timeout = '{STATUS_MIGRATION_LOCK_TIMEOUT}'"))
+        connection.execute(
+            text(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {STATUS_CODE_COLUMN} smallint")
+        )
+        connection.execute(
+            text(
+                f"CREATE OR REPLACE FUNCTION {trigger}() RETURNS trigger AS $$ BEGIN "
+                f"IF TG_OP = 'INSERT' THEN "
+                f"  IF NEW.{STATUS_CODE_COLUMN} IS NULL THEN "
+                f"    NEW.{STATUS_CODE_COLUMN} := {status_code_sql(f'NEW.{TEXT_STATUS_COLUMN}')}; "
+                f"  ELSE NEW.{TEXT_STATUS_COLUMN} := {status_name_sql(f'NEW.{STATUS_CODE_COLUMN}')}; "
+                f"  END IF; "
+                f"ELSIF NEW.{STATUS_CODE_COLUMN} IS DISTINCT FROM OLD.{STATUS_CODE_COLUMN} THEN "
+                f"  NEW.{TEXT_STATUS_COLUMN} := {status_name_sql(f'NEW.{STATUS_CODE_COLUMN}')}; "
+                f"ELSIF NEW.{TEXT_STATUS_COLUMN} IS DISTINCT FROM OLD.{TEXT_STATUS_COLUMN} THEN "
+                f"  NEW.{STATUS_CODE_COLUMN} := {status_code_sql(f'NEW.{TEXT_STATUS_COLUMN}')}; "
+                f"END IF; RETURN NEW; END $$ LANGUAGE plpgsql"
+            )
+        )
+        connection.execute(
+            text(
+                f"CREATE OR REPLACE TRIGGER {trigger} BEFORE INSERT OR UPDATE "
+                f"ON {table_name} FOR EACH ROW EXECUTE FUNCTION {trigger}()"
+            )
+        )
+
+    backfilled = 0
+    last_key = None
+    while True:
+        # Batches walk the primary key from where the last one ended, so each
+        # costs one index range scan however much of the table is done. Rows
+        # written since the trigger exists already have their code and are skipped
+        after_last = "WHERE (order_id, order_date) > (:last_id, :last_date) " if last_key else ""
+        with engine.begin() as connection:
+            batch = connection.execute(
+                text(
+                    f"WITH batch AS ("
+                    f"SELECT order_id, order_date FROM {table_name} {after_last}"
+                    f"ORDER BY order_id, order_date LIMIT :batch_size), "
+                    f"updated AS ("
+                    f"UPDATE {table_name} AS t "
+                    f"SET {STATUS_CODE_COLUMN} = {status_code_sql(f't.{TEXT_STATUS_COLUMN}')} "
+                    f"FROM batch WHERE t.order_id = batch.order_id AND t.order_date = batch.order_date "
+                    f"AND t.{STATUS_CODE_COLUMN} IS NULL RETURNING 1) "
+                    f"SELECT (SELECT count(*) FROM updated) AS updated, order_id, order_date "
+                    f"FROM batch ORDER BY order_id DESC, order_date DESC LIMIT 1"
+                ),
+                {
+                    "batch_size": batch_size,
+                    **({"last_id": last_key[0], "last_date": last_key[1]} if last_key else {}),
+                },
+            ).one_or_none()
+        if batch is None:
+            break
+        last_key = (batch.order_id, batch.order_date)
+        backfilled += batch.updated
+        logger.info(f"Order Service: Backfilled {backfilled} status codes in {table_name}.")
+        time.sleep(pause_seconds)
+
+    # NOT NULL is proven by a constraint validated without blocking writes, so
+    # SET NOT NULL itself skips the table scan under its lock
+    check = f"{table_name}_status_code_not_null"
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{STATUS_MIGRATION_LOCK_TIMEOUT}'"))
+        connection.execute(text(f"ALTER TABLE {table_name} DROP CONSTRAINT IF EXISTS {check}"))
+        connection.execute(
+            text(
+                f"ALTER TABLE {table_name} ADD CONSTRAINT {check} "
+                f"CHECK ({STATUS_CODE_COLUMN} IS NOT NULL) NOT VALID"
+            )
+        )
+    with engine.begin() as connection:
+        connection.execute(text(f"ALTER TABLE {table_name} VALIDATE CONSTRAINT {check}"))
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{STATUS_MIGRATION_LOCK_TIMEOUT}'"))
+        connection.execute(
+            text(f"ALTER TABLE {table_name} ALTER COLUMN {STATUS_CODE_COLUMN} SET NOT NULL")
+        )
+        connection.execute(text(f"ALTER TABLE {table_name} DROP CONSTRAINT {check}"))
+    return backfilled
+
+
+def contract_status_column(engine, table_name: str):
+    """Drops the sync trigger and the text status column."""
+    trigger = f"{table_name}_status_sync"
+    with engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{STATUS_MIGRATION_LOCK_TIMEOUT}'"))
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger} ON {table_name}"))
+        connection.execute(text(f"DROP FUNCTION IF EXISTS {trigger}()"))
+        connection.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {TEXT_STATUS_COLUMN}"))
+
+
+def create_active_status_index(engine, table_name: str) -> List[str]:
+    """
+    Builds the partial index on in-flight orders without blocking writes:
+    CONCURRENTLY per partition, then attached to an index on the parent
+    (partitioned tables can't be indexed concurrently as a whole). Each build
+    gives up after the lock and statement timeouts rather than waiting on a
+    long-running transaction indefinitely. Returns the indexes created.
+    """
+    index = next(
+        index
+        for index in Order.__table__.indexes
+        if index.name == active_status_index_name(Order.__tablename__)
+    )
+    columns = ", ".join(column.name for column in index.columns)
+    codes = ", ".join(str(ORDER_STATUS_CODES[name]) for name in ACTIVE_ORDER_STATUSES)
+    predicate = f"{STATUS_CODE_COLUMN} IN ({codes})"
+    name = active_status_index_name(table_name)
+
+    def index_validity(connection, index_name: str):
+        return connection.execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+            {"name": index_name},
+        ).scalar()
+
+    def build_concurrently(connection, index_name: str, target: str):
+        # A build that failed or timed out leaves an invalid index behind
+        if index_validity(connection, index_name) is False:
+            connection.execute(text(f"DROP INDEX CONCURRENTLY {index_name}"))
+        connection.execute(
+            text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                f"ON {target} ({columns}) WHERE {predicate}"
+            )
+        )
+
+    created = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(text(f"SET lock_timeout = '{STATUS_MIGRATION_LOCK_TIMEOUT}'"))
+        connection.execute(text(f"SET statement_timeout = '{STATUS_MIGRATION_INDEX_TIMEOUT}'"))
+        try:
+            if index_validity(connection, name):
+                return created
+            partitions = list_partitions(connection, table_name)
+            if not partitions:
+                build_concurrently(connection, name, table_name)
+                return [name]
+            # Invalid until every partition's index is attached
+            connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table_name} ({columns}) "
+                    f"WHERE {predicate}"
+                )
+            )
+            for partition in partitions:
+                partition_index = f"{partition}_active_status"
+                build_concurrently(connection, partition_index, partition)
+                connection.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
+                created.append(partition_index)
+            created.append(name)
+        finally:
+            # The connection goes back to the pool
+            connection.execute(text("RESET lock_timeout"))
+            connection.execute(text("RESET statement_timeout"))
+    return created
+
+
+def migrate_order_status(
+    engine,
+    table_name: str = Order.__tablename__,
+    batch_size: int = STATUS_MIGRATION_BATCH_SIZE,
+    contract: bool = False,
+) -> Dict[str, object]:
+    """
+    Runs the expand step on table_name if it still has only the text status,
+    ensures the partial index, and with contract=True drops the text column.
+    """
+    with engine.connect() as connection:
+        columns = table_columns(connection, table_name)
+    has_text_status = TEXT_STATUS_COLUMN in columns
+    backfilled = 0
+    if has_text_status:
+        backfilled = expand_status_column(engine, table_name, batch_size)
+    indexes = create_active_status_index(engine, table_name)
+    if contract and has_text_status:
+        contract_status_column(engine, table_name)
+        logger.info(f"Order Service: Dropped the text status column of {table_name}.")
+    return {
+        "backfilled": backfilled,
+        "indexes": indexes,
+        "contracted": contract and has_text_status,
+    }
+
+
+if __name__ == "__main__":
+    from .db import shard_map
+
+    parser = argparse.ArgumentParser(description="Move order statuses to SMALLINT codes.")
+    parser.add_argument(
+        "--contract",
+        action="store_true",
+        help="Drop the text status column (only once every replica runs the code version).",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for shard, shard_engine in enumerate(shard_map.engines):
+        result = migrate_order_status(shard_engine, contract=args.contract)
+        logger.info(f"Order Service: Shard {shard} status migration: {result}")
@@ -0,0 +1,202 @@
+# week05/example-1/backend/order_service/app/writes.py
+
+import logging
+import os
+import time
+from collections import namedtuple
+from decimal import Decimal
+from typing import List, Optional, Sequence, Tuple
+
+from psycopg.pq import TransactionStatus
+from psycopg.rows import namedtuple_row
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .db import note_write
+from .ids import id_datetime
+from .models import (
+    ORDER_ITEM_LIST_COLUMNS,
+    ORDER_LIST_COLUMNS,
+    ORDER_STATUS_CODES,
+    ORDER_STATUS_NAMES,
+    STATUS_CODE_COLUMN,
+    Order,
+    OrderItem,
+)
+from .querystats import record_statement
+
+logger = logging.getLogger(__name__)
+
+# --- Pipelined Write Configuration ---
+# On psycopg 3, the hot write paths (order insert, stock status updates) send
+# their statements and the COMMIT back to back in pipeline mode: one network
+# round trip per write instead of one per statement
+DB_PIPELINE_WRITES = os.getenv("DB_PIPELINE_WRITES", "true").lower() == "true"
+# Prepares those statements server-side on first use, so later executions on a
+# connection send only parameters. Turn off behind PgBouncer in transaction mode
+DB_PREPARED_WRITES = os.getenv("DB_PREPARED_WRITES", "true").lower() == "true"
+
+ORDERS_TABLE = Order.__tablename__
+ORDER_ITEMS_TABLE = OrderItem.__tablename__
+
+
+def returning_list(columns) -> str:
+    # Columns come back under their attribute names (status_code AS status)
+    return ", ".join(
+        column.expression.name
+        if column.expression.name == column.key
+        else f"{column.expression.name} AS {column.key}"
+        for column in columns
+    )
+
+
+INSERT_ORDER_SQL = f"""
+INSERT INTO {ORDERS_TABLE}
+    (order_id, order_date, user_id, shipping_address, total_amount, {STATUS_CODE_COLUMN})
+VALUES (%(order_id)s, %(order_date)s, %(user_id)s, %(shipping_address)s, %(total_amount)s, %(status)s)
+RETURNING {returning_list(ORDER_LIST_COLUMNS)}
+"""
+# All of an order's items in one statement whose text doesn't depend on the item
+# count (so it is prepared once): the item columns arrive as parallel arrays
+INSERT_ORDER_ITEMS_SQL = f"""
+INSERT INTO {ORDER_ITEMS_TABLE}
+    (order_item_id, order_id, order_date, product_id, quantity, price_at_purchase, item_total)
+SELECT i.order_item_id, %(order_id)s, %(order_date)s, i.product_id, i.quantity, i.price_at_purchase, i.item_total
+FROM unnest(
+    %(order_item_ids)s::bigint[],
+    %(product_ids)s::integer[],
+    %(quantities)s::integer[],
+    %(prices)s::numeric[],
+    %(item_totals)s::numeric[]
+) AS i(order_item_id, product_id, quantity, price_at_purchase, item_total)
+RETURNING {returning_list(ORDER_ITEM_LIST_COLUMNS)}
+"""
+UPDATE_ORDER_STATUS_SQL = f"""
+UPDATE {ORDERS_TABLE} SET {STATUS_CODE_COLUMN} = %(status)s, updated_at = now()
+WHERE order_id = %(order_id)s AND order_date = %(order_date)s
+RETURNING order_id, {STATUS_CODE_COLUMN} AS status
+"""
+
+
+def pipeline_enabled(db: Session) -> bool:
+    return DB_PIPELINE_WRITES and db.get_bind().dialect.driver == "psycopg"
+
+
+def with_status_name(row):
+    # Raw SQL bypasses the OrderStatus type: decode the stored code here
+    return row._replace(status=ORDER_STATUS_NAMES[row.status])
+
+
+def run_and_commit(
+    db: Session,
+    statements: Sequence[Tuple[str, dict]],
+    pipelined: Optional[bool] = None,
+) -> List[list]:
+    """
+    Runs the statements in order, commits, and returns each one's rows. In
+    pipeline mode nothing waits for a result until everything, COMMIT included,
+    has been sent, so the whole write costs one round trip; otherwise each
+    statement waits for the one before.
+    """
+    if pipelined is None:
+        pipelined = pipeline_enabled(db)
+    if not pipelined:
+        connection = db.connection()
+        results = []
+        for sql, params in statements:
+            result = connection.exec_driver_sql(sql, params)
+            # Same row type as the pipelined path
+            row_type = namedtuple("Row", result.keys())
+            results.append([row_type(*row) for row in result])
+        db.commit()
+        return results
+
+    dbapi_connection = db.connection().connection.dbapi_connection
+    # When the write is the session's whole transaction, BEGIN and COMMIT travel
+    # in the pipeline too. psycopg's implicit BEGIN would wait for its own sync,
+    # so the connection is in autocommit mode for the duration
+    owns_transaction = (
+        isinstance(db.get_bind(), Engine)
+        and dbapi_connection.info.transaction_status == TransactionStatus.IDLE
+    )
+    started = time.perf_counter()
+    cursors = []
+    if owns_transaction:
+        dbapi_connection.autocommit = True
+    try:
+        with dbapi_connection.pipeline():
+            if owns_transaction:
+                dbapi_connection.execute("BEGIN")
+            for sql, params in statements:
+                cursor = dbapi_connection.cursor(row_factory=namedtuple_row)
+                cursor.execute(sql, params, prepare=DB_PREPARED_WRITES)
+                cursors.append(cursor)
+            if owns_transaction:
+                dbapi_connection.execute("COMMIT")
+        # Leaving the pipeline sends it and waits for every result
+    except Exception:
+        if owns_transaction:
+            dbapi_connection.rollback()
+        raise
+    finally:
+        if owns_transaction:
+            dbapi_connection.autocommit = False
+    # The pipelined statements bypass the cursor events that note writes
+    note_write()
+    db.commit()  # Already committed above when the write owned the transaction
+    # The statements bypass SQLAlchemy's events; they shared one round trip, so
+    # each is recorded with the pipeline's duration
+    elapsed = time.perf_counter() - started
+    for sql, _ in statements:
+        record_statement(sql, elapsed)
+    return [cursor.fetchall() for cursor in cursors]
+
+
+def insert_order(
+    db: Session, order: dict, items: Sequence[dict], pipelined: Optional[bool] = None
+):
+    """
+    Inserts an order (keys: the INSERT_ORDER_SQL parameters) and its items
+    (order_item_id, product_id, quantity, price_at_purchase, item_total) and
+    commits. Returns the order row and its item rows, in item id order.
+    """
+    items_params = {
+        "order_id": order["order_id"],
+        "order_date": order["order_date"],
+        "order_item_ids": [item["order_item_id"] for item in items],
+        "product_ids": [item["product_id"] for item in items],
+        "quantities": [item["quantity"] for item in items],
+        "prices": [Decimal(str(item["price_at_purchase"])) for item in items],
+        "item_totals": [item["item_total"] for item in items],
+    }
+    order_params = {**order, "status": ORDER_STATUS_CODES[order["status"]]}
+    order_rows, item_rows = run_and_commit(
+        db,
+        [(INSERT_ORDER_SQL, order_params), (INSERT_ORDER_ITEMS_SQL, items_params)],
+        pipelined,
+    )
+    return with_status_name(order_rows[0]), sorted(
+        item_rows, key=lambda row: row.order_item_id
+    )
+
+
+def set_order_status(
+    db: Session, order_id: int, new_status: str, pipelined: Optional[bool] = None
+) -> Optional[str]:
+    """Sets an order's status and commits; returns the status, or None if there is no such order."""
+    (rows,) = run_and_commit(
+        db,
+        [
+            (
+                UPDATE_ORDER_STATUS_SQL,
+                {
+                    "order_id": order_id,
+                    # The partition key, so only the order's month is scanned
+                    "order_date": id_datetime(order_id),
+                    "status": ORDER_STATUS_CODES[new_status],
+                },
+            )
+        ],
+        pipelined,
+    )
+    return with_status_name(rows[0]).status if rows else None
@@ -0,0 +1,157 @@
+# week05/example-1/backend/order_service/benchmarks/order_writes.py
+
+"""
+Latency benchmark for the hot write paths with and without pipeline mode.
+
+Inserts orders (with items) and applies stock status updates through
+app.writes, once with one round trip per statement and once pipelined with
+server-side prepared statements. A local TCP proxy in front of the configured
+database adds --rtt-ms to every round trip, to show what the saved round trips
+are worth on a real network. From the order_service directory:
+
+    python -m benchmarks.order_writes --rtt-ms 2 --orders 200 --items 3
+"""
+
+import argparse
+import queue
+import socket
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.orm import sessionmaker
+
+from app.db import DATABASE_URL, Base
+from app.ids import id_datetime, order_ids, order_item_ids
+from app.writes import insert_order, set_order_status
+
+
+class LatencyProxy:
+    """
+    Forwards TCP connections to the database, delivering every chunk half a
+    round trip after it arrived; chunks in flight together are delayed together.
+    """
+
+    def __init__(self, target_host: str, target_port: int, rtt_seconds: float):
+        self.target = (target_host, target_port)
+        self.one_way_delay = rtt_seconds / 2
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            server = socket.create_connection(self.target)
+            # Forward small protocol messages at once, as libpq does on its own socket
+            for connection in (client, server):
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for source, destination in ((client, server), (server, client)):
+                in_flight = queue.Queue()
+                threading.Thread(
+                    target=self._receive, args=(source, in_flight), daemon=True
+                ).start()
+                threading.Thread(
+                    target=self._deliver, args=(in_flight, destination), daemon=True
+                ).start()
+
+    def _receive(self, source: socket.socket, in_flight: queue.Queue):
+        try:
+            while chunk := source.recv(65536):
+                in_flight.put((time.perf_counter() + self.one_way_delay, chunk))
+        except OSError:
+            pass
+        in_flight.put((0, b""))
+
+    def _deliver(self, in_flight: queue.Queue, destination: socket.socket):
+        try:
+            while True:
+                due, chunk = in_flight.get()
+                if not chunk:
+                    break
+                time.sleep(max(0.0, due - time.perf_counter()))
+                destination.sendall(chunk)
+        except OSError:
+            pass
+        finally:
+            destination.close()
+
+
+def place_order(db, items: int, pipelined: bool) -> int:
+    order_id = order_ids.next_id(0)
+    insert_order(
+        db,
+        {
+            "order_id": order_id,
+            "order_date": id_datetime(order_id),
+            "user_id": 1,
+            "shipping_address": "Benchmark Street 1",
+            "total_amount": Decimal("9.99") * items,
+            "status": "pending",
+        },
+        [
+            {
+                "order_item_id": order_item_ids.next_id(0),
+                "product_id": product_id,
+                "quantity": 1,
+                "price_at_purchase": 9.99,
+                "item_total": Decimal("9.99"),
+            }
+            for product_id in range(1, items + 1)
+        ],
+        pipelined=pipelined,
+    )
+    return order_id
+
+
+def measure(name: str, operation, count: int):
+    # Warm up the connection (and, pipelined, prepare the statements)
+    for _ in range(5):
+        operation()
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(
+        f"{name:<24}{statistics.median(latencies) * 1000:>10.2f}"
+        f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>10.2f}"
+    )
+
+
+def main(args):
+    url = make_url(DATABASE_URL)
+    proxy = LatencyProxy(url.host, url.port or 5432, args.rtt_ms / 1000)
+    engine = create_engine(url.set(host="127.0.0.1", port=proxy.port))
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine)
+
+    print(f"simulated round trip: {args.rtt_ms} ms, {args.items} items per order")
+    print(f"{'path':<24}{'p50 ms':>10}{'p99 ms':>10}")
+    for pipelined in (False, True):
+        mode = "pipelined" if pipelined else "sequential"
+        with session_factory() as db:
+            placed = []
+            measure(
+                f"create order {mode}",
+                lambda: placed.append(place_order(db, args.items, pipelined)),
+                args.orders,
+            )
+            statuses = iter(placed)
+            measure(
+                f"stock update {mode}",
+                lambda: set_order_status(db, next(statuses), "confirmed", pipelined),
+                min(args.orders, len(placed) - 5),
+            )
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--items", type=int, default=3)
+    main(parser.parse_args())
@@ -1,18 +1,43 @@
 # week05/example-1/backend/order_service/tests/test_main.py
 
+import asyncio
+import collections
 import logging
+import re
 import time
+from datetime import datetime, timezone
 from decimal import Decimal
-from unittest.mock import AsyncMock, patch
+from types import SimpleNamespace
+from unittest.mock import patch
 
+import httpcore
+import httpx
 import pytest
-from app.db import SessionLocal, engine, get_db
+from app.db import (
+    DATABASE_URL,
+    SessionLocal,
+    ShardMap,
+    engine,
+    get_db,
+    track_write_position,
+)
+from app.http_client import InstrumentedTransport, create_http_client, get_http_client
+from app.ids import SnowflakeGenerator, id_datetime, id_shard, order_ids, order_item_ids
 from app.main import PRODUCT_SERVICE_URL, app
 from app.models import Base, Order, OrderItem
+from app.partitions import (
+    add_months,
+    create_month_partitions,
+    drop_expired_partitions,
+    missing_month_partitions,
+    month_start,
+    partition_name,
+)
 
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, make_url, select, text
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 
 # Suppress noisy logs from SQLAlchemy/FastAPI/Uvicorn during tests for cleaner output
 logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
@@ -84,18 +109,34 @@ def db_session_for_test():
 
 @pytest.fixture(scope="module")
 def client():
-    with TestClient(app) as test_client:
+    # Tests count statements through the X-DB-Query-Count header, off by default
+    with patch("app.main.DB_QUERY_COUNT_HEADER", True), TestClient(app) as test_client:
         yield test_client
 
 
 @pytest.fixture(scope="function")
-def mock_httpx_client():
-    with patch("app.main.httpx.AsyncClient") as mock_async_client_cls:
-        mock_client_instance = AsyncMock()
-        mock_async_client_cls.return_value.__aenter__.return_value = (
-            mock_client_instance
-        )
-        yield mock_client_instance
+def mock_services():
+    """
+    Answers the order service's calls to other services from a MockTransport.
+    Tests map (method, path) to a response, or to a handler taking the request;
+    every request made is kept in .requests.
+    """
+    services = SimpleNamespace(routes={}, requests=[])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        services.requests.append(request)
+        route = services.routes.get((request.method, request.url.path))
+        if route is None:
+            return httpx.Response(404)
+        return route(request) if callable(route) else route
+
+    mock_client = create_http_client(httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    try:
+        yield services
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        asyncio.run(mock_client.aclose())
 
 
 # --- Order Service Tests ---
@@ -111,3 +152,835 @@ def test_health_check(client: TestClient):
     response = client.get("/health")
     assert response.status_code == 200
     assert response.json() == {"status": "ok", "service": "order-service"}
+
+
+def test_stock_event_applied_on_consumer_executor(
+    client: TestClient, db_session_for_test: Session
+):
+    """Stock events update the order on the consumer executor and show up in /metrics."""
+    from app.main import apply_stock_event, consumer_executor
+
+    db_order = Order(user_id=1, total_amount=Decimal("10.00"), status="pending")
+    db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+    order_key = (db_order.order_id, db_order.order_date)
+
+    outcome = asyncio.run(
+        consumer_executor.run(
+            "product.stock.deducted",
+            apply_stock_event,
+            lambda: db_session_for_test,
+            order_key[0],
+            "product.stock.deducted",
+            None,
+        )
+    )
+    assert outcome == "confirmed"
+    assert (
+        db_session_for_test.get(Order, order_key).status
+        == "confirmed"
+    )
+
+    missing = asyncio.run(
+        consumer_executor.run(
+            "product.stock.deduction.failed",
+            apply_stock_event,
+            lambda: db_session_for_test,
+            999999,
+            "product.stock.deduction.failed",
+            [],
+        )
+    )
+    assert missing == "order_not_found"
+
+    metrics_text = client.get("/metrics").text
+    assert 'order_consumer_executor_workers{app_name="order_service"}' in metrics_text
+    assert 'order_consumer_executor_queued_tasks{app_name="order_service"} 0.0' in metrics_text
+    assert (
+        'order_consumer_task_duration_seconds_count{app_name="order_service",routing_key="product.stock.deducted"} 1.0'
+        in metrics_text
+    )
+
+
+def test_query_count_header_and_repeated_statement_detection(
+    client: TestClient, db_session_for_test: Session
+):
+    """Responses report their query count, and repeated statement shapes are flagged."""
+    from app.metrics import registry
+    from app.querystats import fingerprint, report_request_queries
+    from prometheus_client import generate_latest
+
+    db_order = Order(user_id=1, total_amount=Decimal("10.00"), status="pending")
+    db_order.items.append(
+        OrderItem(
+            product_id=1,
+            quantity=2,
+            price_at_purchase=Decimal("5.00"),
+            item_total=Decimal("10.00"),
+        )
+    )
+    db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+    db_session_for_test.expire_all()
+
+    response = client.get(f"/orders/{db_order.order_id}/items")
+    assert response.status_code == 200
+    # The order and its items in one query
+    assert response.headers["X-DB-Query-Count"] == "1"
+
+    assert (
+        fingerprint("SELECT * FROM t WHERE id = %(id_1)s AND name = 'x' AND n IN (1, 2, 3)")
+        == "SELECT * FROM t WHERE id = ? AND name = ? AND n IN (?)"
+    )
+    report_request_queries(
+        "/orders/{order_id}/items", collections.Counter({"SELECT ? FROM t": 11})
+    )
+    metrics_text = generate_latest(registry).decode()
+    assert (
+        'db_repeated_statements_total{app_name="order_service",route="/orders/{order_id}/items"} 1.0'
+        in metrics_text
+    )
+    assert (
+        'db_request_queries_count{app_name="order_service",route="/orders/{order_id}/items"} 2.0'
+        in metrics_text
+    )
+
+
+def test_list_orders_fast_path_matches_single_order_response(
+    client: TestClient, db_session_for_test: Session
+):
+    """Orders listed from Core rows serialize exactly like the ORM-backed single-order route."""
+    for user_id, quantities in ((41, (1, 2)), (42, (3,))):
+        db_order = Order(user_id=user_id, total_amount=Decimal("0"), status="pending")
+        for quantity in quantities:
+            db_order.items.append(
+                OrderItem(
+                    product_id=quantity,
+                    quantity=quantity,
+                    price_at_purchase=Decimal("2.50"),
+                    item_total=Decimal("2.50") * quantity,
+                )
+            )
+        db_order.total_amount = sum(item.item_total for item in db_order.items)
+        db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+
+    response = client.get("/orders/", params={"user_id": 41})
+    assert response.status_code == 200
+    listed = response.json()
+    assert len(listed) == 1 and len(listed[0]["items"]) == 2
+    # One query for the page of orders, one for all of their items
+    assert response.headers["X-DB-Query-Count"] == "2"
+    assert listed[0] == client.get(f"/orders/{listed[0]['order_id']}").json()
+
+
+def test_recent_orders_touch_only_current_partitions_and_old_months_are_dropped(
+    client: TestClient, db_session_for_test: Session
+):
+    """Date-filtered reads prune old monthly partitions, and expiring a month drops its partitions."""
+    connection = db_session_for_test.connection()
+    current_month = month_start(datetime.now(timezone.utc))
+    old_month = add_months(current_month, -2)
+    for table in (Order.__tablename__, OrderItem.__tablename__):
+        assert create_month_partitions(connection, table, now=old_month, months_ahead=1) == [
+            partition_name(table, old_month),
+            partition_name(table, add_months(old_month, 1)),
+        ]
+
+    for order_date in (old_month, None):
+        db_order = Order(
+            user_id=77, total_amount=Decimal("1.00"), status="pending", order_date=order_date
+        )
+        db_order.items.append(
+            OrderItem(
+                product_id=1,
+                quantity=1,
+                price_at_purchase=Decimal("1.00"),
+                item_total=Decimal("1.00"),
+            )
+        )
+        db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+
+    response = client.get(
+        "/orders/", params={"user_id": 77, "placed_after": current_month.isoformat()}
+    )
+    assert response.status_code == 200
+    assert [len(order["items"]) for order in response.json()] == [1]
+
+    plan = "\n".join(
+        connection.execute(
+            text(f"EXPLAIN SELECT order_id FROM {Order.__tablename__} WHERE order_date >= :since"),
+            {"since": current_month},
+        ).scalars()
+    )
+    assert partition_name(Order.__tablename__, current_month) in plan
+    assert partition_name(Order.__tablename__, old_month) not in plan
+
+    # Ready while this and next month's partitions exist on every shard
+    ready = client.get("/health/ready")
+    assert ready.status_code == 200 and ready.json()["checks"]["partitions"] == "available"
+    a_year_on = add_months(current_month, 12)
+    with patch(
+        "app.main.missing_month_partitions",
+        lambda connection, tables: missing_month_partitions(connection, tables, now=a_year_on),
+    ):
+        not_ready = client.get("/health/ready")
+    assert not_ready.status_code == 503
+    assert partition_name(Order.__tablename__, a_year_on) in not_ready.json()["missing_partitions"]
+
+    # Items reference orders, so their partitions are dropped first
+    for table in (OrderItem.__tablename__, Order.__tablename__):
+        assert drop_expired_partitions(connection, table, retention_months=1) == [
+            partition_name(table, old_month)
+        ]
+    assert len(client.get("/orders/", params={"user_id": 77}).json()) == 1
+
+
+def test_order_lookups_by_id_scan_only_the_order_month_partition(
+    client: TestClient, db_session_for_test: Session
+):
+    """Lookups by id also filter on the id's timestamp, so they touch one orders and one items partition."""
+    from app.main import order_key
+    from app.writes import UPDATE_ORDER_STATUS_SQL
+
+    db_order = Order(user_id=12, total_amount=Decimal("2.00"), status="pending")
+    db_order.items.append(
+        OrderItem(product_id=1, quantity=1, price_at_purchase=Decimal("2.00"), item_total=Decimal("2.00"))
+    )
+    db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+    order_id = db_order.order_id
+    assert db_order.order_date == id_datetime(order_id)
+    assert client.get(f"/orders/{order_id}/items").json()[0]["product_id"] == 1
+
+    connection = db_session_for_test.connection()
+    month = month_start(id_datetime(order_id))
+    lookup = select(Order).options(joinedload(Order.items)).where(order_key(order_id)).compile(
+        dialect=connection.dialect
+    )
+    plans = [
+        connection.exec_driver_sql(f"EXPLAIN {lookup}", lookup.params).scalars().all(),
+        connection.exec_driver_sql(
+            f"EXPLAIN {UPDATE_ORDER_STATUS_SQL}",
+            {"order_id": order_id, "order_date": id_datetime(order_id), "status": 3},
+        ).scalars().all(),
+    ]
+    partitions = connection.execute(
+        text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = ANY(:tables ::regclass[])"),
+        {"tables": [Order.__tablename__, OrderItem.__tablename__]},
+    ).scalars().all()
+    assert len(partitions) > 2  # Several months exist; each lookup scans one
+    scanned = [
+        {name for name in partitions if re.search(rf"\b{name}\b", "\n".join(plan))}
+        for plan in plans
+    ]
+    assert scanned[0] == {
+        partition_name(Order.__tablename__, month),
+        partition_name(OrderItem.__tablename__, month),
+    }
+    assert scanned[1] == {partition_name(Order.__tablename__, month)}
+
+
+@pytest.fixture(scope="function")
+def second_shard():
+    """A second local PostgreSQL database acting as shard 1 (shard 0 is the test database)."""
+    shard_url = make_url(DATABASE_URL).set(database="orders_shard_1_test")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if not connection.execute(
+            text("SELECT 1 FROM pg_database WHERE datname = :name"),
+            {"name": shard_url.database},
+        ).scalar():
+            connection.execute(text(f"CREATE DATABASE {shard_url.database}"))
+    shard_engine = create_engine(shard_url)
+    Base.metadata.drop_all(bind=shard_engine)
+    Base.metadata.create_all(bind=shard_engine)
+    try:
+        yield shard_engine
+    finally:
+        Base.metadata.drop_all(bind=shard_engine)
+        shard_engine.dispose()
+
+
+def test_orders_are_sharded_by_user_and_listed_by_scatter_gather(
+    client: TestClient, db_session_for_test: Session, second_shard
+):
+    """Orders live on their user's shard, ids decode to it, and unfiltered listings merge all shards."""
+    shards = ShardMap([engine, second_shard])
+    users = {}
+    for user_id in range(1, 100):
+        users.setdefault(shards.shard_for_user(user_id), user_id)
+        if len(users) == 2:
+            break
+
+    shard1_session = shards.sessionmakers[1]()
+    order_ids_by_shard = {}
+    for shard, db in ((0, db_session_for_test), (1, shard1_session)):
+        order_id = order_ids_by_shard[shard] = order_ids.next_id(shard)
+        assert shards.shard_for_order(order_id) == shard
+        db_order = Order(
+            order_id=order_id,
+            order_date=id_datetime(order_id),
+            user_id=users[shard],
+            total_amount=Decimal("3.00"),
+            status="pending",
+        )
+        db_order.items.append(
+            OrderItem(
+                product_id=shard + 1,
+                quantity=1,
+                price_at_purchase=Decimal("3.00"),
+                item_total=Decimal("3.00"),
+            )
+        )
+        db.add(db_order)
+        db.flush()
+    shard1_session.commit()
+    shard1_session.close()
+
+    with patch("app.db.shard_map", shards):
+        listed = client.get("/orders/").json()
+        assert [order["order_id"] for order in listed] == [
+            order_ids_by_shard[0],
+            order_ids_by_shard[1],
+        ]
+        assert [order["items"][0]["product_id"] for order in listed] == [1, 2]
+        assert client.get("/orders/", params={"skip": 1}).json() == listed[1:]
+
+        user_orders = client.get("/orders/", params={"user_id": users[1]}).json()
+        assert user_orders == listed[1:]
+        assert client.get(f"/orders/{listed[1]['order_id']}").json() == listed[1]
+        assert len(client.get(f"/orders/{listed[1]['order_id']}/items").json()) == 1
+
+
+def test_overlapping_scatters_run_their_shard_calls_at_the_same_time():
+    """Concurrent requests' scatters don't queue behind each other for shard threads."""
+    import threading
+
+    shards = ShardMap([engine, engine], connections_per_shard=2)
+    # Every shard call of both scatters has to be running at once to get past it
+    all_running = threading.Barrier(4, timeout=5)
+
+    def shard_call(shard: int) -> int:
+        all_running.wait()
+        return shard
+
+    def scatter(results: list):
+        results.extend(
+            shards.run_concurrently([lambda shard=shard: shard_call(shard) for shard in (0, 1)])
+        )
+
+    results = [[], []]
+    threads = [threading.Thread(target=scatter, args=(result,)) for result in results]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not all_running.broken
+    assert results == [[0, 1], [0, 1]]
+
+
+def test_snowflake_ids_are_time_ordered_unique_and_decode_their_shard():
+    """Ids sort by creation time, survive clock steps backwards and sequence overflow, and fit in 53 bits."""
+    now = [1760000000.0]
+    generator = SnowflakeGenerator(worker_id=3, clock=lambda: now[0])
+    ids = [generator.next_id(shard=5) for _ in range(100)]  # Overflows one millisecond's sequence
+    now[0] -= 5  # Clock stepped backwards
+    ids += [generator.next_id(shard=2)]
+    now[0] += 60
+    ids += [generator.next_id(shard=2)]
+
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+    assert all(0 < snowflake_id < 2**53 for snowflake_id in ids)
+    assert [id_shard(snowflake_id) for snowflake_id in ids[-3:]] == [5, 2, 2]
+    assert id_datetime(ids[-1]) == datetime.fromtimestamp(1760000055.0, tz=timezone.utc)
+
+    # Another worker in the same millisecond never produces the same id
+    other = SnowflakeGenerator(worker_id=4, clock=lambda: now[0])
+    assert other.next_id(shard=2) not in ids
+    with pytest.raises(ValueError):
+        SnowflakeGenerator(worker_id=16)
+
+
+def test_create_order_takes_two_statements_and_reads_nothing_back(
+    client: TestClient, db_session_for_test: Session, mock_services
+):
+    """create_order writes an order in two statements: one INSERT per table, with RETURNING."""
+    mock_services.routes["GET", "/customers/7"] = httpx.Response(
+        200, json={"email": "c@example.com", "shipping_address": "1 Main St"}
+    )
+    for product_id in (1, 2, 3):
+        mock_services.routes["GET", f"/products/{product_id}"] = httpx.Response(
+            200, json={"product_id": product_id, "name": f"Product {product_id}", "stock_quantity": 5}
+        )
+
+    with patch("app.querystats.DB_STATEMENT_DURATION") as statement_duration:
+        response = client.post(
+            "/orders/",
+            json={
+                "user_id": 7,
+                "items": [
+                    {"product_id": product_id, "quantity": 1, "price_at_purchase": 2.0}
+                    for product_id in (1, 2, 3)
+                ],
+            },
+        )
+    assert response.status_code == 201
+    created = response.json()
+    assert id_shard(created["order_id"]) == 0
+    assert datetime.fromisoformat(created["order_date"]) == id_datetime(created["order_id"])
+    assert sorted(item["order_item_id"] for item in created["items"]) == [
+        item["order_item_id"] for item in created["items"]
+    ]
+    statements = [call.kwargs["statement"] for call in statement_duration.labels.call_args_list]
+    # All three items go in one multi-row INSERT, and nothing is SELECTed back
+    assert response.headers["X-DB-Query-Count"] == "2"
+    assert [statement.split(" ", 3)[:3] for statement in statements] == [
+        ["INSERT", "INTO", Order.__tablename__],
+        ["INSERT", "INTO", OrderItem.__tablename__],
+    ]
+    assert [item["product_id"] for item in created["items"]] == [1, 2, 3]
+    assert created["status"] == "pending" and created["created_at"]
+
+
+def test_hot_writes_pipelined_with_prepared_statements_match_sequential(
+    db_session_for_test: Session,
+):
+    """Pipelined and one-at-a-time writes return the same rows; pipelined ones are prepared server-side."""
+    from app.writes import insert_order, pipeline_enabled, set_order_status
+
+    assert pipeline_enabled(db_session_for_test)
+    results = {}
+    for pipelined in (False, True):
+        order_id = order_ids.next_id(0)
+        order_row, item_rows = insert_order(
+            db_session_for_test,
+            {
+                "order_id": order_id,
+                "order_date": id_datetime(order_id),
+                "user_id": 5,
+                "shipping_address": None,
+                "total_amount": Decimal("7.50"),
+                "status": "pending",
+            },
+            [
+                {
+                    "order_item_id": order_item_ids.next_id(0),
+                    "product_id": product_id,
+                    "quantity": 1,
+                    "price_at_purchase": 2.5,
+                    "item_total": Decimal("2.50"),
+                }
+                for product_id in (3, 1, 2)
+            ],
+            pipelined=pipelined,
+        )
+        assert order_row.order_id == order_id and order_row.created_at is not None
+        results[pipelined] = (
+            (order_row.user_id, order_row.total_amount, order_row.status),
+            [(row.product_id, row.price_at_purchase, row.order_id) for row in item_rows],
+        )
+        assert results[pipelined][1] == [
+            (product_id, Decimal("2.50"), order_id) for product_id in (3, 1, 2)
+        ]
+        assert set_order_status(db_session_for_test, order_id, "confirmed", pipelined) == "confirmed"
+    assert results[False][0] == results[True][0]
+    assert set_order_status(db_session_for_test, 999999, "failed", pipelined=True) is None
+    # A session of its own sends BEGIN and COMMIT in the pipeline, then leaves
+    # its connection as it found it. The write still yields a consistency token,
+    # although its statements bypass the cursor events
+    with track_write_position() as position, SessionLocal() as own_session:
+        assert set_order_status(own_session, 999999, "failed", pipelined=True) is None
+        dbapi_connection = own_session.connection().connection.dbapi_connection
+        assert dbapi_connection.autocommit is False
+    assert position["lsn"] is not None
+
+    prepared = db_session_for_test.execute(
+        text("SELECT statement FROM pg_prepared_statements")
+    ).scalars().all()
+    for table in (Order.__tablename__, OrderItem.__tablename__):
+        assert any(statement.lstrip().startswith(f"INSERT INTO {table}") for statement in prepared)
+    assert any(statement.lstrip().startswith(f"UPDATE {Order.__tablename__}") for statement in prepared)
+
+
+def test_status_stored_as_code_with_partial_index(
+    client: TestClient, db_session_for_test: Session
+):
+    """Statuses are SMALLINT codes in status_code behind the API names."""
+    from app.models import ORDER_STATUS_CODES, active_status_index_name
+
+    db_order = Order(user_id=11, total_amount=Decimal("3.00"), status="pending")
+    db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+    stored = db_session_for_test.execute(
+        text(f"SELECT status_code FROM {Order.__tablename__} WHERE order_id = :order_id"),
+        {"order_id": db_order.order_id},
+    ).scalar_one()
+    assert stored == ORDER_STATUS_CODES["pending"]
+    listed = client.get("/orders/", params={"user_id": 11, "status": "pending"}).json()
+    assert [order["status"] for order in listed] == ["pending"]
+    response = client.patch(
+        f"/orders/{db_order.order_id}/status", json={"status": "shipped"}
+    )
+    assert response.status_code == 200 and response.json()["status"] == "shipped"
+    assert client.patch(
+        f"/orders/{db_order.order_id}/status", json={"status": "lost"}
+    ).status_code == 422
+    index_definition = db_session_for_test.execute(
+        text("SELECT indexdef FROM pg_indexes WHERE indexname = :name"),
+        {"name": active_status_index_name(Order.__tablename__)},
+    ).scalar_one()
+    assert index_definition.endswith("WHERE (status_code = ANY (ARRAY[1, 2]))")
+
+
+def test_text_status_migrates_online_with_expand_and_contract():
+    """
+    A table still on the text status gains status_code without downtime: both
+    columns stay in sync for old and new writers until the contract step.
+    Runs on its own connections, as CREATE INDEX CONCURRENTLY waits for every
+    open transaction.
+    """
+    from app.models import active_status_index_name
+    from app.status_migration import migrate_order_status, require_status_codes
+
+    legacy = "orders_status_migration_test"
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP TABLE IF EXISTS {legacy}"))
+        connection.execute(
+            text(
+                f"CREATE TABLE {legacy} (order_id bigint, order_date timestamptz, "
+                "status varchar(50) NOT NULL DEFAULT 'pending', PRIMARY KEY (order_id, order_date)) "
+                "PARTITION BY RANGE (order_date)"
+            )
+        )
+        connection.execute(text(f"CREATE TABLE {legacy}_default PARTITION OF {legacy} DEFAULT"))
+        connection.execute(
+            text(f"INSERT INTO {legacy} VALUES (:order_id, now(), :status)"),
+            [
+                {"order_id": order_id, "status": status}
+                for order_id, status in enumerate(["pending", "confirmed", "failed", "processing", "shipped"])
+            ],
+        )
+    try:
+        with pytest.raises(RuntimeError):
+            require_status_codes(engine, legacy)
+
+        result = migrate_order_status(engine, legacy, batch_size=2)
+        assert result["backfilled"] == 5 and not result["contracted"]
+        assert active_status_index_name(legacy) in result["indexes"]
+        require_status_codes(engine, legacy)
+        with engine.begin() as connection:
+            rows = connection.execute(
+                text(f"SELECT order_id, status, status_code FROM {legacy} ORDER BY order_id")
+            ).all()
+            assert rows == [
+                (0, "pending", 1), (1, "confirmed", 3), (2, "failed", 7),
+                (3, "processing", 2), (4, "shipped", 4),
+            ]
+            # Old writers set the text, new writers the code; both columns follow
+            connection.execute(text(f"INSERT INTO {legacy} (order_id, order_date) VALUES (5, now())"))
+            connection.execute(
+                text(f"INSERT INTO {legacy} (order_id, order_date, status_code) VALUES (6, now(), 3)")
+            )
+            connection.execute(text(f"UPDATE {legacy} SET status = 'completed' WHERE order_id = 0"))
+            connection.execute(text(f"UPDATE {legacy} SET status_code = 6 WHERE order_id = 1"))
+            rows = connection.execute(
+                text(f"SELECT order_id, status, status_code FROM {legacy} WHERE order_id IN (0, 1, 5, 6) ORDER BY order_id")
+            ).all()
+            assert rows == [(0, "completed", 5), (1, "cancelled", 6), (5, "pending", 1), (6, "confirmed", 3)]
+            assert connection.execute(
+                text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                {"name": active_status_index_name(legacy)},
+            ).scalar_one()
+
+        result = migrate_order_status(engine, legacy, contract=True)
+        assert result == {"backfilled": 0, "indexes": [], "contracted": True}
+        with engine.begin() as connection:
+            columns = connection.execute(
+                text("SELECT column_name FROM information_schema.columns WHERE table_name = :name"),
+                {"name": legacy},
+            ).scalars().all()
+            assert "status" not in columns and "status_code" in columns
+        # Already converted: another run changes nothing
+        assert migrate_order_status(engine, legacy, contract=True) == {
+            "backfilled": 0, "indexes": [], "contracted": False
+        }
+    finally:
+        with engine.begin() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {legacy}"))
+            connection.execute(text(f"DROP FUNCTION IF EXISTS {legacy}_status_sync()"))
+
+
+def test_customer_order_history_pages_by_keyset_from_covering_index(
+    client: TestClient, db_session_for_test: Session
+):
+    """A customer's history comes newest first in keyset pages of summaries, from an index-only scan."""
+    from datetime import timedelta
+
+    from app.main import customer_orders_query
+
+    placed = datetime.now(timezone.utc) - timedelta(hours=1)
+    # Orders are dated by their ids, so the ids come from a generator whose clock
+    # is set back. Two orders share a timestamp; order_id keeps them in a stable order
+    clock = SimpleNamespace(now=placed)
+    generator = SnowflakeGenerator(clock=lambda: clock.now.timestamp())
+    for minutes in (0, 5, 5, 10, 20):
+        clock.now = placed + timedelta(minutes=minutes)
+        db_order = Order(
+            order_id=generator.next_id(0),
+            user_id=51,
+            total_amount=Decimal("4.00"),
+            status="pending",
+        )
+        db_order.items.append(
+            OrderItem(
+                product_id=1,
+                quantity=1,
+                price_at_purchase=Decimal("4.00"),
+                item_total=Decimal("4.00"),
+            )
+        )
+        db_session_for_test.add(db_order)
+    db_session_for_test.add(Order(user_id=52, total_amount=Decimal("1.00"), status="pending"))
+    db_session_for_test.flush()
+    expected = [
+        order_id
+        for order_id, in db_session_for_test.execute(
+            text(
+                f"SELECT order_id FROM {Order.__tablename__} WHERE user_id = 51 "
+                "ORDER BY order_date DESC, order_id DESC"
+            )
+        )
+    ]
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/customers/51/orders", params=params)
+        assert response.status_code == 200
+        # Summaries only: no items query
+        assert response.headers["X-DB-Query-Count"] == "1"
+        page = response.json()
+        pages.append([order["order_id"] for order in page["orders"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [order_id for page in pages for order_id in page] == expected
+    assert set(page["orders"][0]) == {"order_id", "order_date", "status", "total_amount"}
+    # Items on demand
+    items = client.get(f"/orders/{expected[0]}/items").json()
+    assert [item["quantity"] for item in items] == [1]
+    assert client.get("/customers/51/orders", params={"cursor": "not-a-cursor"}).status_code == 400
+
+    # Both the first page and a page after a cursor read only the index
+    after_first = client.get("/customers/51/orders", params={"limit": 1}).json()["next_cursor"]
+    connection = db_session_for_test.connection()
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+    connection.execute(text("SET LOCAL enable_bitmapscan = off"))
+    for cursor in (None, after_first):
+        query = customer_orders_query(51, cursor, 2)
+        compiled = query.compile(connection, compile_kwargs={"literal_binds": True})
+        plan = "\n".join(connection.execute(text(f"EXPLAIN {compiled}")).scalars())
+        assert "Index Only Scan using" in plan and "Sort" not in plan
+
+
+def test_list_orders_keyset_pages_with_many_items_and_optional_items(
+    client: TestClient, db_session_for_test: Session
+):
+    """Keyset pages hold whole orders with all of their items, loaded in one IN query or skipped."""
+    from datetime import timedelta
+
+    placed = datetime.now(timezone.utc) - timedelta(hours=1)
+    clock = SimpleNamespace(now=placed)
+    generator = SnowflakeGenerator(clock=lambda: clock.now.timestamp())
+    for minutes in range(3):
+        # Dated by its id, like every order
+        clock.now = placed + timedelta(minutes=minutes)
+        db_order = Order(
+            order_id=generator.next_id(0),
+            user_id=61,
+            total_amount=Decimal("25.00"),
+            status="pending",
+        )
+        for product_id in range(1, 26):
+            db_order.items.append(
+                OrderItem(
+                    product_id=product_id,
+                    quantity=1,
+                    price_at_purchase=Decimal("1.00"),
+                    item_total=Decimal("1.00"),
+                )
+            )
+        db_session_for_test.add(db_order)
+    db_session_for_test.flush()
+
+    first = client.get("/orders/", params={"user_id": 61, "limit": 2})
+    assert first.status_code == 200
+    # A page of orders, then every item of the page in one query
+    assert first.headers["X-DB-Query-Count"] == "2"
+    first_page = first.json()
+    assert [len(order["items"]) for order in first_page] == [25, 25]
+    for order in first_page:
+        assert order == client.get(f"/orders/{order['order_id']}").json()
+
+    second = client.get(
+        "/orders/", params={"user_id": 61, "limit": 2, "cursor": first.headers["X-Next-Cursor"]}
+    )
+    second_page = second.json()
+    assert "X-Next-Cursor" not in second.headers
+    assert [len(order["items"]) for order in second_page] == [25]
+    listed = [order["order_id"] for order in first_page + second_page]
+    assert listed == [order["order_id"] for order in client.get("/orders/", params={"user_id": 61}).json()]
+
+    bare = client.get("/orders/", params={"user_id": 61, "include_items": "false"})
+    # The items query is skipped altogether
+    assert bare.headers["X-DB-Query-Count"] == "1"
+    assert [order["items"] for order in bare.json()] == [[], [], []]
+    assert client.get(
+        "/orders/", params={"cursor": first.headers["X-Next-Cursor"], "skip": 1}
+    ).status_code == 400
+
+
+def test_inter_service_calls_share_one_pooled_keep_alive_client(
+    client: TestClient, db_session_for_test: Session, mock_services
+):
+    """Startup creates one pooled client; requests reuse its connections and are exported as metrics."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from app import http_client as http_client_module
+    from app.metrics import registry
+    from prometheus_client import generate_latest
+
+    shared = http_client_module.http_client
+    assert shared is not None and not shared.is_closed
+    assert get_http_client() is shared
+
+    class CustomerService(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keeps connections open between requests
+
+        def do_GET(self):
+            body = b'{"email": "c@example.com"}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CustomerService)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def call_three_times():
+        pooled = create_http_client()
+        # The pool the gauges read; a new httpx release that moves it fails here
+        assert isinstance(pooled._transport.transport._pool, httpcore.AsyncConnectionPool)
+        try:
+            for _ in range(3):
+                response = await pooled.get(f"http://127.0.0.1:{server.server_port}/customers/1")
+                assert response.json() == {"email": "c@example.com"}
+        finally:
+            await pooled.aclose()
+
+    try:
+        asyncio.run(call_three_times())
+    finally:
+        server.shutdown()
+        server.server_close()
+    metrics_text = generate_latest(registry).decode()
+    # Three requests over one kept-alive connection, left idle in the pool
+    assert 'http_client_connections_opened_total{app_name="order_service",target="127.0.0.1"} 1.0' in metrics_text
+    assert 'http_client_request_duration_seconds_count{app_name="order_service",target="127.0.0.1"} 3.0' in metrics_text
+    assert 'http_client_pool_connections{app_name="order_service",state="idle"} 1.0' in metrics_text
+    # A transport without a pool leaves the gauges alone
+    InstrumentedTransport(httpx.MockTransport(lambda request: httpx.Response(200))).record_pool_state()
+    assert 'http_client_pool_connections{app_name="order_service",state="idle"} 1.0' in generate_latest(registry).decode()
+
+    # Routes get the client through the dependency, here answered by the mock transport
+    mock_services.routes["GET", "/products/1"] = httpx.Response(
+        200, json={"product_id": 1, "name": "Product 1", "stock_quantity": 5}
+    )
+    response = client.post(
+        "/orders/",
+        json={"user_id": 8, "items": [{"product_id": 1, "quantity": 1, "price_at_purchase": 2.0}]},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid user_id: Customer 8 not found."
+    (request,) = [request for request in mock_services.requests if "customers" in request.url.path]
+    assert request.url.path == "/customers/8" and "X-Request-Deadline" in request.headers
+
+
+def test_order_validation_calls_run_concurrently_and_first_failure_cancels_the_rest(
+    client: TestClient, db_session_for_test: Session, mock_services
+):
+    """The customer and product lookups overlap, and one failed lookup cancels the others."""
+    in_flight, peak, cancelled = [0], [0], []
+
+    def slow(body: dict, seconds: float = 0.3):
+        async def respond(request: httpx.Request) -> httpx.Response:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            try:
+                await asyncio.sleep(seconds)
+            except asyncio.CancelledError:
+                cancelled.append(request.url.path)
+                raise
+            finally:
+                in_flight[0] -= 1
+            return httpx.Response(200, json=body)
+
+        return respond
+
+    mock_services.routes["GET", "/customers/9"] = slow({"email": "c@example.com"})
+    for product_id in (1, 2, 3):
+        mock_services.routes["GET", f"/products/{product_id}"] = slow(
+            {"product_id": product_id, "name": f"Product {product_id}", "stock_quantity": 5}
+        )
+    items = [
+        {"product_id": product_id, "quantity": 2, "price_at_purchase": 1.0}
+        for product_id in (1, 2, 3, 3)  # Product 3 on two lines: one lookup for 4 units
+    ]
+
+    started = time.perf_counter()
+    response = client.post("/orders/", json={"user_id": 9, "items": items})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 201
+    assert len(mock_services.requests) == 4 and peak[0] == 4
+    # About one lookup's time, not the sum of four
+    assert elapsed < 0.9
+
+    # Product 3 can't cover both lines: the others are cancelled, not awaited
+    mock_services.requests.clear()
+    mock_services.routes["GET", "/customers/9"] = slow({"email": "c@example.com"}, seconds=5)
+    mock_services.routes["GET", "/products/3"] = httpx.Response(
+        200, json={"product_id": 3, "name": "Product 3", "stock_quantity": 3}
+    )
+    started = time.perf_counter()
+    response = client.post("/orders/", json={"user_id": 9, "items": items})
+    assert time.perf_counter() - started < 2
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Insufficient stock for product 'Product 3'. Only 3 available."
+    assert sorted(cancelled) == ["/customers/9", "/products/1", "/products/2"]
+    assert len(
+        client.get("/orders/", params={"user_id": 9, "include_items": "false"}).json()
+    ) == 1
+
+
+def test_worker_id_is_claimed_by_one_live_process_at_a_time(client: TestClient):
+    """A second process starting with a worker id that is already in use fails instead of sharing it."""
+    from app.ids import claim_worker_id
+
+    # The running service holds its own worker id
+    with pytest.raises(RuntimeError):
+        claim_worker_id(engine.url, order_ids.worker_id)
+    claim = claim_worker_id(engine.url, 15)
+    try:
+        with pytest.raises(RuntimeError):
+            claim_worker_id(engine.url, 15)
+    finally:
+        claim.close()
+    # Released with the connection (or the process) that held it
+    claim_worker_id(engine.url, 15).close()
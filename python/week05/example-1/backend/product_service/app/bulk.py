@@ -0,0 +1,228 @@
+# week05/example-1/backend/product_service/app/bulk.py
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import IO, Dict, Iterator, Optional, Tuple
+
+# --- Bulk Ingestion Configuration ---
+# Entries uploaded at once per job (each holds at most one spooled entry)
+IMAGE_BULK_MAX_CONCURRENCY = int(os.getenv("IMAGE_BULK_MAX_CONCURRENCY", "4"))
+# Product updates committed per database transaction
+IMAGE_BULK_COMMIT_BATCH_SIZE = int(os.getenv("IMAGE_BULK_COMMIT_BATCH_SIZE", "50"))
+# Entries are kept in memory up to this size, then spooled to disk
+IMAGE_BULK_SPOOL_BYTES = int(os.getenv("IMAGE_BULK_SPOOL_BYTES", str(1024 * 1024)))
+IMAGE_BULK_MAX_ENTRY_BYTES = int(
+    os.getenv("IMAGE_BULK_MAX_ENTRY_BYTES", str(20 * 1024 * 1024))
+)
+# Finished jobs are forgotten, oldest first, beyond this many
+IMAGE_BULK_MAX_JOBS = int(os.getenv("IMAGE_BULK_MAX_JOBS", "100"))
+
+EXTENSION_CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+}
+
+
+class EntryTooLarge(Exception):
+    pass
+
+
+def parse_manifest(manifest: Optional[str]) -> Optional[Dict[str, int]]:
+    """
+    Parses a file-to-product mapping, given either as a JSON object
+    ({"path/in/archive.jpg": 12}) or a list ([{"file": "...", "product_id": 12}]).
+    Raises ValueError if it is malformed.
+    """
+    if not manifest:
+        return None
+    try:
+        data = json.loads(manifest)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Manifest is not valid JSON: {e}")
+    if isinstance(data, list):
+        try:
+            data = {entry["file"]: entry["product_id"] for entry in data}
+        except (KeyError, TypeError):
+            raise ValueError("Manifest entries must have 'file' and 'product_id'.")
+    if not isinstance(data, dict) or not all(
+        isinstance(product_id, int) and not isinstance(product_id, bool)
+        for product_id in data.values()
+    ):
+        raise ValueError("Manifest must map file names to integer product IDs.")
+    return data
+
+
+def resolve_product_id(
+    entry_name: str, manifest: Optional[Dict[str, int]]
+) -> Optional[int]:
+    """Looks an entry up in the manifest, or reads the product ID from its file name (e.g. 42.jpg)."""
+    base_name = os.path.basename(entry_name)
+    if manifest is not None:
+        return manifest.get(entry_name, manifest.get(base_name))
+    stem = os.path.splitext(base_name)[0]
+    return int(stem) if stem.isdigit() else None
+
+
+def is_ignored_entry(entry_name: str) -> bool:
+    """Hidden files and archiver metadata (e.g. __MACOSX/) are not catalog entries."""
+    return entry_name.startswith("__MACOSX/") or os.path.basename(entry_name).startswith(".")
+
+
+def is_supported_archive(path: str) -> bool:
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def save_to_temp_file(source: IO[bytes]) -> str:
+    """Copies an upload to a named temporary file that outlives the request."""
+    with tempfile.NamedTemporaryFile(prefix="bulk-images-", delete=False) as f:
+        shutil.copyfileobj(source, f)
+        return f.name
+
+
+def iter_archive_entries(path: str) -> Iterator[Tuple[str, IO[bytes]]]:
+    """Yields (name, readable file) for each regular file in a zip or tar archive, in archive order."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as entry:
+                    yield info.filename, entry
+    else:
+        with tarfile.open(path, "r:*") as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                yield member.name, archive.extractfile(member)
+
+
+def read_next_entry(entries: Iterator[Tuple[str, IO[bytes]]]):
+    """
+    Copies the next archive entry into a spooled temporary file (blocking).
+    Returns (name, file), (name, EntryTooLarge()) for oversized entries, or None at the end.
+    """
+    try:
+        name, source = next(entries)
+    except StopIteration:
+        return None
+
+    spool = tempfile.SpooledTemporaryFile(max_size=IMAGE_BULK_SPOOL_BYTES)
+    copied = 0
+    while True:
+        chunk = source.read(1024 * 1024)
+        if not chunk:
+            break
+        copied += len(chunk)
+        if copied > IMAGE_BULK_MAX_ENTRY_BYTES:
+            spool.close()
+            return name, EntryTooLarge()
+        spool.write(chunk)
+    spool.seek(0)
+    return name, spool
+
+
+class BulkImageItem:
+    """Outcome of one archive entry."""
+
+    def __init__(self, file: str):
+        self.file = file
+        self.product_id: Optional[int] = None
+        self.content_type: Optional[str] = None
+        self.blob_name: Optional[str] = None
+        self.size_bytes = 0
+        self.uploaded = False  # True if this job stored the blob
+        self.status = "pending"
+        self.detail: Optional[str] = None
+
+    def succeed(self):
+        self.status = "succeeded"
+
+    def fail(self, detail: str):
+        self.status = "failed"
+        self.detail = detail
+
+    def skip(self, detail: str):
+        self.status = "skipped"
+        self.detail = detail
+
+    def to_dict(self) -> dict:
+        return {
+            "file": self.file,
+            "product_id": self.product_id,
+            "status": self.status,
+            "blob_name": self.blob_name,
+            "detail": self.detail,
+        }
+
+
+class BulkImageJob:
+    """Progress and per-item results of one bulk ingestion, polled via the job-status endpoint."""
+
+    def __init__(self, filename: Optional[str]):
+        self.job_id = uuid.uuid4().hex
+        self.filename = filename
+        self.status = "queued"
+        self.entries_seen = 0
+        self.counts = {"succeeded": 0, "failed": 0, "skipped": 0}
+        self.results = []
+        self.error: Optional[str] = None
+        self.created_at = datetime.now(timezone.utc)
+        self.finished_at: Optional[datetime] = None
+        self.task = None  # Keeps the running job from being garbage-collected
+
+    def record(self, item: BulkImageItem):
+        self.counts[item.status] += 1
+        self.results.append(item.to_dict())
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = datetime.now(timezone.utc)
+        self.task = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "filename": self.filename,
+            "entries_seen": self.entries_seen,
+            **self.counts,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "results": self.results,
+        }
+
+
+class BulkImageJobRegistry:
+    """In-memory job registry; jobs are per-process and lost on restart."""
+
+    def __init__(self, max_jobs: int = IMAGE_BULK_MAX_JOBS):
+        self._max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, BulkImageJob]" = OrderedDict()
+
+    def create(self, filename: Optional[str]) -> BulkImageJob:
+        job = BulkImageJob(filename)
+        self._jobs[job.job_id] = job
+        # Forget the oldest finished jobs; running ones are always kept
+        for job_id in [job_id for job_id, old in self._jobs.items() if old.done]:
+            if len(self._jobs) <= self._max_jobs:
+                break
+            del self._jobs[job_id]
+        return job
+
+    def get(self, job_id: str) -> Optional[BulkImageJob]:
+        return self._jobs.get(job_id)
@@ -0,0 +1,230 @@
+# week05/example-1/backend/product_service/app/catalog_copy.py
+
+import asyncio
+import csv
+import logging
+import os
+import time
+from typing import AsyncIterator, List, Tuple
+
+import asyncpg
+
+from .metrics import APP_NAME, CATALOG_COPY_ROWS, CATALOG_COPY_ROWS_PER_SECOND
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# --- Catalog COPY Configuration ---
+# Columns a catalog file may carry; exports write exactly these, so an export
+# can be imported again as-is
+CATALOG_COPY_COLUMNS = (
+    "product_id",
+    "name",
+    "description",
+    "price",
+    "stock_quantity",
+    "image_url",
+)
+CATALOG_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+# COPY output chunks buffered between the database and a slow client; COPY
+# pauses when the buffer is full, which keeps export memory constant
+CATALOG_EXPORT_BUFFER_CHUNKS = int(os.getenv("CATALOG_EXPORT_BUFFER_CHUNKS", "16"))
+# Longest CSV header line accepted before giving up on finding its end
+MAX_CSV_HEADER_BYTES = 4096
+
+# NDJSON travels through COPY as one jsonb value per line: CSV with a delimiter
+# and quote character that never appear unescaped in JSON passes lines verbatim
+NDJSON_COPY_OPTIONS = {"format": "csv", "delimiter": "\x02", "quote": "\x01"}
+
+STAGING_TABLE = "product_import_staging"
+NDJSON_STAGING_TABLE = "product_import_ndjson"
+PRODUCTS_TABLE = Product.__tablename__
+
+CREATE_STAGING_TABLE_SQL = f"""
+CREATE TEMP TABLE {STAGING_TABLE} (
+    product_id integer,
+    name text,
+    description text,
+    price numeric(10, 2),
+    stock_quantity integer,
+    image_url text
+) ON COMMIT DROP
+"""
+CREATE_NDJSON_STAGING_TABLE_SQL = (
+    f"CREATE TEMP TABLE {NDJSON_STAGING_TABLE} (doc jsonb) ON COMMIT DROP"
+)
+# Each NDJSON object is mapped onto the staging row type by key; missing keys become NULL
+NDJSON_SOURCE_SQL = (
+    f"(SELECT r.* FROM {NDJSON_STAGING_TABLE} n, "
+    f"jsonb_populate_record(NULL::{STAGING_TABLE}, n.doc) r WHERE n.doc IS NOT NULL)"
+)
+# Rows with a product_id replace that product's catalog fields (or create it);
+# rows without one become new products
+UPSERT_SQL = f"""
+INSERT INTO {PRODUCTS_TABLE} (product_id, name, description, price, stock_quantity, image_url)
+SELECT
+    COALESCE(s.product_id, nextval(pg_get_serial_sequence('{PRODUCTS_TABLE}', 'product_id'))),
+    s.name,
+    s.description,
+    s.price,
+    COALESCE(s.stock_quantity, 0),
+    s.image_url
+FROM {{source}} s
+ON CONFLICT (product_id) DO UPDATE SET
+    name = EXCLUDED.name,
+    description = EXCLUDED.description,
+    price = EXCLUDED.price,
+    stock_quantity = EXCLUDED.stock_quantity,
+    image_url = EXCLUDED.image_url,
+    updated_at = now()
+"""
+# Explicit ids don't advance the serial sequence; move it past both the catalog's
+# and the file's ids before upserting, so ids handed to new rows can't collide
+# (never backwards, so deleted ids are not reused)
+ADVANCE_SEQUENCE_SQL = f"""
+SELECT setval(seq.name, ids.max_id)
+FROM (SELECT pg_get_serial_sequence('{PRODUCTS_TABLE}', 'product_id') AS name) seq,
+     (SELECT GREATEST(
+         (SELECT max(product_id) FROM {PRODUCTS_TABLE}),
+         (SELECT max(s.product_id) FROM {{source}} s)
+     ) AS max_id) ids
+WHERE ids.max_id >= COALESCE(pg_sequence_last_value(seq.name::regclass), 0)
+"""
+EXPORT_QUERY_SQL = (
+    f"SELECT {', '.join(CATALOG_COPY_COLUMNS)} FROM {PRODUCTS_TABLE} ORDER BY product_id"
+)
+
+
+class CatalogImportError(Exception):
+    """The uploaded catalog file is malformed or violates a product constraint."""
+
+
+def copied_row_count(command_status: str) -> int:
+    # asyncpg returns the command tag, e.g. "COPY 1000" or "INSERT 0 1000"
+    return int(command_status.rsplit(" ", 1)[-1])
+
+
+def report_copy_throughput(direction: str, rows: int, seconds: float) -> float:
+    rows_per_second = rows / seconds if seconds > 0 else float(rows)
+    CATALOG_COPY_ROWS.labels(app_name=APP_NAME, direction=direction).inc(rows)
+    CATALOG_COPY_ROWS_PER_SECOND.labels(app_name=APP_NAME, direction=direction).set(
+        rows_per_second
+    )
+    return rows_per_second
+
+
+async def split_csv_header(
+    chunks: AsyncIterator[bytes],
+) -> Tuple[List[str], AsyncIterator[bytes]]:
+    """
+    Reads the header line off a CSV byte stream and returns its column names,
+    plus the stream of everything after it. Raises CatalogImportError for
+    unknown or missing columns.
+    """
+    buffered = b""
+    async for chunk in chunks:
+        buffered += chunk
+        if b"\n" in buffered or len(buffered) > MAX_CSV_HEADER_BYTES:
+            break
+    header, _, rest = buffered.partition(b"\n")
+    if len(header) > MAX_CSV_HEADER_BYTES:
+        raise CatalogImportError("CSV header line is too long.")
+    columns = [
+        column.strip()
+        for column in next(csv.reader([header.decode("utf-8-sig").rstrip("\r")]), [])
+    ]
+    unknown = [column for column in columns if column not in CATALOG_COPY_COLUMNS]
+    if not columns or unknown:
+        raise CatalogImportError(
+            f"CSV header must name columns from {', '.join(CATALOG_COPY_COLUMNS)}; "
+            f"got unknown columns: {', '.join(unknown) or '(none)'}."
+        )
+
+    async def body():
+        if rest:
+            yield rest
+        async for chunk in chunks:
+            yield chunk
+
+    return columns, body()
+
+
+async def import_catalog(
+    connection: asyncpg.Connection, fmt: str, chunks: AsyncIterator[bytes]
+) -> Tuple[int, int]:
+    """
+    Streams a CSV (with header) or NDJSON catalog into a temporary staging table
+    with COPY FROM STDIN, then upserts it into the products table in one
+    statement. Must run inside a transaction; returns (rows staged, rows upserted).
+    """
+    try:
+        await connection.execute(CREATE_STAGING_TABLE_SQL)
+        if fmt == "csv":
+            columns, body = await split_csv_header(chunks)
+            copy_status = await connection.copy_to_table(
+                STAGING_TABLE, source=body, columns=columns, format="csv"
+            )
+            source = STAGING_TABLE
+        else:
+            await connection.execute(CREATE_NDJSON_STAGING_TABLE_SQL)
+            copy_status = await connection.copy_to_table(
+                NDJSON_STAGING_TABLE, source=chunks, **NDJSON_COPY_OPTIONS
+            )
+            source = NDJSON_SOURCE_SQL
+        await connection.execute(ADVANCE_SEQUENCE_SQL.format(source=source))
+        upsert_status = await connection.execute(UPSERT_SQL.format(source=source))
+    except asyncpg.PostgresError as e:
+        # Classes 21-23: cardinality (a product_id repeated in one file), bad
+        # data (unparseable values or JSON) and constraint violations
+        if (e.sqlstate or "")[:2] in ("21", "22", "23"):
+            raise CatalogImportError(str(e)) from e
+        raise
+    return copied_row_count(copy_status), copied_row_count(upsert_status)
+
+
+async def stream_catalog_export(engine, fmt: str) -> AsyncIterator[bytes]:
+    """
+    Yields the catalog as CSV (with header) or NDJSON straight from
+    COPY TO STDOUT. A bounded buffer between COPY and the client keeps memory
+    constant however large the catalog is; throughput is reported when done.
+    """
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=CATALOG_EXPORT_BUFFER_CHUNKS)
+    finished = object()
+    started = time.perf_counter()
+
+    async def write(chunk):
+        # asyncpg passes views over its read buffer; copy before handing them off
+        await buffer.put(bytes(chunk))
+
+    async def copy_out() -> int:
+        try:
+            async with engine.connect() as connection:
+                driver_connection = (await connection.get_raw_connection()).driver_connection
+                if fmt == "csv":
+                    status = await driver_connection.copy_from_query(
+                        EXPORT_QUERY_SQL, output=write, format="csv", header=True
+                    )
+                else:
+                    status = await driver_connection.copy_from_query(
+                        f"SELECT row_to_json(p) FROM ({EXPORT_QUERY_SQL}) p",
+                        output=write,
+                        **NDJSON_COPY_OPTIONS,
+                    )
+            return copied_row_count(status)
+        finally:
+            await buffer.put(finished)
+
+    producer = asyncio.create_task(copy_out())
+    try:
+        while (chunk := await buffer.get()) is not finished:
+            yield chunk
+        rows = await producer
+    finally:
+        # The client went away mid-download: stop the COPY and release the connection
+        producer.cancel()
+
+    seconds = time.perf_counter() - started
+    rows_per_second = report_copy_throughput("export", rows, seconds)
+    logger.info(
+        f"Product Service: Exported {rows} catalog rows as {fmt} in {seconds:.2f}s ({rows_per_second:.0f} rows/s)."
+    )
@@ -1,12 +1,38 @@
 # week05/example-1/backend/product-service/app/db.py
 
+import asyncio
+import contextlib
+import contextvars
+import logging
 import os
+import re
+import time
+from typing import Optional
 
-from sqlalchemy import create_engine
+from fastapi import Depends, Request
+from sqlalchemy import event, make_url, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from .metrics import (
+    APP_NAME,
+    DB_POOL_CHECKED_OUT,
+    DB_POOL_CHECKOUT_TIMEOUTS,
+    DB_POOL_CHECKOUT_WAIT,
+    DB_POOL_INVALIDATIONS,
+    DB_POOL_OVERFLOW,
+    DB_READ_ROUTING,
+    DB_REPLICA_LAG,
+)
+from .querystats import instrument_statements
 
 
+logger = logging.getLogger(__name__)
+
 POSTGRES_USER = os.getenv("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD", "postgres")
 POSTGRES_DB = os.getenv("POSTGRES_DB", "products")
@@ -14,20 +40,307 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
 
 DATABASE_URL = (
-    "postgresql://"
+    "postgresql+asyncpg://"
     f"{POSTGRES_USER}:{POSTGRES_PASSWORD}@"
     f"{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+# --- Connection Pool Configuration ---
+# Every worker process has its own pool, so the database sees up to
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections from this service
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+# Connections older than this are replaced on checkout (-1 disables)
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+# Tests each connection with a lightweight query before handing it out
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Async-adapted QueuePool that exports checked-out and overflow connections and
+    how long checkouts wait, labelled by the pool's logging name.
+    """
+
+    def _do_get(self):
+        pool_name = self.logging_name or "default"
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.labels(app_name=APP_NAME, pool=pool_name).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(app_name=APP_NAME, pool=pool_name).observe(
+                time.perf_counter() - started
+            )
+        self._record_usage(pool_name)
+        return record
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._record_usage(self.logging_name or "default")
+
+    def _record_usage(self, pool_name: str):
+        DB_POOL_CHECKED_OUT.labels(app_name=APP_NAME, pool=pool_name).set(
+            self.checkedout()
+        )
+        DB_POOL_OVERFLOW.labels(app_name=APP_NAME, pool=pool_name).set(
+            max(self.overflow(), 0)
+        )
+
+
+def count_invalidations(engine, pool_name: str):
+    """Counts connections the pool discards, e.g. after a failed pre-ping or a dropped connection."""
+
+    @event.listens_for(engine.sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        DB_POOL_INVALIDATIONS.labels(
+            app_name=APP_NAME, pool=pool_name, kind="hard"
+        ).inc()
+
+    @event.listens_for(engine.sync_engine, "soft_invalidate")
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        DB_POOL_INVALIDATIONS.labels(
+            app_name=APP_NAME, pool=pool_name, kind="soft"
+        ).inc()
+
+
 # --- SQLAlchemy Engine and Session Setup ---
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# asyncpg keeps database round trips off the event loop's critical path, so one
+# slow query no longer stalls every other in-flight request on the worker
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_logging_name="api",
+)
+count_invalidations(engine, "api")
+instrument_statements(engine.sync_engine)
+# Objects stay usable after commit; handlers refresh explicitly where the
+# database generates values (e.g. updated_at)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+# --- Consumer Engine ---
+# The order.placed consumer uses its own small pool, so a burst of orders cannot
+# take the connections API requests need (and a busy API cannot starve it)
+CONSUMER_DB_POOL_SIZE = int(os.getenv("CONSUMER_DB_POOL_SIZE", "2"))
+consumer_engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=CONSUMER_DB_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    pool_logging_name="consumer",
+)
+count_invalidations(consumer_engine, "consumer")
+instrument_statements(consumer_engine.sync_engine)
+ConsumerSessionLocal = async_sessionmaker(
+    consumer_engine, autoflush=False, expire_on_commit=False
+)
+
+# --- Read Replica ---
+# Optional streaming replica for read-only routes; unset, every read uses the
+# primary. Any postgresql:// URL works; the asyncpg driver is applied to it.
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+# Reads fall back to the primary while the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+# How long a replica status check is reused before querying it again
+REPLICA_STATUS_TTL_SECONDS = float(os.getenv("REPLICA_STATUS_TTL_SECONDS", "1"))
+# Write responses carry the primary's WAL position in this header; clients send it
+# back on reads that must see their own writes
+CONSISTENCY_TOKEN_HEADER = "X-DB-Consistency-Token"
+
+# Replay position and lag (0 when everything received has been replayed). On a
+# server that is not in recovery the current WAL position is reported instead,
+# so pointing REPLICA_DATABASE_URL at the primary is harmless.
+REPLICA_STATUS_SQL = text(
+    """
+    SELECT
+        CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+             ELSE pg_current_wal_lsn() END::text,
+        CASE WHEN NOT pg_is_in_recovery()
+               OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+             ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+        END
+    """
+)
 
 
-def get_db():
-    db = SessionLocal()
+def parse_lsn(lsn: Optional[str]) -> Optional[int]:
+    """Converts a PostgreSQL LSN ("16/B374D848") to an integer, or None if malformed."""
+    if not lsn:
+        return None
+    high, _, low = lsn.partition("/")
     try:
-        yield db
+        return (int(high, 16) << 32) | int(low, 16)
+    except ValueError:
+        return None
+
+
+class ReplicaStatus:
+    """Replication state of the read replica, refreshed at most every REPLICA_STATUS_TTL_SECONDS."""
+
+    def __init__(self, replica_engine):
+        self.engine = replica_engine
+        self.replay_lsn: Optional[int] = None
+        self.lag_seconds: Optional[float] = None  # None while the replica is unreachable
+        self.checked_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    async def refresh(self):
+        try:
+            async with self.engine.connect() as connection:
+                lsn, lag = (await connection.execute(REPLICA_STATUS_SQL)).one()
+            self.replay_lsn = parse_lsn(lsn)
+            self.lag_seconds = float(lag)
+            DB_REPLICA_LAG.labels(app_name=APP_NAME).set(self.lag_seconds)
+        except (OperationalError, OSError, PoolTimeoutError) as e:
+            logger.warning(f"Product Service: Read replica status check failed: {e}")
+            self.replay_lsn = self.lag_seconds = None
+        self.checked_at = time.monotonic()
+
+    async def refresh_unless_checked_since(self, moment: float):
+        """
+        Refreshes unless a check finished after moment. Requests that find the
+        status stale together wait for one check instead of each running their own.
+        """
+        async with self._refresh_lock:
+            if self.checked_at <= moment:
+                await self.refresh()
+
+    async def choose(self, consistency_token: Optional[str]) -> str:
+        """Returns "replica", or the reason the read has to go to the primary."""
+        now = time.monotonic()
+        if now - self.checked_at > REPLICA_STATUS_TTL_SECONDS:
+            await self.refresh_unless_checked_since(now - REPLICA_STATUS_TTL_SECONDS)
+        if self.lag_seconds is None:
+            return "replica_unavailable"
+        if self.lag_seconds > REPLICA_MAX_LAG_SECONDS:
+            return "replica_lagging"
+        if consistency_token is not None:
+            min_lsn = parse_lsn(consistency_token)
+            if min_lsn is None:
+                return "invalid_token"
+            if self.replay_lsn is None or self.replay_lsn < min_lsn:
+                # The cached position may just be stale; look once more
+                await self.refresh_unless_checked_since(now)
+                if self.replay_lsn is None or self.replay_lsn < min_lsn:
+                    return "replica_behind_token"
+        return "replica"
+
+
+if REPLICA_DATABASE_URL:
+    replica_engine = create_async_engine(
+        make_url(REPLICA_DATABASE_URL).set(drivername="postgresql+asyncpg"),
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name="replica",
+    )
+    count_invalidations(replica_engine, "replica")
+    instrument_statements(replica_engine.sync_engine)
+    ReadSessionLocal = async_sessionmaker(
+        replica_engine, autoflush=False, expire_on_commit=False
+    )
+    replica_status: Optional[ReplicaStatus] = ReplicaStatus(replica_engine)
+else:
+    replica_engine = ReadSessionLocal = None
+    replica_status = None
+
+
+# --- Read-Your-Writes Tokens ---
+# Inside track_write_position (the write-token middleware), statements that change
+# data on the primary are noted; when a session then commits, the primary's WAL
+# position is read on the connection that committed. Requests that wrote nothing
+# never pay for it. The session events fire inside AsyncSession's greenlet, so
+# the read runs as an ordinary synchronous statement.
+WRITE_STATEMENT = re.compile(r"\s*(INSERT|UPDATE|DELETE|MERGE|COPY)\b", re.IGNORECASE)
+
+# The current request's {"wrote", "lsn"}; None outside tracked requests
+_write_position: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar(
+    "write_position", default=None
+)
+
+
+@contextlib.contextmanager
+def track_write_position():
+    """Collects the WAL position after the last write committed inside the block ("lsn", None if none)."""
+    position = {"wrote": False, "lsn": None}
+    token = _write_position.set(position)
+    try:
+        yield position
     finally:
-        db.close()
+        _write_position.reset(token)
+
+
+def note_write():
+    """Marks the current request as having written to the primary."""
+    position = _write_position.get()
+    if position is not None:
+        position["wrote"] = True
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def note_write_statements(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and (context.isinsert or context.isupdate or context.isdelete):
+        note_write()
+    elif WRITE_STATEMENT.match(statement):
+        note_write()
+
+
+@event.listens_for(Session, "after_begin")
+def remember_primary_connection(session, transaction, connection):
+    if connection.engine is engine.sync_engine:
+        session.info["primary_connection"] = connection
+
+
+@event.listens_for(Session, "after_commit")
+def capture_write_position(session):
+    connection = session.info.pop("primary_connection", None)
+    position = _write_position.get()
+    if connection is None or position is None or not position["wrote"]:
+        return
+    # Read after the commit, so the position is at or past its commit record
+    position["lsn"] = connection.exec_driver_sql(
+        "SELECT pg_current_wal_lsn()::text"
+    ).scalar_one()
+    position["wrote"] = False
+
+
+Base = declarative_base()
+
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+async def get_read_db(request: Request, primary_db: AsyncSession = Depends(get_db)):
+    """
+    Session for read-only routes: the replica when it is reachable, within
+    REPLICA_MAX_LAG_SECONDS and past the request's consistency token, otherwise
+    the primary session (which never connects if unused).
+    """
+    if replica_status is None:
+        yield primary_db
+        return
+    reason = await replica_status.choose(request.headers.get(CONSISTENCY_TOKEN_HEADER))
+    if reason != "replica":
+        DB_READ_ROUTING.labels(app_name=APP_NAME, target="primary", reason=reason).inc()
+        yield primary_db
+        return
+    DB_READ_ROUTING.labels(app_name=APP_NAME, target="replica", reason="ok").inc()
+    async with ReadSessionLocal() as db:
+        yield db
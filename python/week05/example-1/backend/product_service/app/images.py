@@ -0,0 +1,126 @@
+# week05/example-1/backend/product_service/app/images.py
+
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# --- Image Variant Configuration ---
+# Bounding boxes (width, height) for each generated variant; aspect ratio is preserved
+IMAGE_VARIANT_SIZES: Dict[str, Tuple[int, int]] = {
+    "thumb": (150, 150),
+    "card": (400, 400),
+    "full": (1600, 1600),
+}
+IMAGE_VARIANT_FORMAT = "WEBP"
+IMAGE_VARIANT_EXTENSION = ".webp"
+IMAGE_VARIANT_CONTENT_TYPE = "image/webp"
+IMAGE_VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+# Processes doing the Pillow work, and asyncio workers feeding them jobs
+IMAGE_VARIANT_PROCESSES = int(os.getenv("IMAGE_VARIANT_PROCESSES", "2"))
+IMAGE_VARIANT_QUEUE_WORKERS = int(os.getenv("IMAGE_VARIANT_QUEUE_WORKERS", "2"))
+
+
+def variant_blob_name(blob_name: str, variant: str) -> str:
+    """Returns the blob name of a variant, stored next to its original."""
+    stem = os.path.splitext(blob_name)[0]
+    return f"{stem}_{variant}{IMAGE_VARIANT_EXTENSION}"
+
+
+def render_variants(data: bytes, quality: int = IMAGE_VARIANT_QUALITY) -> Dict[str, bytes]:
+    """
+    Decodes an image and renders every configured variant as WebP.
+    Runs inside the process pool, so it must stay a picklable module-level function.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+    variants = {}
+    for variant, size in IMAGE_VARIANT_SIZES.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)  # Never upscales
+        buffer = io.BytesIO()
+        resized.save(buffer, format=IMAGE_VARIANT_FORMAT, quality=quality, method=4)
+        variants[variant] = buffer.getvalue()
+    return variants
+
+
+class ImageVariantPipeline:
+    """
+    Background queue that generates image variants without blocking uploads.
+
+    Jobs are keyed by (product_id, blob_name); enqueueing a job that is already
+    queued or running is a no-op. The CPU-bound Pillow work is sent to a
+    ProcessPoolExecutor that is created on first use.
+    """
+
+    def __init__(
+        self,
+        process_job: Callable[[int, str], Awaitable[None]],
+        workers: int = IMAGE_VARIANT_QUEUE_WORKERS,
+        processes: int = IMAGE_VARIANT_PROCESSES,
+    ):
+        self._process_job = process_job
+        self._workers = workers
+        self._processes = processes
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending = set()
+        self._tasks = []
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self._workers)
+        ]
+        logger.info(
+            f"Product Service: Image variant pipeline started with {self._workers} workers."
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def enqueue(self, product_id: int, blob_name: str) -> bool:
+        """Queues variant generation. Returns False if the job is already pending."""
+        key = (product_id, blob_name)
+        if self._queue is None or key in self._pending:
+            return False
+        self._pending.add(key)
+        self._queue.put_nowait(key)
+        return True
+
+    async def render(self, data: bytes) -> Dict[str, bytes]:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(max_workers=self._processes)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._process_pool, render_variants, data)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            key = await self._queue.get()
+            product_id, blob_name = key
+            try:
+                await self._process_job(product_id, blob_name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(
+                    f"Product Service: Variant worker {worker_id} failed for product {product_id} ('{blob_name}'): {e}",
+                    exc_info=True,
+                )
+            finally:
+                self._pending.discard(key)
+                self._queue.task_done()
@@ -8,17 +8,11 @@ import sys
 import time
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Optional
-from urllib.parse import urlparse
+from typing import Dict, List, Optional
 
 import aio_pika
+import pydantic_core
 
-from azure.storage.blob import (
-    BlobSasPermissions,
-    BlobServiceClient,
-    ContentSettings,
-    generate_blob_sas,
-)
 from fastapi import (
     Depends,
     FastAPI,
@@ -26,17 +20,97 @@ from fastapi import (
     Form,
     HTTPException,
     Query,
+    Request,
     Response,
     UploadFile,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import generate_latest
+from sqlalchemy import case, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import OperationalError, IntegrityError
-from sqlalchemy.orm import Session
-
-from .db import Base, engine, get_db
-from .models import Product
-from .schemas import ProductCreate, ProductResponse, ProductUpdate, StockDeductRequest
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import PlainTextResponse, StreamingResponse
+
+from .bulk import (
+    EXTENSION_CONTENT_TYPES,
+    IMAGE_BULK_COMMIT_BATCH_SIZE,
+    IMAGE_BULK_MAX_CONCURRENCY,
+    BulkImageItem,
+    BulkImageJob,
+    BulkImageJobRegistry,
+    EntryTooLarge,
+    is_ignored_entry,
+    is_supported_archive,
+    iter_archive_entries,
+    parse_manifest,
+    read_next_entry,
+    resolve_product_id,
+    save_to_temp_file,
+)
+from .catalog_copy import (
+    CATALOG_MEDIA_TYPES,
+    CatalogImportError,
+    import_catalog,
+    report_copy_throughput,
+    stream_catalog_export,
+)
+from .db import (
+    CONSISTENCY_TOKEN_HEADER,
+    Base,
+    ConsumerSessionLocal,
+    SessionLocal,
+    consumer_engine,
+    engine,
+    get_db,
+    get_read_db,
+    replica_engine,
+    replica_status,
+    track_write_position,
+)
+from .images import (
+    IMAGE_VARIANT_CONTENT_TYPE,
+    IMAGE_VARIANT_SIZES,
+    ImageVariantPipeline,
+    variant_blob_name,
+)
+from .metrics import (
+    APP_NAME,
+    ORDER_CONSUMER_DURATION,
+    ORDER_CONSUMER_IN_FLIGHT,
+    registry,
+)
+from .models import Product, ProductImageBlob
+from .querystats import (
+    DB_QUERY_COUNT_HEADER,
+    QUERY_COUNT_HEADER,
+    report_request_queries,
+    track_request_queries,
+)
+from .schemas import (
+    BulkImageJobResponse,
+    ProductCreate,
+    ProductResponse,
+    ProductUpdate,
+    StockDeductRequest,
+    product_row_to_json,
+)
+from .serving import mmap_file_response
+from .storage import (
+    AZURE_SAS_TOKEN_EXPIRY_HOURS,
+    SAS_URL_CACHE_BUCKET_SECONDS,
+    AzureBlobStorage,
+    blob_name_from_url,
+    blob_url,
+    content_addressed_blob_name,
+    get_image_storage,
+    get_image_cache,
+    hash_upload,
+    initialize_image_storage,
+    is_valid_blob_name,
+    run_blocking,
+)
 
 # --- Standard Logging Configuration ---
 logging.basicConfig(
@@ -50,48 +124,23 @@ logger = logging.getLogger(__name__)
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.error").setLevel(logging.INFO)
 
-AZURE_STORAGE_ACCOUNT_NAME = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
-AZURE_STORAGE_ACCOUNT_KEY = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
-AZURE_STORAGE_CONTAINER_NAME = os.getenv(
-    "AZURE_STORAGE_CONTAINER_NAME", "product-images"
+# Unreferenced image blobs are deleted in batches once this grace period has passed,
+# so signed URLs handed out just before the last reference was dropped keep working
+IMAGE_GC_INTERVAL_SECONDS = int(os.getenv("IMAGE_GC_INTERVAL_SECONDS", "3600"))
+IMAGE_GC_BATCH_SIZE = int(os.getenv("IMAGE_GC_BATCH_SIZE", "100"))
+IMAGE_GC_GRACE_PERIOD_SECONDS = int(
+    os.getenv(
+        "IMAGE_GC_GRACE_PERIOD_SECONDS",
+        str(AZURE_SAS_TOKEN_EXPIRY_HOURS * 3600 + SAS_URL_CACHE_BUCKET_SECONDS),
+    )
 )
-AZURE_SAS_TOKEN_EXPIRY_HOURS = int(os.getenv("AZURE_SAS_TOKEN_EXPIRY_HOURS", "24"))
 
-blob_service_client: Optional[BlobServiceClient] = None
-
-# Initialize BlobServiceClient
-if AZURE_STORAGE_ACCOUNT_NAME and AZURE_STORAGE_ACCOUNT_KEY:
-    try:
-        blob_service_client = BlobServiceClient(
-            account_url=f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
-            credential=AZURE_STORAGE_ACCOUNT_KEY,
-        )
-        logger.info("Product Service: Azure BlobServiceClient initialized.")
-        # Ensure the container exists
-        try:
-            container_client = blob_service_client.get_container_client(
-                AZURE_STORAGE_CONTAINER_NAME
-            )
-            container_client.create_container()
-            logger.info(
-                f"Product Service: Azure container '{AZURE_STORAGE_CONTAINER_NAME}' ensured to exist."
-            )
-        except Exception as e:
-            logger.warning(
-                f"Product Service: Could not create or verify Azure container '{AZURE_STORAGE_CONTAINER_NAME}'. It might already exist. Error: {e}"
-            )
-    except Exception as e:
-        logger.critical(
-            f"Product Service: Failed to initialize Azure BlobServiceClient. Check credentials and account name. Error: {e}",
-            exc_info=True,
-        )
-        blob_service_client = None  # Set to None if initialization fails
-else:
-    logger.warning(
-        "Product Service: Azure Storage credentials not found. Image upload functionality will be disabled."
-    )
-    blob_service_client = None
+# When true, /health/ready fails while image storage is unavailable; by default
+# storage is only reported, so product reads keep being served during an outage
+READINESS_REQUIRES_STORAGE = os.getenv("READINESS_REQUIRES_STORAGE", "false").lower() == "true"
 
+# Background task verifying image storage; kept so it can be cancelled on shutdown
+storage_init_task: Optional[asyncio.Task] = None
 
 RESTOCK_THRESHOLD = 5
 
@@ -100,6 +149,8 @@ RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
 RABBITMQ_USER = os.getenv("RABBITMQ_USER", "guest")
 RABBITMQ_PASS = os.getenv("RABBITMQ_PASS", "guest")
+# Unacknowledged order.placed messages held by this consumer at once
+CONSUMER_PREFETCH_COUNT = int(os.getenv("CONSUMER_PREFETCH_COUNT", "10"))
 
 # Global RabbitMQ connection and channel objects
 rabbitmq_connection: Optional[aio_pika.Connection] = None
@@ -123,6 +174,224 @@ app.add_middleware(
 )
 
 
+# --- Middleware for SQL Statement Metrics ---
+@app.middleware("http")
+async def count_database_queries(request: Request, call_next):
+    with track_request_queries() as queries:
+        response = await call_next(request)
+    # Label by route template (e.g. /orders/{order_id}) to keep cardinality bounded
+    route = getattr(request.scope.get("route"), "path", request.url.path)
+    report_request_queries(route, queries)
+    if DB_QUERY_COUNT_HEADER:
+        response.headers[QUERY_COUNT_HEADER] = str(sum(queries.values()))
+    return response
+
+
+# --- Middleware for Read-Your-Writes Tokens ---
+@app.middleware("http")
+async def add_consistency_token(request: Request, call_next):
+    # Clients echo the token on later reads so the replica is only used once it
+    # has replayed this write; only needed when a replica is configured. The
+    # position is captured when a write commits (see track_write_position)
+    if replica_status is None:
+        return await call_next(request)
+    with track_write_position() as position:
+        response = await call_next(request)
+    if position["lsn"] is not None and response.status_code < 400:
+        response.headers[CONSISTENCY_TOKEN_HEADER] = position["lsn"]
+    return response
+
+
+# --- Image Blob Reference Counting ---
+async def acquire_image_reference(db: AsyncSession, blob_name: str) -> bool:
+    """Adds a reference to an already stored blob. Returns False if it isn't stored."""
+    result = await db.execute(
+        update(ProductImageBlob)
+        .where(ProductImageBlob.blob_name == blob_name)
+        .values(ref_count=ProductImageBlob.ref_count + 1, unreferenced_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+async def register_image_blob(
+    db: AsyncSession, blob_name: str, size_bytes: int, content_type: str
+):
+    """Records a newly uploaded blob with one reference (two concurrent uploads of the same bytes both count)."""
+    statement = pg_insert(ProductImageBlob).values(
+        blob_name=blob_name,
+        ref_count=1,
+        size_bytes=size_bytes,
+        content_type=content_type,
+    )
+    await db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[ProductImageBlob.blob_name],
+            set_={
+                "ref_count": ProductImageBlob.ref_count + 1,
+                "unreferenced_at": None,
+            },
+        )
+    )
+
+
+async def release_image_reference(db: AsyncSession, blob_name: str):
+    """Drops a reference; blobs reaching zero become eligible for garbage collection."""
+    await db.execute(
+        update(ProductImageBlob)
+        .where(
+            ProductImageBlob.blob_name == blob_name, ProductImageBlob.ref_count > 0
+        )
+        .values(
+            ref_count=ProductImageBlob.ref_count - 1,
+            unreferenced_at=case(
+                (ProductImageBlob.ref_count == 1, func.now()), else_=None
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def collect_unreferenced_images(batch_size: int = IMAGE_GC_BATCH_SIZE) -> int:
+    """
+    Deletes one batch of unreferenced blobs (and their variants) from storage.
+    Rows are locked with SKIP LOCKED so concurrent collectors never overlap, and an
+    upload re-referencing a blob mid-collection waits for the row and re-uploads.
+    Returns the number of originals deleted.
+    """
+    storage = get_image_storage()
+    if not storage:
+        return 0
+
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(ProductImageBlob)
+            .where(
+                ProductImageBlob.ref_count == 0,
+                ProductImageBlob.unreferenced_at
+                <= func.now() - timedelta(seconds=IMAGE_GC_GRACE_PERIOD_SECONDS),
+            )
+            .order_by(ProductImageBlob.unreferenced_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        candidates = result.scalars().all()
+        if not candidates:
+            return 0  # Closing the session rolls back
+
+        blob_names = []
+        for candidate in candidates:
+            blob_names.append(candidate.blob_name)
+            blob_names.extend(
+                variant_blob_name(candidate.blob_name, variant)
+                for variant in IMAGE_VARIANT_SIZES
+            )
+        await storage.delete_many(blob_names)
+
+        for candidate in candidates:
+            await db.delete(candidate)
+        await db.commit()
+        logger.info(
+            f"Product Service: Garbage-collected {len(candidates)} unreferenced images ({len(blob_names)} blobs)."
+        )
+        return len(candidates)
+
+
+async def run_image_gc_periodically():
+    """Background task that drains unreferenced image blobs on a fixed interval."""
+    while True:
+        await asyncio.sleep(IMAGE_GC_INTERVAL_SECONDS)
+        try:
+            while await collect_unreferenced_images() == IMAGE_GC_BATCH_SIZE:
+                pass  # A full batch means there may be more to collect
+        except Exception as e:
+            logger.error(
+                f"Product Service: Image garbage collection failed: {e}", exc_info=True
+            )
+
+
+async def migrate_persisted_sas_urls() -> int:
+    """
+    Moves SAS URLs persisted by earlier versions of upload_product_image into
+    image_blob_name, so those images are signed at read time and stop expiring.
+    """
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Product).where(
+                Product.image_blob_name.is_(None),
+                Product.image_url.startswith(blob_url("")),
+            )
+        )
+        products = result.scalars().all()
+        for db_product in products:
+            db_product.image_blob_name = blob_name_from_url(db_product.image_url)
+            db_product.image_url = None
+        await db.commit()
+        return len(products)
+
+
+# --- Image Variant Pipeline ---
+async def save_image_variants(product_id: int, blob_name: str, variant_blob_names: dict):
+    """Stores variant blob names, unless the product's image changed while the job was queued."""
+    async with SessionLocal() as db:
+        db_product = await db.get(Product, product_id)
+        if not db_product or not db_product.image_blob_name:
+            logger.info(
+                f"Product Service: Product {product_id} no longer has an image. Discarding variants of '{blob_name}'."
+            )
+            return
+        if db_product.image_blob_name != blob_name:
+            logger.info(
+                f"Product Service: Product {product_id} image changed from '{blob_name}'. Discarding stale variants."
+            )
+            return
+        db_product.image_variants = variant_blob_names
+        await db.commit()
+        logger.info(
+            f"Product Service: Stored {len(variant_blob_names)} image variants for product {product_id}."
+        )
+
+
+async def generate_image_variants(product_id: int, blob_name: str):
+    """
+    Renders the resized variants of an uploaded image and stores them next to the
+    original. Variants that already exist are not rendered again.
+    """
+    storage = get_image_storage()
+    if not storage:
+        return
+
+    variant_blob_names = {
+        variant: variant_blob_name(blob_name, variant) for variant in IMAGE_VARIANT_SIZES
+    }
+    existing = await asyncio.gather(
+        *(run_blocking(storage.exists, name) for name in variant_blob_names.values())
+    )
+
+    if not all(existing):
+        original_data = await run_blocking(storage.read_bytes, blob_name)
+        rendered = await variant_pipeline.render(original_data)
+        await asyncio.gather(
+            *(
+                run_blocking(
+                    storage.put_bytes,
+                    variant_blob_names[variant],
+                    content,
+                    IMAGE_VARIANT_CONTENT_TYPE,
+                )
+                for variant, content in rendered.items()
+            )
+        )
+        logger.info(
+            f"Product Service: Rendered {len(rendered)} variants of '{blob_name}' for product {product_id}."
+        )
+
+    await save_image_variants(product_id, blob_name, variant_blob_names)
+
+
+variant_pipeline = ImageVariantPipeline(generate_image_variants)
+
+
 # --- RabbitMQ Helper Functions ---
 async def connect_to_rabbitmq():
     """Establishes an asynchronous connection to RabbitMQ."""
@@ -193,7 +462,7 @@ async def publish_event(routing_key: str, message_data: dict):
         )
 
 
-async def consume_order_placed_events(db_session: Session):
+async def consume_order_placed_events():
     """
     Consumes messages from the 'order.placed' queue and processes stock deductions.
     This function runs in a separate background task.
@@ -208,6 +477,9 @@ async def consume_order_placed_events(db_session: Session):
     order_placed_routing_key = "order.placed"
 
     try:
+        # Messages are handled one at a time; keep only a few unacknowledged ones
+        # here and leave the rest in the broker
+        await rabbitmq_channel.set_qos(prefetch_count=CONSUMER_PREFETCH_COUNT)
         queue = await rabbitmq_channel.declare_queue(queue_name, durable=True)
         await queue.bind(rabbitmq_exchange, routing_key=order_placed_routing_key)
         logger.info(
@@ -216,94 +488,113 @@ async def consume_order_placed_events(db_session: Session):
 
         async with queue.iterator() as queue_iter:
             async for message in queue_iter:
-                async with message.process():
-                    try:
-                        message_data = json.loads(message.body.decode("utf-8"))
-                        logger.info(
-                            f"Product Service: Received order.placed message: {message_data}"
-                        )
-
-                        order_id = message_data.get("order_id")
-                        order_items = message_data.get("items", [])
+                ORDER_CONSUMER_IN_FLIGHT.labels(app_name=APP_NAME).inc()
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    async with message.process():
+                        try:
+                            message_data = json.loads(message.body.decode("utf-8"))
+                            logger.info(
+                                f"Product Service: Received order.placed message: {message_data}"
+                            )
 
-                        success = True
-                        failed_products = []
+                            order_id = message_data.get("order_id")
+                            order_items = message_data.get("items", [])
+
+                            success = True
+                            failed_products = []
+
+                            local_db_session = ConsumerSessionLocal()
+                            try:
+                                for item in order_items:
+                                    product_id = item.get("product_id")
+                                    quantity = item.get("quantity")
+                                    if not product_id or not quantity:
+                                        logger.error(
+                                            f"Product Service: Invalid item data in message: {item}"
+                                        )
+                                        success = False
+                                        break
+
+                                    # Deduct stock
+                                    db_product = await local_db_session.get(
+                                        Product, product_id
+                                    )
 
-                        local_db_session = Session(bind=engine)
-                        try:
-                            for item in order_items:
-                                product_id = item.get("product_id")
-                                quantity = item.get("quantity")
-                                if not product_id or not quantity:
-                                    logger.error(
-                                        f"Product Service: Invalid item data in message: {item}"
+                                    if not db_product:
+                                        logger.warning(
+                                            f"Product Service: Stock deduction failed for order {order_id}. Product {product_id} not found."
+                                        )
+                                        success = False
+                                        failed_products.append(
+                                            {
+                                                "product_id": product_id,
+                                                "reason": "product_not_found",
+                                            }
+                                        )
+                                        break  # Fail entire order deduction if a product is not found
+
+                                    if db_product.stock_quantity < quantity:
+                                        logger.warning(
+                                            f"Product Service: Stock deduction failed for order {order_id}. Insufficient stock for product {product_id}. Available: {db_product.stock_quantity}, Requested: {quantity}."
+                                        )
+                                        success = False
+                                        failed_products.append(
+                                            {
+                                                "product_id": product_id,
+                                                "reason": "insufficient_stock",
+                                                "available_stock": db_product.stock_quantity,
+                                            }
+                                        )
+                                        break  # Fail entire order deduction if stock is insufficient
+
+                                    db_product.stock_quantity -= quantity
+                                    local_db_session.add(db_product)
+                                    logger.info(
+                                        f"Product Service: Deducted {quantity} from product {product_id} for order {order_id}. New stock: {db_product.stock_quantity}."
                                     )
-                                    success = False
-                                    break
-
-                                # Deduct stock
-                                db_product = (
-                                    local_db_session.query(Product)
-                                    .filter(Product.product_id == product_id)
-                                    .first()
-                                )
 
-                                if not db_product:
-                                    logger.warning(
-                                        f"Product Service: Stock deduction failed for order {order_id}. Product {product_id} not found."
+                                    # Optional: Log or trigger alert if stock falls below threshold
+                                    if db_product.stock_quantity < RESTOCK_THRESHOLD:
+                                        logger.warning(
+                                            f"Product Service: ALERT! Stock for product '{db_product.name}' (ID: {db_product.product_id}) is low: {db_product.stock_quantity}."
+                                        )
+
+                                if success:
+                                    await local_db_session.commit()
+                                    outcome = "deducted"
+                                    logger.info(
+                                        f"Product Service: Successfully deducted stock for all items in order {order_id}. Publishing 'product.stock.deducted' event."
                                     )
-                                    success = False
-                                    failed_products.append(
+                                    await publish_event(
+                                        "product.stock.deducted",
                                         {
-                                            "product_id": product_id,
-                                            "reason": "product_not_found",
-                                        }
+                                            "order_id": order_id,
+                                            "status": "success",
+                                            "timestamp": datetime.utcnow().isoformat(),
+                                        },
                                     )
-                                    break  # Fail entire order deduction if a product is not found
-
-                                if db_product.stock_quantity < quantity:
-                                    logger.warning(
-                                        f"Product Service: Stock deduction failed for order {order_id}. Insufficient stock for product {product_id}. Available: {db_product.stock_quantity}, Requested: {quantity}."
+                                else:
+                                    await local_db_session.rollback()  # Rollback all changes if any item fails
+                                    outcome = "rejected"
+                                    logger.error(
+                                        f"Product Service: Failed to deduct stock for order {order_id}. Rolling back. Publishing 'product.stock.deduction.failed' event."
                                     )
-                                    success = False
-                                    failed_products.append(
+                                    await publish_event(
+                                        "product.stock.deduction.failed",
                                         {
-                                            "product_id": product_id,
-                                            "reason": "insufficient_stock",
-                                            "available_stock": db_product.stock_quantity,
-                                        }
-                                    )
-                                    break  # Fail entire order deduction if stock is insufficient
-
-                                db_product.stock_quantity -= quantity
-                                local_db_session.add(db_product)
-                                logger.info(
-                                    f"Product Service: Deducted {quantity} from product {product_id} for order {order_id}. New stock: {db_product.stock_quantity}."
-                                )
-
-                                # Optional: Log or trigger alert if stock falls below threshold
-                                if db_product.stock_quantity < RESTOCK_THRESHOLD:
-                                    logger.warning(
-                                        f"Product Service: ALERT! Stock for product '{db_product.name}' (ID: {db_product.product_id}) is low: {db_product.stock_quantity}."
+                                            "order_id": order_id,
+                                            "status": "failed",
+                                            "timestamp": datetime.utcnow().isoformat(),
+                                            "details": failed_products,
+                                        },
                                     )
-
-                            if success:
-                                local_db_session.commit()
-                                logger.info(
-                                    f"Product Service: Successfully deducted stock for all items in order {order_id}. Publishing 'product.stock.deducted' event."
-                                )
-                                await publish_event(
-                                    "product.stock.deducted",
-                                    {
-                                        "order_id": order_id,
-                                        "status": "success",
-                                        "timestamp": datetime.utcnow().isoformat(),
-                                    },
-                                )
-                            else:
-                                local_db_session.rollback()  # Rollback all changes if any item fails
-                                logger.error(
-                                    f"Product Service: Failed to deduct stock for order {order_id}. Rolling back. Publishing 'product.stock.deduction.failed' event."
+                            except Exception as db_e:
+                                await local_db_session.rollback()
+                                logger.critical(
+                                    f"Product Service: Database error during stock deduction for order {order_id}: {db_e}",
+                                    exc_info=True,
                                 )
                                 await publish_event(
                                     "product.stock.deduction.failed",
@@ -311,41 +602,32 @@ async def consume_order_placed_events(db_session: Session):
                                         "order_id": order_id,
                                         "status": "failed",
                                         "timestamp": datetime.utcnow().isoformat(),
-                                        "details": failed_products,
+                                        "details": [
+                                            {
+                                                "reason": "database_error",
+                                                "message": str(db_e),
+                                            }
+                                        ],
                                     },
                                 )
-                        except Exception as db_e:
-                            local_db_session.rollback()
-                            logger.critical(
-                                f"Product Service: Database error during stock deduction for order {order_id}: {db_e}",
-                                exc_info=True,
+                            finally:
+                                await local_db_session.close()
+
+                        except json.JSONDecodeError as e:
+                            outcome = "invalid"
+                            logger.error(
+                                f"Product Service: Failed to decode RabbitMQ message body: {e}. Message: {message.body}"
                             )
-                            await publish_event(
-                                "product.stock.deduction.failed",
-                                {
-                                    "order_id": order_id,
-                                    "status": "failed",
-                                    "timestamp": datetime.utcnow().isoformat(),
-                                    "details": [
-                                        {
-                                            "reason": "database_error",
-                                            "message": str(db_e),
-                                        }
-                                    ],
-                                },
+                        except Exception as e:
+                            logger.error(
+                                f"Product Service: Unhandled error processing order.placed message: {e}",
+                                exc_info=True,
                             )
-                        finally:
-                            local_db_session.close()
-
-                    except json.JSONDecodeError as e:
-                        logger.error(
-                            f"Product Service: Failed to decode RabbitMQ message body: {e}. Message: {message.body}"
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"Product Service: Unhandled error processing order.placed message: {e}",
-                            exc_info=True,
-                        )
+                finally:
+                    ORDER_CONSUMER_IN_FLIGHT.labels(app_name=APP_NAME).dec()
+                    ORDER_CONSUMER_DURATION.labels(
+                        app_name=APP_NAME, outcome=outcome
+                    ).observe(time.perf_counter() - started)
     except Exception as e:
         logger.critical(
             f"Product Service: Error in RabbitMQ consumer for order.placed events: {e}",
@@ -363,18 +645,19 @@ async def startup_event():
             logger.info(
                 f"Product Service: Attempting to connect to PostgreSQL and create tables (attempt {i+1}/{max_retries})..."
             )
-            Base.metadata.create_all(bind=engine)
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
             logger.info(
                 "Product Service: Successfully connected to PostgreSQL and ensured tables exist."
             )
             break  # Exit loop if successful
-        except OperationalError as e:
+        except (OperationalError, OSError) as e:
             logger.warning(f"Product Service: Failed to connect to PostgreSQL: {e}")
             if i < max_retries - 1:
                 logger.info(
                     f"Product Service: Retrying in {retry_delay_seconds} seconds..."
                 )
-                time.sleep(retry_delay_seconds)
+                await asyncio.sleep(retry_delay_seconds)
             else:
                 logger.critical(
                     f"Product Service: Failed to connect to PostgreSQL after {max_retries} attempts. Exiting application."
@@ -387,15 +670,42 @@ async def startup_event():
             )
             sys.exit(1)
 
+    # Storage is verified in the background so startup never waits on Azure
+    global storage_init_task
+    storage_init_task = asyncio.create_task(initialize_image_storage())
+
+    variant_pipeline.start()
+    storage = get_image_storage()
+    if isinstance(storage, AzureBlobStorage):
+        migrated = await migrate_persisted_sas_urls()
+        if migrated:
+            logger.info(
+                f"Product Service: Converted {migrated} persisted SAS URLs to blob names."
+            )
+    if storage:
+        asyncio.create_task(run_image_gc_periodically())
+
     # Connect to RabbitMQ and start consumer
     if await connect_to_rabbitmq():
-        asyncio.create_task(consume_order_placed_events(next(get_db())))
+        asyncio.create_task(consume_order_placed_events())
     else:
         logger.error(
             "Product Service: RabbitMQ connection failed at startup. Async order processing will not work."
         )
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if storage_init_task:
+        storage_init_task.cancel()
+    await variant_pipeline.stop()
+    await close_rabbitmq_connection()
+    await consumer_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
+    await engine.dispose()
+
+
 # --- Root Endpoint ---
 @app.get("/", status_code=status.HTTP_200_OK, summary="Root endpoint")
 async def read_root():
@@ -408,6 +718,45 @@ async def health_check():
     return {"status": "ok", "service": "product-service"}
 
 
+async def ping_database():
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+@app.get("/health/ready", summary="Readiness check covering the database and image storage")
+async def readiness_check(response: Response):
+    checks = {}
+    try:
+        await ping_database()
+        checks["database"] = "available"
+    except Exception as e:
+        logger.warning(f"Product Service: Readiness check could not reach the database: {e}")
+        checks["database"] = "unavailable"
+
+    storage = get_image_storage()
+    checks["storage"] = storage.status if storage else "disabled"
+
+    ready = checks["database"] == "available" and (
+        not READINESS_REQUIRES_STORAGE or checks["storage"] == "available"
+    )
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    result = {
+        "status": "ready" if ready else "not_ready",
+        "service": "product-service",
+        "checks": checks,
+    }
+    if storage and storage.last_error:
+        result["storage_error"] = storage.last_error
+    return result
+
+
+# --- Prometheus Metrics Endpoint ---
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus metrics endpoint")
+async def metrics():
+    return PlainTextResponse(generate_latest(registry))
+
+
 # --- CRUD Endpoints ---
 @app.post(
     "/products/",
@@ -415,19 +764,21 @@ async def health_check():
     status_code=status.HTTP_201_CREATED,
     summary="Create a new product",
 )
-async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+async def create_product(
+    product: ProductCreate, db: AsyncSession = Depends(get_db)
+):
     logger.info(f"Product Service: Creating product: {product.name}")
     try:
         db_product = Product(**product.model_dump())
         db.add(db_product)
-        db.commit()
-        db.refresh(db_product)
+        await db.commit()
+        await db.refresh(db_product)
         logger.info(
             f"Product Service: Product '{db_product.name}' (ID: {db_product.product_id}) created successfully."
         )
         return db_product
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         logger.warning(
             f"Product Service: Integrity error creating product: likely duplicate name or ID issue for product: {product.name}"
         )
@@ -436,7 +787,7 @@ async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
             detail="Product with this name might already exist or similar data integrity issue.",
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Product Service: Error creating product: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -444,13 +795,28 @@ async def create_product(product: ProductCreate, db: Session = Depends(get_db)):
         )
 
 
+# Columns needed to build a ProductResponse
+PRODUCT_LIST_COLUMNS = (
+    Product.product_id,
+    Product.name,
+    Product.description,
+    Product.price,
+    Product.stock_quantity,
+    Product.image_url,
+    Product.image_blob_name,
+    Product.image_variants,
+    Product.created_at,
+    Product.updated_at,
+)
+
+
 @app.get(
     "/products/",
     response_model=List[ProductResponse],
     summary="Retrieve a list of all products",
 )
-def list_products(
-    db: Session = Depends(get_db),
+async def list_products(
+    db: AsyncSession = Depends(get_read_db),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
     search: Optional[str] = Query(None, max_length=255),
@@ -458,20 +824,71 @@ def list_products(
     logger.info(
         f"Product Service: Listing products with skip={skip}, limit={limit}, search='{search}'"
     )
-    query = db.query(Product)
+    # Read-only fast path: plain rows straight to JSON bytes, without ORM objects
+    # in the identity map or ProductResponse validation per row
+    query = select(*PRODUCT_LIST_COLUMNS)
     if search:
         search_pattern = f"%{search}%"
         logger.info(f"Product Service: Applying search filter for term: {search}")
-        query = query.filter(
+        query = query.where(
             (Product.name.ilike(search_pattern))
             | (Product.description.ilike(search_pattern))
         )
-    products = query.offset(skip).limit(limit).all()
+    result = await db.execute(query.offset(skip).limit(limit))
+    products = [product_row_to_json(row) for row in result]
 
     logger.info(
         f"Product Service: Retrieved {len(products)} products (skip={skip}, limit={limit})."
     )
-    return products
+    return Response(content=pydantic_core.to_json(products), media_type="application/json")
+
+
+# --- Catalog Import/Export Endpoints ---
+# Registered before /products/{product_id} so "import" and "export" aren't read as IDs
+@app.post("/products/import", summary="Bulk import the catalog from CSV or NDJSON via COPY")
+async def import_products(
+    request: Request, format: str = Query("csv", pattern="^(csv|ndjson)$")
+):
+    """
+    Streams the request body (CSV with a header row, or NDJSON) into a staging
+    table with COPY FROM STDIN and upserts it into the catalog in one statement.
+    Rows with a product_id replace that product's catalog fields; rows without
+    one create new products. The whole file is applied in one transaction.
+    """
+    logger.info(f"Product Service: Importing catalog as {format}.")
+    started = time.perf_counter()
+    try:
+        async with engine.connect() as connection:
+            driver_connection = (await connection.get_raw_connection()).driver_connection
+            async with driver_connection.transaction():
+                rows_staged, rows_upserted = await import_catalog(
+                    driver_connection, format, request.stream()
+                )
+    except CatalogImportError as e:
+        logger.warning(f"Product Service: Rejected catalog import: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    seconds = time.perf_counter() - started
+    rows_per_second = report_copy_throughput("import", rows_staged, seconds)
+    logger.info(
+        f"Product Service: Imported {rows_staged} catalog rows ({rows_upserted} upserted) in {seconds:.2f}s ({rows_per_second:.0f} rows/s)."
+    )
+    return {
+        "rows_staged": rows_staged,
+        "rows_upserted": rows_upserted,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows_per_second, 1),
+    }
+
+
+@app.get("/products/export", summary="Stream the whole catalog as CSV or NDJSON via COPY")
+async def export_products(format: str = Query("csv", pattern="^(csv|ndjson)$")):
+    logger.info(f"Product Service: Exporting catalog as {format}.")
+    return StreamingResponse(
+        stream_catalog_export(engine, format),
+        media_type=CATALOG_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="products.{format}"'},
+    )
 
 
 @app.get(
@@ -479,9 +896,9 @@ def list_products(
     response_model=ProductResponse,
     summary="Retrieve a single product by ID",
 )
-def get_product(product_id: int, db: Session = Depends(get_db)):
+async def get_product(product_id: int, db: AsyncSession = Depends(get_read_db)):
     logger.info(f"Product Service: Fetching product with ID: {product_id}")
-    product = db.query(Product).filter(Product.product_id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         logger.warning(f"Product Service: Product with ID {product_id} not found.")
         raise HTTPException(
@@ -500,12 +917,12 @@ def get_product(product_id: int, db: Session = Depends(get_db)):
     summary="Update an existing product by ID",
 )
 async def update_product(
-    product_id: int, product: ProductUpdate, db: Session = Depends(get_db)
+    product_id: int, product: ProductUpdate, db: AsyncSession = Depends(get_db)
 ):
     logger.info(
         f"Product Service: Updating product with ID: {product_id} with data: {product.model_dump(exclude_unset=True)}"
     )
-    db_product = db.query(Product).filter(Product.product_id == product_id).first()
+    db_product = await db.get(Product, product_id)
     if not db_product:
         logger.warning(
             f"Product Service: Attempted to update non-existent product with ID {product_id}."
@@ -518,14 +935,20 @@ async def update_product(
     for key, value in update_data.items():
         setattr(db_product, key, value)
 
+    # An explicitly set image_url replaces any uploaded image
+    if "image_url" in update_data and db_product.image_blob_name:
+        await release_image_reference(db, db_product.image_blob_name)
+        db_product.image_blob_name = None
+        db_product.image_variants = None
+
     try:
         db.add(db_product)  # Mark for update
-        db.commit()
-        db.refresh(db_product)
+        await db.commit()
+        await db.refresh(db_product)
         logger.info(f"Product Service: Product {product_id} updated successfully.")
         return db_product
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(
             f"Product Service: Error updating product {product_id}: {e}", exc_info=True
         )
@@ -540,9 +963,9 @@ async def update_product(
     status_code=status.HTTP_204_NO_CONTENT,
     summary="Delete a product by ID",
 )
-def delete_product(product_id: int, db: Session = Depends(get_db)):
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
     logger.info(f"Product Service: Attempting to delete product with ID: {product_id}")
-    product = db.query(Product).filter(Product.product_id == product_id).first()
+    product = await db.get(Product, product_id)
     if not product:
         logger.warning(
             f"Product Service: Attempted to delete non-existent product with ID {product_id}."
@@ -552,13 +975,15 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
         )
 
     try:
-        db.delete(product)
-        db.commit()
+        if product.image_blob_name:
+            await release_image_reference(db, product.image_blob_name)
+        await db.delete(product)
+        await db.commit()
         logger.info(
             f"Product Service: Product {product_id} deleted successfully. Name: {product.name}"
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(
             f"Product Service: Error deleting product {product_id}: {e}", exc_info=True
         )
@@ -572,18 +997,21 @@ def delete_product(product_id: int, db: Session = Depends(get_db)):
 @app.post(
     "/products/{product_id}/upload-image",
     response_model=ProductResponse,
-    summary="Upload an image for a product to Azure Blob Storage",
+    summary="Upload an image for a product to the configured image storage",
 )
 async def upload_product_image(
-    product_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)
+    product_id: int,
+    file: UploadFile = File(...),
+    db: AsyncSession = Depends(get_db),
 ):
-    if not blob_service_client:
+    storage = get_image_storage()
+    if not storage:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Azure Blob Storage is not configured or available.",
+            detail="Image storage is not configured or available.",
         )
 
-    db_product = db.query(Product).filter(Product.product_id == product_id).first()
+    db_product = await db.get(Product, product_id)
     if not db_product:
         logger.warning(
             f"Product Service: Product with ID {product_id} not found for image upload."
@@ -601,53 +1029,47 @@ async def upload_product_image(
         )
 
     try:
-        # Create a unique blob name (e.g., product_id/timestamp_originalfilename.ext)
-        file_extension = (
-            os.path.splitext(file.filename)[1]
-            if os.path.splitext(file.filename)[1]
-            else ".jpg"
-        )  # Ensure extension
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        blob_name = f"{timestamp}{file_extension}"
-
-        blob_client = blob_service_client.get_blob_client(
-            container=AZURE_STORAGE_CONTAINER_NAME, blob=blob_name
-        )
-
-        logger.info(
-            f"Product Service: Uploading image '{file.filename}' for product {product_id} as '{blob_name}' to Azure."
-        )
+        # Blobs are named by the SHA-256 of their content, so identical images
+        # uploaded for many products (or re-uploaded) are stored only once
+        digest, size_bytes = await hash_upload(file)
+        blob_name = content_addressed_blob_name(digest, file.content_type)
+        previous_blob_name = db_product.image_blob_name
 
-        blob_client.upload_blob(
-            file.file,
-            overwrite=True,
-            content_settings=ContentSettings(content_type=file.content_type),
-        )
-
-        sas_token = generate_blob_sas(
-            account_name=AZURE_STORAGE_ACCOUNT_NAME,
-            account_key=AZURE_STORAGE_ACCOUNT_KEY,
-            container_name=AZURE_STORAGE_CONTAINER_NAME,
-            blob_name=blob_name,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.utcnow() + timedelta(hours=AZURE_SAS_TOKEN_EXPIRY_HOURS),
-        )
-        # Construct the full URL with SAS token
-        image_url = f"{blob_client.url}?{sas_token}"
-
-        # Update the product in the database with the image URL (including SAS token)
-        db_product.image_url = image_url
+        if await acquire_image_reference(db, blob_name):
+            logger.info(
+                f"Product Service: Image '{file.filename}' for product {product_id} already stored as '{blob_name}'. Skipping upload."
+            )
+        else:
+            logger.info(
+                f"Product Service: Uploading image '{file.filename}' for product {product_id} as '{blob_name}' to {storage.name} storage."
+            )
+            # The blob only becomes visible (and the DB is only updated) once the
+            # backend has fully stored it: Azure commits a staged block list, local
+            # disk renames a completed temporary file
+            await storage.upload_file(blob_name, file, file.content_type)
+            await register_image_blob(db, blob_name, size_bytes, file.content_type)
+
+        if previous_blob_name:
+            await release_image_reference(db, previous_blob_name)
+
+        # Only the blob name is persisted; ProductResponse signs a URL at read time.
+        # Variants of a different previous image no longer apply; new ones are queued below.
+        db_product.image_blob_name = blob_name
+        db_product.image_url = None
+        if previous_blob_name != blob_name:
+            db_product.image_variants = None
         db.add(db_product)
-        db.commit()
-        db.refresh(db_product)
+        await db.commit()
+        await db.refresh(db_product)
 
         logger.info(
-            f"Product Service: Image uploaded and product {product_id} updated with SAS URL: {image_url}"
+            f"Product Service: Image uploaded and product {product_id} updated with blob '{blob_name}'."
         )
+        variant_pipeline.enqueue(product_id, blob_name)
         return db_product
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(
             f"Product Service: Error uploading image for product {product_id}: {e}",
             exc_info=True,
@@ -658,6 +1080,261 @@ async def upload_product_image(
         )
 
 
+# --- Bulk Image Ingestion ---
+bulk_image_jobs = BulkImageJobRegistry()
+
+
+async def image_blob_registered(blob_name: str) -> bool:
+    async with SessionLocal() as db:
+        return await db.get(ProductImageBlob, blob_name) is not None
+
+
+async def commit_bulk_image_batch(items: List[BulkImageItem]):
+    """Points a batch of products at their uploaded blobs in a single transaction."""
+    async with SessionLocal() as db:
+        product_ids = {item.product_id for item in items}
+        result = await db.execute(
+            select(Product).where(Product.product_id.in_(list(product_ids)))
+        )
+        products = {db_product.product_id: db_product for db_product in result.scalars()}
+        for item in items:
+            if not await acquire_image_reference(db, item.blob_name):
+                if not item.uploaded:
+                    # Collected between the existence check and this commit
+                    item.fail("Stored image was garbage-collected during the job; retry.")
+                    continue
+                await register_image_blob(
+                    db, item.blob_name, item.size_bytes, item.content_type
+                )
+
+            db_product = products.get(item.product_id)
+            if db_product is None:
+                await release_image_reference(db, item.blob_name)  # Leaves the blob to GC
+                item.fail("Product not found.")
+                continue
+
+            previous_blob_name = db_product.image_blob_name
+            if previous_blob_name:
+                await release_image_reference(db, previous_blob_name)
+            db_product.image_blob_name = item.blob_name
+            db_product.image_url = None
+            if previous_blob_name != item.blob_name:
+                db_product.image_variants = None
+            item.succeed()
+        await db.commit()
+
+
+async def run_bulk_image_job(
+    job: BulkImageJob, archive_path: str, manifest: Optional[Dict[str, int]]
+):
+    """
+    Streams entries out of an archive and uploads them with bounded concurrency.
+    Each entry is hashed and stored content-addressed like a single upload (bytes
+    repeated within the job or already stored are uploaded once), and product
+    updates are committed IMAGE_BULK_COMMIT_BATCH_SIZE at a time.
+    """
+    storage = get_image_storage()
+    slots = asyncio.Semaphore(IMAGE_BULK_MAX_CONCURRENCY)
+    commit_lock = asyncio.Lock()
+    pending: List[BulkImageItem] = []
+    uploads: Dict[str, asyncio.Future] = {}
+    tasks = set()
+
+    async def flush():
+        async with commit_lock:
+            batch = pending[:]
+            pending.clear()
+            if not batch:
+                return
+            try:
+                await commit_bulk_image_batch(batch)
+            except Exception as e:
+                logger.error(
+                    f"Product Service: Bulk image job {job.job_id} failed to commit {len(batch)} items: {e}",
+                    exc_info=True,
+                )
+                for item in batch:
+                    item.fail(f"Could not update product: {e}")
+            for item in batch:
+                job.record(item)
+                if item.status == "succeeded":
+                    variant_pipeline.enqueue(item.product_id, item.blob_name)
+
+    async def store(blob_name: str, upload: UploadFile, content_type: str) -> bool:
+        if await image_blob_registered(blob_name):
+            return False
+        await storage.upload_file(blob_name, upload, content_type)
+        return True
+
+    async def process_entry(item: BulkImageItem, spool):
+        try:
+            upload = UploadFile(file=spool, filename=item.file)
+            digest, item.size_bytes = await hash_upload(upload)
+            item.blob_name = content_addressed_blob_name(digest, item.content_type)
+            if item.blob_name not in uploads:
+                uploads[item.blob_name] = asyncio.ensure_future(
+                    store(item.blob_name, upload, item.content_type)
+                )
+            item.uploaded = await uploads[item.blob_name]
+            pending.append(item)
+        except Exception as e:
+            logger.error(
+                f"Product Service: Bulk image job {job.job_id} failed to upload '{item.file}': {e}"
+            )
+            item.fail(f"Could not upload image: {e}")
+            job.record(item)
+        finally:
+            spool.close()
+            slots.release()
+        if len(pending) >= IMAGE_BULK_COMMIT_BATCH_SIZE:
+            await flush()
+
+    job.status = "running"
+    entries = iter_archive_entries(archive_path)
+    error = None
+    try:
+        while True:
+            await slots.acquire()
+            entry = await run_blocking(read_next_entry, entries)
+            if entry is None:
+                slots.release()
+                break
+            name, spool = entry
+            if is_ignored_entry(name):
+                slots.release()
+                continue
+
+            job.entries_seen += 1
+            item = BulkImageItem(name)
+            item.product_id = resolve_product_id(name, manifest)
+            item.content_type = EXTENSION_CONTENT_TYPES.get(
+                os.path.splitext(name)[1].lower()
+            )
+            if isinstance(spool, EntryTooLarge):
+                item.skip("File is too large.")
+            elif item.content_type is None:
+                item.skip("Unsupported file type.")
+            elif item.product_id is None:
+                item.skip("No product ID for this file.")
+            if item.status == "skipped":
+                if not isinstance(spool, EntryTooLarge):
+                    spool.close()
+                slots.release()
+                job.record(item)
+                continue
+
+            task = asyncio.create_task(process_entry(item, spool))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except Exception as e:
+        # A corrupt archive stops reading; entries already read still complete
+        error = f"Could not read archive: {e}"
+        logger.error(f"Product Service: Bulk image job {job.job_id}: {error}")
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await flush()
+        entries.close()
+        os.remove(archive_path)
+
+    job.finish("failed" if error else "completed", error)
+    logger.info(
+        f"Product Service: Bulk image job {job.job_id} {job.status}: {job.counts['succeeded']} succeeded, {job.counts['failed']} failed, {job.counts['skipped']} skipped."
+    )
+
+
+@app.post(
+    "/products/images/bulk",
+    response_model=BulkImageJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    summary="Upload many product images from a zip or tar archive as a background job",
+)
+async def bulk_upload_product_images(
+    file: UploadFile = File(..., description="Zip or tar archive of images."),
+    manifest: Optional[str] = Form(
+        None,
+        description="JSON mapping of archive paths to product IDs. Without it, file names must be product IDs (e.g. 42.jpg).",
+    ),
+):
+    if not get_image_storage():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Image storage is not configured or available.",
+        )
+    try:
+        mapping = parse_manifest(manifest)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # The upload is closed when this request ends, so the job reads its own copy
+    archive_path = await run_blocking(save_to_temp_file, file.file)
+    if not await run_blocking(is_supported_archive, archive_path):
+        os.remove(archive_path)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid file type. Only zip and tar archives are allowed.",
+        )
+
+    job = bulk_image_jobs.create(file.filename)
+    job.task = asyncio.create_task(run_bulk_image_job(job, archive_path, mapping))
+    logger.info(
+        f"Product Service: Started bulk image job {job.job_id} for archive '{file.filename}'."
+    )
+    return job.to_dict()
+
+
+@app.get(
+    "/products/images/bulk/{job_id}",
+    response_model=BulkImageJobResponse,
+    summary="Get progress and per-item results of a bulk image upload job",
+)
+async def get_bulk_image_job(job_id: str):
+    job = bulk_image_jobs.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Bulk image job not found"
+        )
+    return job.to_dict()
+
+
+@app.post(
+    "/images/gc",
+    summary="Garbage-collect one batch of product images no longer referenced by any product",
+)
+async def garbage_collect_images(batch_size: int = Query(IMAGE_GC_BATCH_SIZE, ge=1, le=1000)):
+    if not get_image_storage():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Image storage is not configured or available.",
+        )
+    deleted = await collect_unreferenced_images(batch_size)
+    return {"deleted": deleted}
+
+
+@app.get(
+    "/images/{blob_name}",
+    summary="Serve a product image from local storage or the on-disk cache of remote blobs",
+    responses={206: {"description": "Partial content"}, 304: {"description": "Not modified"}},
+)
+async def serve_image(blob_name: str, request: Request):
+    storage = get_image_storage()
+    if not storage or not is_valid_blob_name(blob_name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Image not found"
+        )
+
+    path = storage.local_path(blob_name)
+    if path is None:
+        path = await get_image_cache().get_path(storage, blob_name)
+    # Content-addressed names identify the bytes, so the name doubles as a strong ETag
+    etag = f'"{os.path.splitext(blob_name)[0]}"'
+    try:
+        if path:
+            return mmap_file_response(request, path, etag)
+    except FileNotFoundError:
+        pass
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+
+
 # --- Endpoint for Stock Deduction ---
 @app.patch(
     "/products/{product_id}/deduct-stock",
@@ -665,12 +1342,14 @@ async def upload_product_image(
     summary="[DEPRECATED/FALLBACK] Deduct stock quantity for a product (prefer async events)",
 )
 async def deduct_product_stock_sync(
-    product_id: int, request: StockDeductRequest, db: Session = Depends(get_db)
+    product_id: int,
+    request: StockDeductRequest,
+    db: AsyncSession = Depends(get_db),
 ):
     logger.info(
         f"Product Service: Attempting to deduct {request.quantity_to_deduct} from stock for product ID: {product_id}"
     )
-    db_product = db.query(Product).filter(Product.product_id == product_id).first()
+    db_product = await db.get(Product, product_id)
 
     if not db_product:
         logger.warning(
@@ -694,8 +1373,8 @@ async def deduct_product_stock_sync(
 
     try:
         db.add(db_product)
-        db.commit()
-        db.refresh(db_product)
+        await db.commit()
+        await db.refresh(db_product)
         logger.info(
             f"Product Service: Stock for product {product_id} updated to {db_product.stock_quantity}. Deducted {request.quantity_to_deduct}."
         )
@@ -708,7 +1387,7 @@ async def deduct_product_stock_sync(
 
         return db_product
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(
             f"Product Service: Error deducting stock for product {product_id}: {e}",
             exc_info=True,
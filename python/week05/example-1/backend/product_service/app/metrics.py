@@ -0,0 +1,147 @@
+# week05/example-1/backend/product_service/app/metrics.py
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CollectorRegistry
+
+# --- Prometheus Metrics Initialization ---
+# Create a custom registry specific to this application instance
+registry = CollectorRegistry()
+APP_NAME = "product_service"  # Unique identifier for this service in metrics
+
+# Histogram: Wall-clock time of an image upload to blob storage (staging + commit)
+IMAGE_UPLOAD_DURATION = Histogram(
+    "product_image_upload_duration_seconds",
+    "Time taken to upload a product image to blob storage",
+    ["app_name", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=registry,
+)
+# Histogram: Effective upload throughput for successful uploads
+IMAGE_UPLOAD_THROUGHPUT = Histogram(
+    "product_image_upload_throughput_bytes_per_second",
+    "Effective throughput of successful product image uploads",
+    ["app_name"],
+    buckets=(64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6),
+    registry=registry,
+)
+# Counter: Signed URL cache lookups, by hit/miss
+SAS_URL_CACHE_REQUESTS = Counter(
+    "product_image_sas_url_cache_requests_total",
+    "Signed image URL cache lookups",
+    ["app_name", "result"],
+    registry=registry,
+)
+# Counter: On-disk image cache lookups in GET /images, by hit/miss
+IMAGE_DISK_CACHE_REQUESTS = Counter(
+    "product_image_disk_cache_requests_total",
+    "On-disk image cache lookups for remote blobs",
+    ["app_name", "result"],
+    registry=registry,
+)
+# Gauge: Bytes currently held by the on-disk image cache
+IMAGE_DISK_CACHE_BYTES = Gauge(
+    "product_image_disk_cache_bytes",
+    "Bytes currently stored in the on-disk image cache",
+    ["app_name"],
+    registry=registry,
+)
+# Gauge: order.placed messages currently being processed by the consumer
+ORDER_CONSUMER_IN_FLIGHT = Gauge(
+    "product_order_consumer_in_flight_messages",
+    "order.placed messages currently being processed",
+    ["app_name"],
+    registry=registry,
+)
+# Histogram: Time spent processing one order.placed message, by outcome
+ORDER_CONSUMER_DURATION = Histogram(
+    "product_order_consumer_duration_seconds",
+    "Time taken to process an order.placed message",
+    ["app_name", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    registry=registry,
+)
+
+# --- Database Connection Pool Metrics ---
+# Labelled by pool ("api" for request handlers, "consumer" for RabbitMQ consumers)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections",
+    "Connections currently checked out of the pool",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections open beyond pool_size (counted against max_overflow)",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["app_name", "pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+    registry=registry,
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout seconds",
+    ["app_name", "pool"],
+    registry=registry,
+)
+DB_POOL_INVALIDATIONS = Counter(
+    "db_pool_invalidations_total",
+    "Connections invalidated (hard: closed after an error; soft: replaced on next checkout)",
+    ["app_name", "pool", "kind"],
+    registry=registry,
+)
+
+# --- SQL Statement Metrics ---
+# Labelled by statement fingerprint: literals and bind parameters replaced with ?
+DB_STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "Time taken to execute a SQL statement, by statement fingerprint",
+    ["app_name", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5),
+    registry=registry,
+)
+DB_REQUEST_QUERIES = Histogram(
+    "db_request_queries",
+    "SQL statements executed per HTTP request",
+    ["app_name", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+    registry=registry,
+)
+DB_REPEATED_STATEMENTS = Counter(
+    "db_repeated_statements_total",
+    "Requests that ran one statement fingerprint more times than the N+1 threshold",
+    ["app_name", "route"],
+    registry=registry,
+)
+
+# --- Read Replica Metrics ---
+DB_READ_ROUTING = Counter(
+    "db_read_routing_total",
+    "Read-only requests by the database they were sent to, and why",
+    ["app_name", "target", "reason"],
+    registry=registry,
+)
+DB_REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds",
+    "Replication lag of the read replica at its last status check",
+    ["app_name"],
+    registry=registry,
+)
+
+# --- Catalog COPY Import/Export Metrics ---
+CATALOG_COPY_ROWS = Counter(
+    "product_catalog_copy_rows_total",
+    "Catalog rows moved through COPY, by direction (import, export)",
+    ["app_name", "direction"],
+    registry=registry,
+)
+CATALOG_COPY_ROWS_PER_SECOND = Gauge(
+    "product_catalog_copy_rows_per_second",
+    "Throughput of the most recent catalog import or export",
+    ["app_name", "direction"],
+    registry=registry,
+)
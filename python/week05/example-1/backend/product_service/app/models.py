@@ -1,6 +1,6 @@
 # week05/example-1/backend/product_service/app/models.py
 
-from sqlalchemy import Column, DateTime, Integer, Numeric, String, Text
+from sqlalchemy import JSON, BigInteger, Column, DateTime, Integer, Numeric, String, Text
 from sqlalchemy.sql import func
 
 from .db import Base
@@ -13,10 +13,32 @@ class Product(Base):
     description = Column(Text, nullable=True)
     price = Column(Numeric(10, 2), nullable=False)
     stock_quantity = Column(Integer, nullable=False, default=0)
-    image_url = Column(String(2048), nullable=True)  # URL can be long
+    image_url = Column(String(2048), nullable=True)  # External URL set via the API
+    # Uploaded images are stored by blob name only and signed when serialized
+    image_blob_name = Column(String(255), nullable=True)
+    image_variants = Column(JSON, nullable=True)  # e.g. {"thumb": blob_name, ...}
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
     def __repr__(self):
         # A helpful representation when debugging
         return f"<Product(id={self.product_id}, name='{self.name}', stock={self.stock_quantity}, image_url='{self.image_url[:30] if self.image_url else 'None'}...')>"
+
+
+class ProductImageBlob(Base):
+    """
+    One row per content-addressed image blob (named by the SHA-256 of its bytes).
+    ref_count tracks how many products point at the blob; rows that reach zero
+    are garbage-collected in batches together with their variants.
+    """
+
+    __tablename__ = "product_image_blobs_week05_example_01"
+    blob_name = Column(String(255), primary_key=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    size_bytes = Column(BigInteger, nullable=False)
+    content_type = Column(String(100), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    unreferenced_at = Column(DateTime(timezone=True), nullable=True, index=True)
+
+    def __repr__(self):
+        return f"<ProductImageBlob(name='{self.blob_name}', refs={self.ref_count})>"
@@ -1,8 +1,10 @@
 # week05/example-1/backend/product_service/app/schemas.py
 
 from datetime import datetime
-from typing import Optional
-from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from .storage import image_url_for
 
 
 class ProductBase(BaseModel):
@@ -30,13 +32,89 @@ class ProductUpdate(ProductBase):
 
 class ProductResponse(ProductBase):
     product_id: int
+    image_blob_name: Optional[str] = Field(None, exclude=True)
+    image_variants: Optional[Dict[str, str]] = Field(
+        None,
+        description="URLs of resized WebP variants (thumb, card, full), once generated.",
+    )
     created_at: datetime  # Datetime type for Pydantic to serialize
     updated_at: Optional[datetime] = None  # Datetime type for Pydantic to serialize
 
     model_config = ConfigDict(from_attributes=True)  # Enable ORM mode for Pydantic V2
 
+    @model_validator(mode="after")
+    def sign_image_urls(self):
+        self.image_url, self.image_variants = resolve_image_urls(
+            self.image_url, self.image_blob_name, self.image_variants
+        )
+        return self
+
+
+def resolve_image_urls(
+    image_url: Optional[str],
+    image_blob_name: Optional[str],
+    image_variants: Optional[Dict[str, str]],
+) -> Tuple[Optional[str], Optional[Dict[str, str]]]:
+    """
+    Uploaded images are persisted as blob names; resolve them at serialization
+    time (Azure: signed through the shared (blob, expiry bucket) cache).
+    Returns the image URL and variant URLs to send to clients.
+    """
+    if image_blob_name:
+        image_url = image_url_for(image_blob_name)
+    if image_variants:
+        signed_variants = {
+            variant: image_url_for(blob_name)
+            for variant, blob_name in image_variants.items()
+        }
+        image_variants = signed_variants if all(signed_variants.values()) else None
+    return image_url, image_variants
+
+
+def product_row_to_json(row) -> dict:
+    """
+    Builds the ProductResponse JSON shape from a Core row of product columns,
+    for list endpoints that skip ORM objects and model validation.
+    """
+    image_url, image_variants = resolve_image_urls(
+        row.image_url, row.image_blob_name, row.image_variants
+    )
+    return {
+        "name": row.name,
+        "description": row.description,
+        "price": float(row.price),
+        "stock_quantity": row.stock_quantity,
+        "image_url": image_url,
+        "product_id": row.product_id,
+        "image_variants": image_variants,
+        "created_at": row.created_at,
+        "updated_at": row.updated_at,
+    }
+
 
 class StockDeductRequest(BaseModel):
     quantity_to_deduct: int = Field(
         ..., gt=0, description="Quantity of product to deduct from stock."
     )
+
+
+class BulkImageItemResult(BaseModel):
+    file: str = Field(..., description="Path of the entry inside the archive.")
+    product_id: Optional[int] = None
+    status: str = Field(..., description="succeeded, failed or skipped.")
+    blob_name: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class BulkImageJobResponse(BaseModel):
+    job_id: str
+    status: str = Field(..., description="queued, running, completed or failed.")
+    filename: Optional[str] = None
+    entries_seen: int
+    succeeded: int
+    failed: int
+    skipped: int
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    results: List[BulkImageItemResult]
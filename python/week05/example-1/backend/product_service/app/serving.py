@@ -0,0 +1,104 @@
+# week05/example-1/backend/product_service/app/serving.py
+
+import mimetypes
+import mmap
+import os
+from typing import Optional, Tuple
+
+from fastapi import Request, Response, status
+
+# Blobs are content-addressed, so a URL always refers to the same bytes
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single `bytes=` Range header into an inclusive (start, end) pair.
+    Returns None when the whole file should be sent: no header, a malformed one, or
+    multiple ranges (which servers may ignore). Raises RangeNotSatisfiable when the
+    range lies outside the file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, _, end_text = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            suffix_length = int(end_text)
+            if suffix_length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix_length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Weak comparison against an If-None-Match header, as used for GET requests."""
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or any(
+        candidate.removeprefix("W/") == etag for candidate in candidates
+    )
+
+
+def mmap_file_response(
+    request: Request, path: str, etag: str, media_type: Optional[str] = None
+) -> Response:
+    """
+    Serves a file with ETag, If-None-Match and single-range support.
+
+    The body is a memoryview over a read-only mmap of the file, so the bytes are
+    read from the page cache by the socket write rather than copied into Python
+    objects. The file is opened immediately: once mapped, the response keeps
+    working even if the file is deleted or replaced before it is sent.
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    body = memoryview(mapped) if mapped is not None else memoryview(b"")
+    byte_range = None
+    # If-Range: only honour the range if the client's copy is still current
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_byte_range(request.headers.get("range"), size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(
+                status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+                headers=headers,
+            )
+
+    if byte_range is None:
+        return Response(content=body, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(
+        content=body[start : end + 1],
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,691 @@
+# week05/example-1/backend/product_service/app/storage.py
+
+import asyncio
+import base64
+import functools
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import (
+    BlobBlock,
+    BlobSasPermissions,
+    BlobServiceClient,
+    ContentSettings,
+    generate_blob_sas,
+)
+
+from .metrics import (
+    APP_NAME,
+    IMAGE_DISK_CACHE_BYTES,
+    IMAGE_DISK_CACHE_REQUESTS,
+    IMAGE_UPLOAD_DURATION,
+    IMAGE_UPLOAD_THROUGHPUT,
+    SAS_URL_CACHE_REQUESTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# --- Azure Storage Configuration ---
+AZURE_STORAGE_ACCOUNT_NAME = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
+AZURE_STORAGE_ACCOUNT_KEY = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
+AZURE_STORAGE_CONTAINER_NAME = os.getenv(
+    "AZURE_STORAGE_CONTAINER_NAME", "product-images"
+)
+AZURE_SAS_TOKEN_EXPIRY_HOURS = int(os.getenv("AZURE_SAS_TOKEN_EXPIRY_HOURS", "24"))
+
+# Signed URLs are cached per (blob, time bucket). A URL issued during a bucket stays
+# valid for AZURE_SAS_TOKEN_EXPIRY_HOURS after that bucket ends.
+SAS_URL_CACHE_BUCKET_SECONDS = int(os.getenv("SAS_URL_CACHE_BUCKET_SECONDS", "3600"))
+SAS_URL_CACHE_MAX_ENTRIES = int(os.getenv("SAS_URL_CACHE_MAX_ENTRIES", "10000"))
+
+# --- Storage Backend Configuration ---
+# "azure", "local", or unset to use Azure when credentials are present and local disk otherwise
+IMAGE_STORAGE_BACKEND = os.getenv("IMAGE_STORAGE_BACKEND", "").lower()
+LOCAL_IMAGE_STORAGE_DIR = os.getenv("LOCAL_IMAGE_STORAGE_DIR", "/tmp/product-images")
+# Base URL clients use to reach this service's /images route (local backend only)
+IMAGE_PUBLIC_BASE_URL = os.getenv("IMAGE_PUBLIC_BASE_URL", "http://localhost:8000")
+# On-disk LRU cache that GET /images serves remote (Azure) blobs from
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/product-image-cache")
+IMAGE_CACHE_MAX_BYTES = int(
+    os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+
+# Container checks at startup are bounded and retried in the background with backoff,
+# so a slow or unreachable storage account never delays startup
+STORAGE_INIT_TIMEOUT_SECONDS = float(os.getenv("STORAGE_INIT_TIMEOUT_SECONDS", "5"))
+STORAGE_INIT_RETRY_SECONDS = float(os.getenv("STORAGE_INIT_RETRY_SECONDS", "2"))
+STORAGE_INIT_MAX_RETRY_SECONDS = float(os.getenv("STORAGE_INIT_MAX_RETRY_SECONDS", "60"))
+
+# --- Upload Tuning Configuration ---
+# Size of each staged block and how many blocks may be in flight per upload
+AZURE_UPLOAD_BLOCK_SIZE_BYTES = int(
+    os.getenv("AZURE_UPLOAD_BLOCK_SIZE_BYTES", str(4 * 1024 * 1024))
+)
+AZURE_UPLOAD_MAX_CONCURRENCY = int(os.getenv("AZURE_UPLOAD_MAX_CONCURRENCY", "4"))
+# Upper bound on threads running blocking Azure SDK calls across all requests
+AZURE_UPLOAD_THREAD_POOL_SIZE = int(os.getenv("AZURE_UPLOAD_THREAD_POOL_SIZE", "8"))
+# Chunk size used when hashing uploads, and the Azure Blob Batch subrequest limit
+HASH_CHUNK_SIZE_BYTES = 1024 * 1024
+AZURE_DELETE_BATCH_SIZE = 256
+
+# The sync Azure SDK performs network I/O, so it must never run on the event loop
+upload_executor = ThreadPoolExecutor(
+    max_workers=AZURE_UPLOAD_THREAD_POOL_SIZE, thread_name_prefix="blob-upload"
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking storage call on the bounded upload thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        upload_executor, functools.partial(func, *args, **kwargs)
+    )
+
+
+# Canonical extension per allowed content type, so identical bytes map to one blob
+CONTENT_TYPE_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+}
+
+
+async def hash_upload(file) -> Tuple[str, int]:
+    """
+    Streams an uploaded file through SHA-256 and rewinds it.
+    Returns the hex digest and the size in bytes.
+    """
+    digest = hashlib.sha256()
+    size_bytes = 0
+    while True:
+        chunk = await file.read(HASH_CHUNK_SIZE_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size_bytes += len(chunk)
+    await file.seek(0)
+    return digest.hexdigest(), size_bytes
+
+
+# Blob names are used as file names by the local backend and the disk cache
+_BLOB_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,254}$")
+
+
+def is_valid_blob_name(blob_name: str) -> bool:
+    return bool(_BLOB_NAME_PATTERN.match(blob_name))
+
+
+def content_addressed_blob_name(digest: str, content_type: str) -> str:
+    return f"{digest}{CONTENT_TYPE_EXTENSIONS.get(content_type, '.jpg')}"
+
+
+def blob_name_from_url(url: Optional[str]) -> Optional[str]:
+    """Extracts the blob name from a (possibly SAS-signed) blob URL."""
+    if not url:
+        return None
+    return urlparse(url).path.rsplit("/", 1)[-1] or None
+
+
+def blob_url(blob_name: str) -> str:
+    return (
+        f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net/"
+        f"{AZURE_STORAGE_CONTAINER_NAME}/{quote(blob_name)}"
+    )
+
+
+def sign_blob_url(blob_name: str, expiry: datetime) -> str:
+    """Returns the blob URL with a read-only SAS token that expires at `expiry`."""
+    sas_token = generate_blob_sas(
+        account_name=AZURE_STORAGE_ACCOUNT_NAME,
+        account_key=AZURE_STORAGE_ACCOUNT_KEY,
+        container_name=AZURE_STORAGE_CONTAINER_NAME,
+        blob_name=blob_name,
+        permission=BlobSasPermissions(read=True),
+        expiry=expiry,
+    )
+    return f"{blob_url(blob_name)}?{sas_token}"
+
+
+class SignedUrlCache:
+    """
+    Bounded LRU cache of signed URLs keyed by (blob_name, expiry bucket).
+
+    All requests within one bucket share a single signature per blob, so list pages
+    don't compute an HMAC per row, and clients see stable, cacheable URLs.
+    """
+
+    def __init__(
+        self,
+        sign: Callable[[str, datetime], str],
+        bucket_seconds: int,
+        validity_seconds: int,
+        max_entries: int,
+    ):
+        self._sign = sign
+        self._bucket_seconds = bucket_seconds
+        self._validity_seconds = validity_seconds
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_name: str, now: Optional[float] = None) -> str:
+        bucket = int((time.time() if now is None else now) // self._bucket_seconds)
+        key = (blob_name, bucket)
+        with self._lock:
+            url = self._entries.get(key)
+            if url is not None:
+                self._entries.move_to_end(key)
+                SAS_URL_CACHE_REQUESTS.labels(app_name=APP_NAME, result="hit").inc()
+                return url
+
+        SAS_URL_CACHE_REQUESTS.labels(app_name=APP_NAME, result="miss").inc()
+        expiry = datetime.fromtimestamp(
+            (bucket + 1) * self._bucket_seconds + self._validity_seconds,
+            tz=timezone.utc,
+        )
+        url = self._sign(blob_name, expiry)
+        with self._lock:
+            self._entries[key] = url
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)  # Also ages out past buckets
+        return url
+
+
+signed_url_cache = SignedUrlCache(
+    sign_blob_url,
+    bucket_seconds=SAS_URL_CACHE_BUCKET_SECONDS,
+    validity_seconds=AZURE_SAS_TOKEN_EXPIRY_HOURS * 3600,
+    max_entries=SAS_URL_CACHE_MAX_ENTRIES,
+)
+
+
+async def delete_blobs_in_batches(container_client, blob_names: List[str]):
+    """Deletes blobs using the Blob Batch API, ignoring blobs that don't exist."""
+    for start in range(0, len(blob_names), AZURE_DELETE_BATCH_SIZE):
+        batch = blob_names[start : start + AZURE_DELETE_BATCH_SIZE]
+        await run_blocking(
+            container_client.delete_blobs, *batch, raise_on_any_failure=False
+        )
+
+
+def _observe_upload(outcome: str, total_bytes: int, elapsed: float):
+    IMAGE_UPLOAD_DURATION.labels(app_name=APP_NAME, status=outcome).observe(elapsed)
+    if outcome == "success" and elapsed > 0:
+        IMAGE_UPLOAD_THROUGHPUT.labels(app_name=APP_NAME).observe(
+            total_bytes / elapsed
+        )
+
+
+async def _stage_block(blob_client, block_id: str, data: bytes, slots: asyncio.Semaphore):
+    try:
+        await run_blocking(blob_client.stage_block, block_id=block_id, data=data)
+    finally:
+        slots.release()
+
+
+async def upload_blob_in_blocks(blob_client, file, content_type: str) -> int:
+    """
+    Streams an uploaded file to Azure as staged blocks and commits the block list.
+
+    Blocks are read from `file` (a FastAPI UploadFile) one at a time and staged
+    concurrently, with at most AZURE_UPLOAD_MAX_CONCURRENCY blocks held in memory.
+    The blob only becomes visible once `commit_block_list` succeeds.
+    Returns the number of bytes uploaded.
+    """
+    upload_id = uuid.uuid4().hex
+    slots = asyncio.Semaphore(AZURE_UPLOAD_MAX_CONCURRENCY)
+    block_ids = []
+    tasks = []
+    total_bytes = 0
+    outcome = "failure"
+    start_time = time.perf_counter()
+
+    try:
+        while True:
+            await slots.acquire()
+            chunk = await file.read(AZURE_UPLOAD_BLOCK_SIZE_BYTES)
+            if not chunk:
+                slots.release()
+                break
+
+            # Fail fast instead of reading the rest of the file after a block error
+            for task in tasks:
+                if task.done() and task.exception():
+                    slots.release()
+                    raise task.exception()
+
+            # Block IDs must be base64 strings of equal length within a blob
+            block_id = base64.b64encode(
+                f"{upload_id}-{len(block_ids):06d}".encode("utf-8")
+            ).decode("utf-8")
+            block_ids.append(block_id)
+            total_bytes += len(chunk)
+            tasks.append(
+                asyncio.create_task(_stage_block(blob_client, block_id, chunk, slots))
+            )
+
+        await asyncio.gather(*tasks)
+        await run_blocking(
+            blob_client.commit_block_list,
+            [BlobBlock(block_id=block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_type=content_type),
+        )
+        outcome = "success"
+    finally:
+        for task in tasks:
+            task.cancel()
+        elapsed = time.perf_counter() - start_time
+        _observe_upload(outcome, total_bytes, elapsed)
+
+    logger.info(
+        f"Product Service: Committed {len(block_ids)} blocks ({total_bytes} bytes) in {elapsed:.3f}s."
+    )
+    return total_bytes
+
+
+# --- Storage Backends ---
+class BlobStorage(ABC):
+    """Where product image blobs live. Blocking methods must be called via run_blocking."""
+
+    name = "base"
+    # "initializing", "available" or "unavailable"; set by initialize_image_storage
+    status = "initializing"
+    last_error: Optional[str] = None
+
+    def ensure_ready(self):
+        """Verifies (or creates) the backing container. Blocking; raises if unavailable."""
+
+    @abstractmethod
+    async def upload_file(self, blob_name: str, file, content_type: str) -> int:
+        """Stores an UploadFile under `blob_name`. Returns the number of bytes stored."""
+
+    @abstractmethod
+    def put_bytes(self, blob_name: str, data: bytes, content_type: str):
+        """Stores (or overwrites) a small blob held in memory."""
+
+    @abstractmethod
+    def read_bytes(self, blob_name: str) -> bytes:
+        """Returns a blob's content. Raises FileNotFoundError if it doesn't exist."""
+
+    @abstractmethod
+    def exists(self, blob_name: str) -> bool: ...
+
+    @abstractmethod
+    async def delete_many(self, blob_names: List[str]):
+        """Deletes blobs, ignoring ones that don't exist."""
+
+    @abstractmethod
+    def url_for(self, blob_name: str) -> str:
+        """Returns the URL clients fetch the blob from."""
+
+    def local_path(self, blob_name: str) -> Optional[str]:
+        """Returns a file path the blob can be served from directly, if there is one."""
+        return None
+
+    def download_to_file(self, blob_name: str, path: str) -> bool:
+        """Writes a blob to `path`. Returns False if the blob doesn't exist."""
+        try:
+            data = self.read_bytes(blob_name)
+        except FileNotFoundError:
+            return False
+        with open(path, "wb") as f:
+            f.write(data)
+        return True
+
+
+class AzureBlobStorage(BlobStorage):
+    """Blobs in an Azure Storage container, served to clients through signed URLs."""
+
+    name = "azure"
+
+    def __init__(
+        self, service_client, container_name: str = AZURE_STORAGE_CONTAINER_NAME
+    ):
+        self.service_client = service_client
+        self.container_name = container_name
+
+    def ensure_ready(self):
+        try:
+            self.service_client.get_container_client(
+                self.container_name
+            ).create_container()
+            logger.info(
+                f"Product Service: Azure container '{self.container_name}' created."
+            )
+        except ResourceExistsError:
+            pass
+
+    def _blob_client(self, blob_name: str):
+        return self.service_client.get_blob_client(
+            container=self.container_name, blob=blob_name
+        )
+
+    async def upload_file(self, blob_name: str, file, content_type: str) -> int:
+        return await upload_blob_in_blocks(
+            self._blob_client(blob_name), file, content_type
+        )
+
+    def put_bytes(self, blob_name: str, data: bytes, content_type: str):
+        self._blob_client(blob_name).upload_blob(
+            data,
+            overwrite=True,
+            content_settings=ContentSettings(content_type=content_type),
+        )
+
+    def read_bytes(self, blob_name: str) -> bytes:
+        try:
+            return self._blob_client(blob_name).download_blob().readall()
+        except ResourceNotFoundError as e:
+            raise FileNotFoundError(blob_name) from e
+
+    def download_to_file(self, blob_name: str, path: str) -> bool:
+        # Streams to disk so large originals are never held in memory
+        try:
+            downloader = self._blob_client(blob_name).download_blob()
+            with open(path, "wb") as f:
+                downloader.readinto(f)
+        except ResourceNotFoundError:
+            return False
+        return True
+
+    def exists(self, blob_name: str) -> bool:
+        return self._blob_client(blob_name).exists()
+
+    async def delete_many(self, blob_names: List[str]):
+        container_client = self.service_client.get_container_client(
+            self.container_name
+        )
+        await delete_blobs_in_batches(container_client, blob_names)
+
+    def url_for(self, blob_name: str) -> str:
+        return signed_url_cache.get(blob_name)
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Blobs stored as files in a local directory, served by this service's /images route.
+    Writes go to a temporary file first and are renamed into place, so readers never
+    see a partially written blob.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, public_base_url: str = IMAGE_PUBLIC_BASE_URL):
+        self.root = root
+        self.public_base_url = public_base_url.rstrip("/")
+        self._incoming = os.path.join(root, ".incoming")
+        os.makedirs(self._incoming, exist_ok=True)
+
+    def ensure_ready(self):
+        os.makedirs(self._incoming, exist_ok=True)
+        if not os.access(self.root, os.W_OK):
+            raise PermissionError(f"Image directory '{self.root}' is not writable")
+
+    def local_path(self, blob_name: str) -> str:
+        return os.path.join(self.root, blob_name)
+
+    def _temp_path(self) -> str:
+        return os.path.join(self._incoming, uuid.uuid4().hex)
+
+    async def upload_file(self, blob_name: str, file, content_type: str) -> int:
+        temp_path = self._temp_path()
+        total_bytes = 0
+        outcome = "failure"
+        start_time = time.perf_counter()
+        try:
+            # Every file operation runs on the upload pool, as the Azure calls do
+            out = await run_blocking(open, temp_path, "wb")
+            try:
+                while True:
+                    chunk = await file.read(AZURE_UPLOAD_BLOCK_SIZE_BYTES)
+                    if not chunk:
+                        break
+                    await run_blocking(out.write, chunk)
+                    total_bytes += len(chunk)
+            finally:
+                await run_blocking(out.close)
+            await run_blocking(os.replace, temp_path, self.local_path(blob_name))
+            outcome = "success"
+        finally:
+            if outcome != "success":
+                await run_blocking(self._discard, temp_path)
+            _observe_upload(outcome, total_bytes, time.perf_counter() - start_time)
+        return total_bytes
+
+    @staticmethod
+    def _discard(temp_path: str):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def put_bytes(self, blob_name: str, data: bytes, content_type: str):
+        temp_path = self._temp_path()
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self.local_path(blob_name))
+
+    def read_bytes(self, blob_name: str) -> bytes:
+        with open(self.local_path(blob_name), "rb") as f:
+            return f.read()
+
+    def download_to_file(self, blob_name: str, path: str) -> bool:
+        try:
+            shutil.copyfile(self.local_path(blob_name), path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def exists(self, blob_name: str) -> bool:
+        return os.path.isfile(self.local_path(blob_name))
+
+    def _remove(self, blob_names: List[str]):
+        for blob_name in blob_names:
+            try:
+                os.remove(self.local_path(blob_name))
+            except FileNotFoundError:
+                pass
+
+    async def delete_many(self, blob_names: List[str]):
+        await run_blocking(self._remove, blob_names)
+
+    def url_for(self, blob_name: str) -> str:
+        return f"{self.public_base_url}/images/{quote(blob_name)}"
+
+
+class DiskBlobCache:
+    """
+    Bounded on-disk LRU cache of remote blobs, so GET /images can serve them from
+    local files. Concurrent misses for one blob share a single download, and the
+    least recently used files are deleted once the cache exceeds `max_bytes`.
+    Bookkeeping only happens on the event loop, so it needs no lock.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._incoming = os.path.join(root, ".incoming")
+        os.makedirs(self._incoming, exist_ok=True)
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # LRU first
+        self._total_bytes = 0
+        self._downloads: Dict[str, asyncio.Future] = {}
+
+        # Files left by a previous run are reused, oldest access first
+        with os.scandir(root) as entries:
+            existing = sorted(
+                (entry.stat().st_atime, entry.name, entry.stat().st_size)
+                for entry in entries
+                if entry.is_file()
+            )
+        for _, blob_name, size_bytes in existing:
+            self._entries[blob_name] = size_bytes
+            self._total_bytes += size_bytes
+        self._evict()
+
+    def _path(self, blob_name: str) -> str:
+        return os.path.join(self.root, blob_name)
+
+    def _evict(self):
+        # The newest entry is kept even if it alone exceeds the budget
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            blob_name, size_bytes = self._entries.popitem(last=False)
+            self._total_bytes -= size_bytes
+            try:
+                os.remove(self._path(blob_name))
+            except FileNotFoundError:
+                pass
+        IMAGE_DISK_CACHE_BYTES.labels(app_name=APP_NAME).set(self._total_bytes)
+
+    async def get_path(self, storage: BlobStorage, blob_name: str) -> Optional[str]:
+        """
+        Returns the path of a cached copy of the blob, downloading it on a miss, or
+        None if the blob doesn't exist. The file stays in place until the next
+        await, so callers should open it before yielding to the event loop.
+        """
+        if blob_name in self._entries:
+            self._entries.move_to_end(blob_name)
+            IMAGE_DISK_CACHE_REQUESTS.labels(app_name=APP_NAME, result="hit").inc()
+            return self._path(blob_name)
+
+        IMAGE_DISK_CACHE_REQUESTS.labels(app_name=APP_NAME, result="miss").inc()
+        download = self._downloads.get(blob_name)
+        if download is None:
+            download = asyncio.ensure_future(self._download(storage, blob_name))
+            self._downloads[blob_name] = download
+            download.add_done_callback(
+                lambda _: self._downloads.pop(blob_name, None)
+            )
+        # A cancelled request doesn't cancel a download other requests are waiting on
+        return await asyncio.shield(download)
+
+    async def _download(self, storage: BlobStorage, blob_name: str) -> Optional[str]:
+        temp_path = os.path.join(self._incoming, uuid.uuid4().hex)
+        try:
+            found = await run_blocking(storage.download_to_file, blob_name, temp_path)
+            if not found:
+                return None
+            size_bytes = os.path.getsize(temp_path)
+            os.replace(temp_path, self._path(blob_name))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self._entries[blob_name] = size_bytes
+        self._total_bytes += size_bytes
+        self._evict()
+        return self._path(blob_name) if blob_name in self._entries else None
+
+
+def create_image_storage() -> Optional[BlobStorage]:
+    """
+    Builds the storage backend selected by IMAGE_STORAGE_BACKEND. No network calls
+    are made here; initialize_image_storage verifies the backend in the background.
+    """
+    backend = IMAGE_STORAGE_BACKEND or (
+        "azure" if AZURE_STORAGE_ACCOUNT_NAME and AZURE_STORAGE_ACCOUNT_KEY else "local"
+    )
+
+    if backend == "local":
+        logger.info(
+            f"Product Service: Storing images on local disk at '{LOCAL_IMAGE_STORAGE_DIR}'."
+        )
+        return LocalBlobStorage(LOCAL_IMAGE_STORAGE_DIR)
+
+    if not (AZURE_STORAGE_ACCOUNT_NAME and AZURE_STORAGE_ACCOUNT_KEY):
+        logger.warning(
+            "Product Service: Azure Storage credentials not found. Image upload functionality will be disabled."
+        )
+        return None
+
+    try:
+        blob_service_client = BlobServiceClient(
+            account_url=f"https://{AZURE_STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
+            credential=AZURE_STORAGE_ACCOUNT_KEY,
+        )
+        logger.info("Product Service: Azure BlobServiceClient initialized.")
+    except Exception as e:
+        logger.critical(
+            f"Product Service: Failed to initialize Azure BlobServiceClient. Check credentials and account name. Error: {e}",
+            exc_info=True,
+        )
+        return None
+    return AzureBlobStorage(blob_service_client)
+
+
+# Both are created on first use rather than at import time
+_NOT_CREATED = object()
+image_storage = _NOT_CREATED
+image_cache: Optional[DiskBlobCache] = None
+
+
+def get_image_storage() -> Optional[BlobStorage]:
+    global image_storage
+    if image_storage is _NOT_CREATED:
+        image_storage = create_image_storage()
+    return image_storage
+
+
+def get_image_cache() -> DiskBlobCache:
+    global image_cache
+    if image_cache is None:
+        image_cache = DiskBlobCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES)
+    return image_cache
+
+
+async def initialize_image_storage(
+    timeout_seconds: float = STORAGE_INIT_TIMEOUT_SECONDS,
+    retry_seconds: float = STORAGE_INIT_RETRY_SECONDS,
+):
+    """
+    Startup task that verifies the storage backend, retrying with exponential
+    backoff until it succeeds. Its progress is reported by the readiness endpoint.
+    """
+    storage = get_image_storage()
+    if storage is None:
+        return
+
+    attempt = 0
+    delay = retry_seconds
+    while True:
+        attempt += 1
+        try:
+            # A timed-out call keeps its pool thread until the SDK's own timeout fires
+            await asyncio.wait_for(run_blocking(storage.ensure_ready), timeout_seconds)
+            storage.status = "available"
+            storage.last_error = None
+            logger.info(
+                f"Product Service: {storage.name} image storage is available (attempt {attempt})."
+            )
+            return
+        except asyncio.TimeoutError:
+            storage.last_error = f"Timed out after {timeout_seconds}s"
+        except Exception as e:
+            storage.last_error = str(e)
+        storage.status = "unavailable"
+        logger.warning(
+            f"Product Service: {storage.name} image storage is not available (attempt {attempt}): {storage.last_error}. Retrying in {delay:.0f}s."
+        )
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STORAGE_INIT_MAX_RETRY_SECONDS)
+
+
+def image_url_for(blob_name: str) -> Optional[str]:
+    """Returns the URL clients should load a blob from, or None if storage isn't available."""
+    storage = get_image_storage()
+    if storage is None:
+        return None
+    return storage.url_for(blob_name)
@@ -0,0 +1,112 @@
+# week05/example-1/backend/product_service/benchmarks/list_page.py
+
+"""
+Allocation and latency benchmark for one page of GET /products/.
+
+Compares the previous ORM path (Product instances validated into ProductResponse
+and encoded by FastAPI) with the Core fast path (plain rows serialized straight
+to JSON bytes). Runs against the configured database, seeding products if fewer
+than --limit exist. From the product_service directory:
+
+    python -m benchmarks.list_page --limit 100 --pages 200
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+from typing import List
+
+import pydantic_core
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+from sqlalchemy import func, insert, select
+
+from app.db import Base, SessionLocal, engine
+from app.main import PRODUCT_LIST_COLUMNS
+from app.models import Product
+from app.schemas import ProductResponse, product_row_to_json
+
+product_list_adapter = TypeAdapter(List[ProductResponse])
+
+
+async def orm_page(limit: int) -> bytes:
+    async with SessionLocal() as db:
+        products = (await db.execute(select(Product).limit(limit))).scalars().all()
+        # What FastAPI and Starlette's JSONResponse do with response_model=List[ProductResponse]
+        validated = product_list_adapter.validate_python(products, from_attributes=True)
+        return json.dumps(
+            jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+async def core_page(limit: int) -> bytes:
+    async with SessionLocal() as db:
+        result = await db.execute(select(*PRODUCT_LIST_COLUMNS).limit(limit))
+        return pydantic_core.to_json([product_row_to_json(row) for row in result])
+
+
+async def seed_products(count: int):
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        existing = (await connection.execute(select(func.count(Product.product_id)))).scalar_one()
+        if existing < count:
+            await connection.execute(
+                insert(Product),
+                [
+                    {
+                        "name": f"Benchmark Product {i}",
+                        "description": "Seeded by the list page benchmark " * 4,
+                        "price": 9.99,
+                        "stock_quantity": 100,
+                        "image_url": f"http://example.com/{i}.png",
+                    }
+                    for i in range(count - existing)
+                ],
+            )
+
+
+async def measure(name: str, render_page, limit: int, pages: int):
+    # Warm up connections and statement caches
+    for _ in range(10):
+        body = await render_page(limit)
+
+    latencies = []
+    for _ in range(pages):
+        started = time.perf_counter()
+        await render_page(limit)
+        latencies.append(time.perf_counter() - started)
+
+    # Allocations are measured separately: tracemalloc slows every allocation down
+    tracemalloc.start()
+    peaks = []
+    for _ in range(min(pages, 50)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await render_page(limit)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    latencies.sort()
+    print(
+        f"{name:<8}{len(body):>10}{statistics.median(latencies) * 1000:>10.2f}"
+        f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>10.2f}"
+        f"{statistics.median(peaks) / 1024:>12.1f}"
+    )
+
+
+async def main(args):
+    await seed_products(args.limit)
+    print(f"{'path':<8}{'bytes':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+    await measure("orm", orm_page, args.limit, args.pages)
+    await measure("core", core_page, args.limit, args.pages)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
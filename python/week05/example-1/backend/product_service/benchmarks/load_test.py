@@ -0,0 +1,141 @@
+# week05/example-1/backend/product_service/benchmarks/load_test.py
+
+"""
+Concurrent load test for the Product Service.
+
+Seeds a set of products, then drives each scenario with a fixed number of
+concurrent clients and reports requests per second and latency percentiles.
+Run it against the service before and after a change to compare, e.g.:
+
+    python benchmarks/load_test.py --base-url http://localhost:8000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+
+async def seed_products(client: httpx.AsyncClient, count: int) -> list:
+    product_ids = []
+    for i in range(count):
+        response = await client.post(
+            "/products/",
+            json={
+                "name": f"Benchmark Product {time.time_ns()}-{i}",
+                "description": "Seeded by the load test",
+                "price": 9.99,
+                "stock_quantity": 1_000_000,
+            },
+        )
+        response.raise_for_status()
+        product_ids.append(response.json()["product_id"])
+    return product_ids
+
+
+def scenarios(product_ids: list) -> dict:
+    def get_product(client):
+        return client.get(f"/products/{random.choice(product_ids)}")
+
+    def list_products(client):
+        return client.get("/products/", params={"limit": 50})
+
+    def update_product(client):
+        return client.put(
+            f"/products/{random.choice(product_ids)}",
+            json={"description": f"Updated at {time.time_ns()}"},
+        )
+
+    def create_product(client):
+        return client.post(
+            "/products/",
+            json={
+                "name": f"Benchmark Create {time.time_ns()}-{random.random()}",
+                "price": 1.0,
+                "stock_quantity": 1,
+            },
+        )
+
+    return {
+        "get_product": get_product,
+        "list_products": list_products,
+        "update_product": update_product,
+        "create_product": create_product,
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, make_request, concurrency: int, total_requests: int
+) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total_requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await make_request(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=60
+    ) as client:
+        product_ids = await seed_products(client, args.seed_products)
+        selected = scenarios(product_ids)
+        if args.scenario:
+            selected = {name: selected[name] for name in args.scenario}
+
+        print(
+            f"{'scenario':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+        )
+        for name, make_request in selected.items():
+            await run_scenario(client, make_request, args.concurrency, args.warmup)
+            result = await run_scenario(
+                client, make_request, args.concurrency, args.requests
+            )
+            print(
+                f"{name:<16}{result['requests']:>10}{result['errors']:>8}"
+                f"{result['rps']:>10.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--seed-products", type=int, default=200)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=["get_product", "list_products", "update_product", "create_product"],
+        help="Run only this scenario (repeatable). Defaults to all.",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -1,20 +1,41 @@
 # week05/example-1/backend/product_service/tests/test_main.py
 
 
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
 import logging
 import os
 import time
-from unittest.mock import MagicMock, patch
+import zipfile
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
-from app.db import SessionLocal, engine, get_db
-from app.main import app
-from app.models import Base, Product
+from app.db import DATABASE_URL
+from app.images import ImageVariantPipeline, render_variants, variant_blob_name
+from app.main import app, consume_order_placed_events
+from app.storage import (
+    AzureBlobStorage,
+    DiskBlobCache,
+    LocalBlobStorage,
+    SignedUrlCache,
+    initialize_image_storage,
+)
+from app.models import Base, Product, ProductImageBlob
 
 from fastapi.testclient import TestClient
+from PIL import Image
+from sqlalchemy import create_engine, make_url, text
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
 
+# The app talks to PostgreSQL through asyncpg on the TestClient's event loop; tests
+# set up the schema and verify results through a separate synchronous engine
+engine = create_engine(make_url(DATABASE_URL).set(drivername="postgresql+psycopg2"))
+
 # Suppress noisy logs from SQLAlchemy/FastAPI during tests for cleaner output
 logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
 logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
@@ -65,22 +86,18 @@ def setup_database_for_tests():
 
 @pytest.fixture(scope="function")
 def db_session_for_test():
-    connection = engine.connect()
-    transaction = connection.begin()
-    db = SessionLocal(bind=connection)
-
-    def override_get_db():
-        yield db
-
-    app.dependency_overrides[get_db] = override_get_db
-
+    """
+    Provides a synchronous session for verifying what the app committed. The app
+    commits through its own engine, so tables are emptied after each test.
+    """
+    db = Session(bind=engine, expire_on_commit=False)
     try:
         yield db
     finally:
-        transaction.rollback()
         db.close()
-        connection.close()
-        app.dependency_overrides.pop(get_db, None)
+        table_names = ", ".join(table.name for table in Base.metadata.sorted_tables)
+        with engine.begin() as connection:
+            connection.execute(text(f"TRUNCATE {table_names} RESTART IDENTITY CASCADE"))
 
 
 @pytest.fixture(scope="module")
@@ -94,7 +111,8 @@ def client():
     os.environ["AZURE_STORAGE_CONTAINER_NAME"] = "test-images"
     os.environ["AZURE_SAS_TOKEN_EXPIRY_HOURS"] = "1"
 
-    with TestClient(app) as test_client:
+    # Tests count statements through the X-DB-Query-Count header, off by default
+    with patch("app.main.DB_QUERY_COUNT_HEADER", True), TestClient(app) as test_client:
         yield test_client
 
     # Clean up environment variables after tests
@@ -106,7 +124,7 @@ def client():
 
 @pytest.fixture(scope="function", autouse=True)
 def mock_azure_blob_storage():
-    with patch("app.main.BlobServiceClient") as mock_blob_service_client:
+    with patch("app.storage.BlobServiceClient") as mock_blob_service_client:
         mock_instance = MagicMock()
         mock_blob_service_client.return_value = mock_instance
 
@@ -129,8 +147,10 @@ def mock_azure_blob_storage():
             "https://testaccount.blob.core.windows.net/test-images/mock_blob.jpg"
         )
 
-        # Mock generate_blob_sas
-        with patch("app.main.generate_blob_sas") as mock_generate_blob_sas:
+        # Mock generate_blob_sas (URLs are signed at read time from the storage module)
+        with patch("app.storage.generate_blob_sas") as mock_generate_blob_sas, patch(
+            "app.storage.AZURE_STORAGE_ACCOUNT_NAME", "testaccount"
+        ), patch("app.storage.AZURE_STORAGE_ACCOUNT_KEY", "testkey"):
             mock_generate_blob_sas.return_value = "sv=2021-08-01&st=2024-01-01T00%3A00%3A00Z&se=2024-01-01T01%3A00%3A00Z&sr=b&sp=r&sig=mock_sas_token"
             yield mock_blob_service_client  # Yield the mock object for potential assertions
 
@@ -218,7 +238,7 @@ def test_list_products_with_data(client: TestClient, db_session_for_test: Sessio
     Tests listing products when products exist, verifying the list structure.
     A product is created via API to ensure it's present.
     """
-    # Create a product via API within the test's transaction
+    # Create a product via API
     product_data = {
         "name": "List Product Example",
         "description": "For list test",
@@ -235,6 +255,35 @@ def test_list_products_with_data(client: TestClient, db_session_for_test: Sessio
     assert any(p["name"] == "List Product Example" for p in response.json())
 
 
+def test_list_products_fast_path_matches_single_product_response(
+    client: TestClient, db_session_for_test: Session, tmp_path
+):
+    """
+    Tests that the Core-row list path renders products exactly like the ORM path,
+    including signed image URLs and variants.
+    """
+    product = Product(
+        name="Fast Path Product",
+        price=12.5,
+        stock_quantity=3,
+        image_blob_name="a" * 64 + ".png",
+        image_variants={"thumb": "a" * 64 + "-thumb.webp"},
+    )
+    db_session_for_test.add(product)
+    db_session_for_test.commit()
+
+    with patch(
+        "app.storage.image_storage",
+        LocalBlobStorage(str(tmp_path), "http://testserver"),
+    ):
+        listed = client.get("/products/", params={"search": "Fast Path"})
+        single = client.get(f"/products/{product.product_id}")
+
+    assert listed.headers["content-type"] == "application/json"
+    assert listed.json() == [single.json()]
+    assert single.json()["image_variants"]["thumb"].startswith("http://testserver/images/")
+
+
 def test_get_product_success(client: TestClient, db_session_for_test: Session):
     """
     Tests successful retrieval of a product by ID.
@@ -255,6 +304,8 @@ def test_get_product_success(client: TestClient, db_session_for_test: Session):
     assert response.status_code == 200
     assert response.json()["product_id"] == product_id
     assert response.json()["name"] == "Get Product Test"
+    # A single primary-key lookup, counted through the async engine
+    assert response.headers["X-DB-Query-Count"] == "1"
 
 
 def test_update_product_partial(client: TestClient, db_session_for_test: Session):
@@ -321,3 +372,678 @@ def test_delete_product_success(client: TestClient, db_session_for_test: Session
         .first()
     )
     assert deleted_product_in_db is None
+
+
+def test_upload_product_image_stages_blocks(
+    client: TestClient, db_session_for_test: Session
+):
+    """
+    Tests that an image upload is sent as staged blocks and committed as a block
+    list before the product's image_url is updated.
+    """
+    create_resp = client.post(
+        "/products/",
+        json={
+            "name": "Product With Image",
+            "description": "Image upload test",
+            "price": 20.0,
+            "stock_quantity": 5,
+        },
+    )
+    product_id = create_resp.json()["product_id"]
+
+    mock_blob_client = MagicMock()
+    mock_blob_client.url = (
+        "https://testaccount.blob.core.windows.net/test-images/mock_blob.png"
+    )
+    mock_service_client = MagicMock()
+    mock_service_client.get_blob_client.return_value = mock_blob_client
+
+    payload = b"0123456789"
+    with patch("app.storage.image_storage", AzureBlobStorage(mock_service_client)), patch(
+        "app.storage.AZURE_UPLOAD_BLOCK_SIZE_BYTES", 4
+    ):
+        response = client.post(
+            f"/products/{product_id}/upload-image",
+            files={"file": ("photo.png", payload, "image/png")},
+        )
+
+    assert response.status_code == 200
+    assert response.json()["image_url"].startswith(
+        "https://testaccount.blob.core.windows.net/product-images/"
+    )
+
+    # 10 bytes in 4-byte blocks -> 3 staged blocks, committed in file order
+    assert mock_blob_client.stage_block.call_count == 3
+    staged = {
+        call.kwargs["block_id"]: call.kwargs["data"]
+        for call in mock_blob_client.stage_block.call_args_list
+    }
+    committed = mock_blob_client.commit_block_list.call_args.args[0]
+    assert b"".join(staged[block.id] for block in committed) == payload
+    mock_blob_client.upload_blob.assert_not_called()
+    # Variants are generated in the background; the upload response doesn't wait
+    assert response.json()["image_variants"] is None
+
+
+def test_metrics_endpoint_exposes_upload_histograms(client: TestClient):
+    """
+    Tests that the Prometheus endpoint exports the image upload histograms.
+    """
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "product_image_upload_duration_seconds" in response.text
+
+
+def test_metrics_endpoint_exposes_api_pool_usage(client: TestClient):
+    """
+    Tests that requests check connections out of the instrumented "api" pool and return them.
+    """
+    client.get("/products/")
+    response = client.get("/metrics")
+    assert (
+        'db_pool_checked_out_connections{app_name="product_service",pool="api"} 0.0'
+        in response.text
+    )
+    assert (
+        'db_pool_checkout_wait_seconds_count{app_name="product_service",pool="api"}'
+        in response.text
+    )
+
+
+def test_render_variants_produces_resized_webp():
+    """
+    Tests that every configured variant is rendered as WebP within its bounding box.
+    """
+    buffer = io.BytesIO()
+    Image.new("RGB", (2000, 1000), color="red").save(buffer, format="PNG")
+
+    variants = render_variants(buffer.getvalue())
+
+    assert set(variants) == {"thumb", "card", "full"}
+    with Image.open(io.BytesIO(variants["thumb"])) as thumb:
+        assert thumb.format == "WEBP"
+        assert thumb.size == (150, 75)
+    with Image.open(io.BytesIO(variants["full"])) as full:
+        assert full.size == (1600, 800)
+    assert variant_blob_name("20240101.png", "card") == "20240101_card.webp"
+
+
+def test_variant_pipeline_deduplicates_pending_jobs():
+    """
+    Tests that a job already queued is not queued again, and runs exactly once.
+    """
+    process_job = AsyncMock()
+
+    async def run_pipeline():
+        pipeline = ImageVariantPipeline(process_job, workers=1)
+        pipeline.start()
+        try:
+            assert pipeline.enqueue(1, "image.png") is True
+            assert pipeline.enqueue(1, "image.png") is False
+            await pipeline._queue.join()
+        finally:
+            await pipeline.stop()
+
+    asyncio.run(run_pipeline())
+    process_job.assert_awaited_once_with(1, "image.png")
+
+
+def _mock_storage_client():
+    """Returns a mock BlobServiceClient whose blob clients are cached per blob name."""
+    blob_clients = {}
+
+    def get_blob_client(container, blob):
+        if blob not in blob_clients:
+            blob_clients[blob] = MagicMock()
+            blob_clients[blob].url = (
+                f"https://testaccount.blob.core.windows.net/{container}/{blob}"
+            )
+        return blob_clients[blob]
+
+    mock_service_client = MagicMock()
+    mock_service_client.get_blob_client.side_effect = get_blob_client
+    return mock_service_client, blob_clients
+
+
+def test_upload_identical_images_are_deduplicated(
+    client: TestClient, db_session_for_test: Session
+):
+    """
+    Tests that re-uploading the same bytes for another product skips the upload,
+    points both products at one content-addressed blob, and counts references.
+    """
+    product_ids = [
+        client.post(
+            "/products/",
+            json={"name": f"Shared Image {i}", "price": 3.0, "stock_quantity": 1},
+        ).json()["product_id"]
+        for i in range(2)
+    ]
+    mock_service_client, blob_clients = _mock_storage_client()
+    payload = b"identical image bytes"
+    blob_name = hashlib.sha256(payload).hexdigest() + ".png"
+
+    with patch("app.storage.image_storage", AzureBlobStorage(mock_service_client)):
+        for product_id in product_ids:
+            response = client.post(
+                f"/products/{product_id}/upload-image",
+                files={"file": ("same.png", payload, "image/png")},
+            )
+            assert response.status_code == 200
+            assert response.json()["image_url"].startswith(
+                blob_clients[blob_name].url + "?"
+            )
+
+        # The second upload of the same bytes was skipped
+        assert blob_clients[blob_name].commit_block_list.call_count == 1
+
+        image_blob = db_session_for_test.get(ProductImageBlob, blob_name)
+        assert image_blob.ref_count == 2
+
+        # Deleting a product releases its reference
+        assert client.delete(f"/products/{product_ids[0]}").status_code == 204
+        db_session_for_test.refresh(image_blob)
+        assert image_blob.ref_count == 1
+        assert image_blob.unreferenced_at is None
+
+
+def test_garbage_collect_unreferenced_images(
+    client: TestClient, db_session_for_test: Session
+):
+    """
+    Tests that unreferenced blobs past the grace period are deleted, variants included.
+    """
+    db_session_for_test.add_all(
+        [
+            ProductImageBlob(
+                blob_name="orphan.png",
+                ref_count=0,
+                size_bytes=10,
+                content_type="image/png",
+                unreferenced_at=datetime.now(timezone.utc) - timedelta(days=30),
+            ),
+            ProductImageBlob(
+                blob_name="in-use.png",
+                ref_count=1,
+                size_bytes=10,
+                content_type="image/png",
+            ),
+        ]
+    )
+    db_session_for_test.commit()
+    db_session_for_test.expunge_all()
+    mock_service_client, _ = _mock_storage_client()
+    mock_container_client = mock_service_client.get_container_client.return_value
+
+    with patch("app.storage.image_storage", AzureBlobStorage(mock_service_client)):
+        response = client.post("/images/gc")
+
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 1}
+    deleted_names = mock_container_client.delete_blobs.call_args.args
+    assert set(deleted_names) == {
+        "orphan.png",
+        "orphan_thumb.webp",
+        "orphan_card.webp",
+        "orphan_full.webp",
+    }
+    assert db_session_for_test.get(ProductImageBlob, "orphan.png") is None
+    assert db_session_for_test.get(ProductImageBlob, "in-use.png") is not None
+
+
+def test_uploaded_image_is_persisted_as_blob_name_and_signed_on_read(
+    client: TestClient, db_session_for_test: Session
+):
+    """
+    Tests that only the blob name is stored, and a signed URL is produced on read.
+    """
+    product_id = client.post(
+        "/products/",
+        json={"name": "Signed Image Product", "price": 4.0, "stock_quantity": 2},
+    ).json()["product_id"]
+    mock_service_client, _ = _mock_storage_client()
+
+    with patch("app.storage.image_storage", AzureBlobStorage(mock_service_client)):
+        client.post(
+            f"/products/{product_id}/upload-image",
+            files={"file": ("signed.png", b"signed image", "image/png")},
+        )
+
+        db_product = db_session_for_test.get(Product, product_id)
+        assert db_product.image_url is None
+        assert db_product.image_blob_name.endswith(".png")
+
+        response = client.get(f"/products/{product_id}")
+    assert response.json()["image_url"] == (
+        "https://testaccount.blob.core.windows.net/product-images/"
+        f"{db_product.image_blob_name}?sv=2021-08-01&st=2024-01-01T00%3A00%3A00Z"
+        "&se=2024-01-01T01%3A00%3A00Z&sr=b&sp=r&sig=mock_sas_token"
+    )
+    assert "image_blob_name" not in response.json()
+
+
+def test_signed_url_cache_signs_once_per_blob_and_bucket():
+    """
+    Tests that signatures are reused within a bucket and renewed in the next one,
+    with an expiry that outlives the bucket.
+    """
+    sign = MagicMock(
+        side_effect=lambda blob_name, expiry: f"{blob_name}@{expiry.timestamp():.0f}"
+    )
+    cache = SignedUrlCache(
+        sign, bucket_seconds=60, validity_seconds=3600, max_entries=10
+    )
+
+    first = cache.get("a.png", now=120)
+    assert cache.get("a.png", now=179) == first
+    assert sign.call_count == 1
+    assert first == "a.png@3780"  # End of bucket (180) + validity (3600)
+
+    assert cache.get("a.png", now=180) == "a.png@3840"
+    assert sign.call_count == 2
+
+
+def test_local_storage_upload_and_serve_with_range_and_etag(
+    client: TestClient, db_session_for_test: Session, tmp_path
+):
+    """
+    Tests that the local backend stores uploads on disk and that GET /images serves
+    them with a content-hash ETag, conditional requests and byte ranges.
+    """
+    product_id = client.post(
+        "/products/",
+        json={"name": "Local Image Product", "price": 6.0, "stock_quantity": 1},
+    ).json()["product_id"]
+    payload = b"local image bytes 0123456789"
+    digest = hashlib.sha256(payload).hexdigest()
+    storage = LocalBlobStorage(str(tmp_path), public_base_url="http://testserver")
+
+    with patch("app.storage.image_storage", storage):
+        response = client.post(
+            f"/products/{product_id}/upload-image",
+            files={"file": ("local.png", payload, "image/png")},
+        )
+        assert response.status_code == 200
+        image_url = response.json()["image_url"]
+        assert image_url == f"http://testserver/images/{digest}.png"
+        assert (tmp_path / f"{digest}.png").read_bytes() == payload
+
+        full = client.get(image_url)
+        assert full.status_code == 200
+        assert full.content == payload
+        assert full.headers["etag"] == f'"{digest}"'
+        assert full.headers["content-type"] == "image/png"
+
+        not_modified = client.get(image_url, headers={"If-None-Match": f'"{digest}"'})
+        assert not_modified.status_code == 304
+
+        partial = client.get(image_url, headers={"Range": "bytes=6-10"})
+        assert partial.status_code == 206
+        assert partial.content == payload[6:11]
+        assert partial.headers["content-range"] == f"bytes 6-10/{len(payload)}"
+
+        suffix = client.get(image_url, headers={"Range": "bytes=-4"})
+        assert suffix.content == payload[-4:]
+
+        unsatisfiable = client.get(image_url, headers={"Range": "bytes=1000-"})
+        assert unsatisfiable.status_code == 416
+
+        assert client.get("/images/missing.png").status_code == 404
+        assert client.get("/images/..%2Fsecret").status_code == 404
+
+
+def test_local_storage_upload_does_its_file_io_on_the_upload_pool(tmp_path):
+    """Tests that a local upload opens, writes, renames and cleans up files off the event loop."""
+    from app import storage as storage_module
+
+    storage = LocalBlobStorage(str(tmp_path))
+    offloaded = []
+    run_blocking = storage_module.run_blocking
+
+    async def recording_run_blocking(func, *args, **kwargs):
+        offloaded.append(func.__name__)
+        return await run_blocking(func, *args, **kwargs)
+
+    upload = MagicMock()
+    upload.read = AsyncMock(side_effect=[b"abc", b"def", b""])
+    with patch("app.storage.run_blocking", recording_run_blocking):
+        assert asyncio.run(storage.upload_file("a.bin", upload, "application/octet-stream")) == 6
+        assert offloaded == ["open", "write", "write", "close", "replace"]
+        assert (tmp_path / "a.bin").read_bytes() == b"abcdef"
+
+        offloaded.clear()
+        upload.read = AsyncMock(side_effect=[b"abc", OSError("client went away")])
+        with pytest.raises(OSError):
+            asyncio.run(storage.upload_file("b.bin", upload, "application/octet-stream"))
+        assert offloaded == ["open", "write", "close", "_discard"]
+        assert not (tmp_path / "b.bin").exists()
+        assert os.listdir(tmp_path / ".incoming") == []
+
+
+def test_disk_blob_cache_downloads_once_and_evicts_least_recently_used(tmp_path):
+    """
+    Tests that concurrent misses share one download and that the cache stays
+    within its byte budget by evicting the least recently used blob.
+    """
+    remote = LocalBlobStorage(str(tmp_path / "remote"))
+    for name in ("a.png", "b.png", "c.png"):
+        remote.put_bytes(name, b"x" * 10, "image/png")
+    cache = DiskBlobCache(str(tmp_path / "cache"), max_bytes=20)
+
+    async def exercise_cache():
+        with patch.object(
+            remote, "download_to_file", wraps=remote.download_to_file
+        ) as download:
+            paths = await asyncio.gather(
+                *(cache.get_path(remote, "a.png") for _ in range(5))
+            )
+            assert len(set(paths)) == 1
+            assert download.call_count == 1
+
+            await cache.get_path(remote, "b.png")
+            await cache.get_path(remote, "a.png")  # Hit: a becomes most recent
+            await cache.get_path(remote, "c.png")  # Evicts b
+            assert download.call_count == 3
+            assert await cache.get_path(remote, "missing.png") is None
+
+    asyncio.run(exercise_cache())
+    assert sorted(p.name for p in (tmp_path / "cache").glob("*.png")) == [
+        "a.png",
+        "c.png",
+    ]
+
+
+def _wait_for_bulk_job(client: TestClient, job_id: str) -> dict:
+    for _ in range(100):
+        job = client.get(f"/products/images/bulk/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"Bulk image job {job_id} did not finish")
+
+
+def test_bulk_image_upload_reports_per_item_results(
+    client: TestClient, db_session_for_test: Session, tmp_path
+):
+    """
+    Tests that an archive is ingested as a background job: file names map to
+    product IDs, identical bytes are stored once, and every entry is reported.
+    """
+    product_ids = [
+        client.post(
+            "/products/",
+            json={"name": f"Bulk Product {i}", "price": 2.0, "stock_quantity": 1},
+        ).json()["product_id"]
+        for i in range(2)
+    ]
+    shared = b"shared catalog image"
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr(f"catalog/{product_ids[0]}.png", shared)
+        zf.writestr(f"catalog/{product_ids[1]}.png", shared)
+        zf.writestr("catalog/999999.png", b"no such product")
+        zf.writestr("catalog/notes.txt", b"not an image")
+        zf.writestr("__MACOSX/catalog/._1.png", b"metadata")
+    storage = LocalBlobStorage(str(tmp_path))
+
+    with patch("app.storage.image_storage", storage):
+        response = client.post(
+            "/products/images/bulk",
+            files={"file": ("catalog.zip", archive.getvalue(), "application/zip")},
+        )
+        assert response.status_code == 202
+        job = _wait_for_bulk_job(client, response.json()["job_id"])
+
+    assert job["status"] == "completed"
+    assert (job["entries_seen"], job["succeeded"], job["failed"], job["skipped"]) == (
+        4,
+        2,
+        1,
+        1,
+    )
+    results = {result["file"]: result for result in job["results"]}
+    assert results["catalog/999999.png"]["detail"] == "Product not found."
+    assert results["catalog/notes.txt"]["status"] == "skipped"
+
+    blob_name = hashlib.sha256(shared).hexdigest() + ".png"
+    assert sorted(p.name for p in tmp_path.glob("*.png")) == sorted(
+        [blob_name, hashlib.sha256(b"no such product").hexdigest() + ".png"]
+    )
+    for product_id in product_ids:
+        assert db_session_for_test.get(Product, product_id).image_blob_name == blob_name
+    assert db_session_for_test.get(ProductImageBlob, blob_name).ref_count == 2
+
+    bad_manifest = client.post(
+        "/products/images/bulk",
+        files={"file": ("catalog.zip", archive.getvalue(), "application/zip")},
+        data={"manifest": "[1, 2]"},
+    )
+    assert bad_manifest.status_code == 400
+
+
+def test_storage_initialization_times_out_and_retries_in_background(tmp_path):
+    """
+    Tests that a hanging or failing storage check is bounded by the timeout and
+    retried until the backend becomes available.
+    """
+    storage = LocalBlobStorage(str(tmp_path))
+    attempts = []
+
+    def flaky_ensure_ready():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            time.sleep(0.5)  # Hangs past the timeout
+        elif len(attempts) == 2:
+            raise ConnectionError("storage unreachable")
+
+    storage.ensure_ready = flaky_ensure_ready
+    with patch("app.storage.image_storage", storage):
+        asyncio.run(initialize_image_storage(timeout_seconds=0.1, retry_seconds=0.01))
+
+    assert len(attempts) == 3
+    assert storage.status == "available"
+    assert storage.last_error is None
+
+
+def test_readiness_reports_storage_status(client: TestClient, tmp_path):
+    """
+    Tests that readiness reports image storage, and only fails on it when required.
+    """
+    storage = LocalBlobStorage(str(tmp_path))
+    storage.status = "unavailable"
+    storage.last_error = "storage unreachable"
+
+    with patch("app.storage.image_storage", storage):
+        response = client.get("/health/ready")
+        assert response.status_code == 200
+        assert response.json()["checks"] == {
+            "database": "available",
+            "storage": "unavailable",
+        }
+        assert response.json()["storage_error"] == "storage unreachable"
+
+        with patch("app.main.READINESS_REQUIRES_STORAGE", True):
+            assert client.get("/health/ready").status_code == 503
+
+
+def test_order_placed_consumer_deducts_stock_on_its_own_pool(
+    db_session_for_test: Session,
+):
+    """The order.placed consumer commits through the consumer engine and records its timing."""
+    from app.db import consumer_engine
+    from app.metrics import registry
+    from prometheus_client import generate_latest
+
+    product = Product(name="Consumer Widget", price=5.0, stock_quantity=10)
+    db_session_for_test.add(product)
+    db_session_for_test.commit()
+
+    class FakeMessage:
+        def __init__(self, data):
+            self.body = json.dumps(data).encode("utf-8")
+
+        def process(self):
+            return contextlib.nullcontext()
+
+    class FakeQueue:
+        bind = AsyncMock()
+
+        @contextlib.asynccontextmanager
+        async def iterator(self):
+            async def messages():
+                yield FakeMessage(
+                    {"order_id": 7, "items": [{"product_id": product.product_id, "quantity": 3}]}
+                )
+
+            yield messages()
+
+    channel = MagicMock()
+    channel.set_qos = AsyncMock()
+    channel.declare_queue = AsyncMock(return_value=FakeQueue())
+
+    async def consume():
+        try:
+            await consume_order_placed_events()
+        finally:
+            await consumer_engine.dispose()
+
+    with patch("app.main.rabbitmq_channel", channel), patch(
+        "app.main.rabbitmq_exchange", MagicMock()
+    ), patch("app.main.publish_event", AsyncMock()) as mock_publish:
+        asyncio.run(consume())
+
+    channel.set_qos.assert_awaited_once()
+    assert mock_publish.await_args.args[0] == "product.stock.deducted"
+    db_session_for_test.expire_all()
+    assert db_session_for_test.get(Product, product.product_id).stock_quantity == 7
+
+    metrics_text = generate_latest(registry).decode()
+    assert (
+        'product_order_consumer_duration_seconds_count{app_name="product_service",outcome="deducted"} 1.0'
+        in metrics_text
+    )
+    assert 'product_order_consumer_in_flight_messages{app_name="product_service"} 0.0' in metrics_text
+
+
+def test_reads_use_replica_until_it_lags_and_writes_return_consistency_token(
+    client: TestClient, db_session_for_test: Session
+):
+    """
+    Tests replica routing with the primary standing in for the replica: a write
+    returns a WAL token, a read carrying it is served by the replica, and reads go
+    back to the primary once the replica lags.
+    """
+    from app import db as app_db
+    from app.metrics import registry
+    from prometheus_client import generate_latest
+
+    replica_status = app_db.ReplicaStatus(app_db.engine)
+    with patch("app.db.replica_status", replica_status), patch(
+        "app.main.replica_status", replica_status
+    ), patch("app.db.ReadSessionLocal", app_db.SessionLocal), patch(
+        "app.db.REPLICA_STATUS_TTL_SECONDS", 60
+    ):
+        create_response = client.post(
+            "/products/", json={"name": "Replica Widget", "price": 3.0, "stock_quantity": 1}
+        )
+        token = create_response.headers["X-DB-Consistency-Token"]
+        product_id = create_response.json()["product_id"]
+
+        response = client.get(
+            f"/products/{product_id}", headers={"X-DB-Consistency-Token": token}
+        )
+        assert response.status_code == 200
+        assert replica_status.replay_lsn >= app_db.parse_lsn(token)
+
+        replica_status.lag_seconds = 3600.0
+        assert client.get(f"/products/{product_id}").status_code == 200
+
+    metrics_text = generate_latest(registry).decode()
+    assert (
+        'db_read_routing_total{app_name="product_service",reason="ok",target="replica"} 1.0'
+        in metrics_text
+    )
+    assert (
+        'db_read_routing_total{app_name="product_service",reason="replica_lagging",target="primary"} 1.0'
+        in metrics_text
+    )
+
+
+def test_catalog_import_upserts_csv_and_ndjson_and_export_round_trips(
+    client: TestClient, db_session_for_test: Session
+):
+    """COPY-based import updates rows by product_id, creates the rest, and export replays as the same catalog."""
+    existing = client.post(
+        "/products/", json={"name": "Old Name", "price": 1.00, "stock_quantity": 1}
+    ).json()
+
+    csv_body = (
+        "product_id,name,price,stock_quantity,description\n"
+        f"{existing['product_id']},Renamed,2.50,7,\"Quoted, with comma\"\n"
+        "42,Explicit Id,3.00,,\n"
+        ",Fresh Product,4.00,9,\n"
+    )
+    response = client.post("/products/import?format=csv", content=csv_body)
+    assert response.status_code == 200
+    assert response.json()["rows_staged"] == 3
+    assert response.json()["rows_upserted"] == 3
+    assert response.json()["rows_per_second"] > 0
+
+    ndjson_body = '{"name": "From JSON", "price": 5.5, "description": "back\\\\slash \\"quote\\""}\n\n'
+    response = client.post("/products/import?format=ndjson", content=ndjson_body)
+    assert response.status_code == 200
+    assert response.json()["rows_upserted"] == 1
+
+    products = {p.name: p for p in db_session_for_test.query(Product).all()}
+    assert products["Renamed"].product_id == existing["product_id"]
+    assert products["Renamed"].stock_quantity == 7
+    assert products["Renamed"].description == "Quoted, with comma"
+    assert products["Explicit Id"].product_id == 42
+    assert products["Explicit Id"].stock_quantity == 0
+    # New rows get ids past the explicitly imported one
+    assert products["Fresh Product"].product_id > 42
+    assert products["From JSON"].description == 'back\\slash "quote"'
+
+    exported_csv = client.get("/products/export?format=csv")
+    assert exported_csv.status_code == 200
+    assert exported_csv.headers["content-type"].startswith("text/csv")
+    assert exported_csv.text.splitlines()[0] == (
+        "product_id,name,description,price,stock_quantity,image_url"
+    )
+    assert len(exported_csv.text.splitlines()) == 5
+
+    exported_ndjson = client.get("/products/export?format=ndjson")
+    exported_rows = [json.loads(line) for line in exported_ndjson.text.splitlines()]
+    assert [row["name"] for row in exported_rows] == [
+        "Renamed", "Explicit Id", "Fresh Product", "From JSON"
+    ]
+    assert exported_rows[-1]["description"] == 'back\\slash "quote"'
+
+    # Importing an export back changes nothing but updated_at
+    response = client.post("/products/import?format=ndjson", content=exported_ndjson.content)
+    assert response.json()["rows_upserted"] == 4
+    assert client.get("/products/export?format=ndjson").content == exported_ndjson.content
+    assert 'product_catalog_copy_rows_total{app_name="product_service",direction="export"}' in (
+        client.get("/metrics").text
+    )
+
+
+def test_catalog_import_rejects_bad_files_without_partial_writes(
+    client: TestClient, db_session_for_test: Session
+):
+    """Unknown columns, unparseable values and duplicate ids fail with 400 and roll the whole file back."""
+    response = client.post("/products/import", content="name,colour\nShirt,red\n")
+    assert response.status_code == 400
+    assert "colour" in response.json()["detail"]
+
+    response = client.post(
+        "/products/import", content="name,price\nGood,1.00\nBad,not-a-price\n"
+    )
+    assert response.status_code == 400
+
+    response = client.post(
+        "/products/import", content="product_id,name,price\n5,A,1\n5,B,2\n"
+    )
+    assert response.status_code == 400
+    assert db_session_for_test.query(Product).count() == 0
@@ -67,7 +67,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 productCard.className = 'product-card';
                 
                 productCard.innerHTML = `
-                    <img src="${product.image_url || 'https://placehold.co/300x200/cccccc/333333?text=No+Image'}" alt="${product.name}" onerror="this.onerror=null;this.src='https://placehold.co/300x200/cccccc/333333?text=Image+Error';" />
+                    <img src="${(product.image_variants && product.image_variants.card) || product.image_url || 'https://placehold.co/300x200/cccccc/333333?text=No+Image'}" alt="${product.name}" onerror="this.onerror=null;this.src='https://placehold.co/300x200/cccccc/333333?text=Image+Error';" />
                     <h3>${product.name} (ID: ${product.product_id})</h3>
                     <p>${product.description || 'No description available.'}</p>
                     <p class="price">${formatCurrency(product.price)}</p>